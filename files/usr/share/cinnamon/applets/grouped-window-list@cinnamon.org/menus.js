@@ -2,6 +2,7 @@ const Clutter = imports.gi.Clutter;
 const Meta = imports.gi.Meta;
 const St = imports.gi.St;
 const Gio = imports.gi.Gio;
+const GLib = imports.gi.GLib;
 const AppletManager = imports.ui.appletManager;
 const Main = imports.ui.main;
 const Tweener = imports.ui.tweener;
@@ -9,7 +10,7 @@ const PopupMenu = imports.ui.popupMenu;
 const Applet = imports.ui.applet;
 const SignalManager = imports.misc.signalManager;
 
-const {each, findIndex, tryFn, unref, trySpawnCommandLine, spawn_async} = imports.misc.util;
+const {each, findIndex, tryFn, unref, trySpawnCommandLine} = imports.misc.util;
 const {
     CLOSE_BTN_SIZE,
     CLOSED_BUTTON_STYLE,
@@ -20,6 +21,44 @@ const {
     autoStartStrDir
 } = require('./constants');
 
+// Desktop files for window backed apps are made by the helper service in utils.py, started by D-Bus
+// when it's first needed. Requests made close together are sent to it as one batch.
+const HELPER_BUS_NAME = 'org.Cinnamon.GroupedWindowListHelper';
+const HELPER_PATH = '/org/Cinnamon/GroupedWindowListHelper';
+const HELPER_BATCH_DELAY = 50;
+let desktopFileRequests = [];
+
+const requestDesktopFile = function(pid, callback) {
+    desktopFileRequests.push({pid, callback});
+    if (desktopFileRequests.length > 1) return;
+
+    setTimeout(() => {
+        let requests = desktopFileRequests;
+        desktopFileRequests = [];
+        Gio.DBus.session.call(
+            HELPER_BUS_NAME,
+            HELPER_PATH,
+            HELPER_BUS_NAME,
+            'GetDesktopFiles',
+            new GLib.Variant('(au)', [requests.map((request) => request.pid)]),
+            new GLib.VariantType('(as)'),
+            Gio.DBusCallFlags.NONE,
+            -1,
+            null,
+            (connection, result) => {
+                let desktopFiles;
+                try {
+                    [desktopFiles] = connection.call_finish(result).deep_unpack();
+                } catch (e) {
+                    global.logError('Could not create a desktop file: ' + e.message);
+                    return;
+                }
+                each(requests, (request, i) => request.callback(desktopFiles[i]));
+            }
+        );
+    }, HELPER_BATCH_DELAY);
+};
+
 const convertRange = function(value, r1, r2) {
     return ((value - r1[0]) * (r2[1] - r2[0])) / (r1[1] - r1[0]) + r2[0];
 };
@@ -427,15 +466,10 @@ class AppMenuButtonRightClickMenu extends Applet.AppletPopupMenu {
 
     createShortcut() {
         let proc = this.groupState.lastFocused.get_pid();
-        let cmd = [
-            'bash',
-            '-c',
-            'python3 /usr/share/cinnamon/applets/grouped-window-list@cinnamon.org/utils.py get_process ' + proc.toString()
-        ];
-        spawn_async(cmd, (stdout) => {
-            if (stdout) {
+        requestDesktopFile(proc, (desktopFile) => {
+            if (desktopFile) {
                 setTimeout(() => {
-                    this.state.trigger('addFavorite', {appId: stdout.trim(), app: null, pos: -1});
+                    this.state.trigger('addFavorite', {appId: desktopFile, app: null, pos: -1});
                     this.state.trigger('refreshCurrentAppList');
                 }, 2000);
             }
@@ -1,112 +1,238 @@
 #!/usr/bin/python3
 
-import subprocess
 import os
-import json
+import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-CLI = sys.argv
+from gi.repository import Gio, GLib
 
-def parse_args(command):
-    return command.split(' ')
+CLI = sys.argv
 
-def spawn(command):
+# The applet asks the helper service for desktop files over D-Bus, it's started on demand and quits
+# once it has been idle for HELPER_IDLE_TIMEOUT seconds.
+HELPER_BUS_NAME = 'org.Cinnamon.GroupedWindowListHelper'
+HELPER_PATH = '/org/Cinnamon/GroupedWindowListHelper'
+HELPER_INTERFACE = '''
+<node>
+  <interface name="org.Cinnamon.GroupedWindowListHelper">
+    <method name="GetDesktopFiles">
+      <arg type="au" name="pids" direction="in"/>
+      <arg type="as" name="desktop_files" direction="out"/>
+    </method>
+  </interface>
+</node>
+'''
+HELPER_IDLE_TIMEOUT = 60
+
+# Icons are extracted one at a time, and at most this many wait for their turn. Desktop files
+# made while the queue is full don't get an icon.
+ICON_QUEUE_SIZE = 8
+ICON_TIMEOUT = 10
+
+
+def read_cmdline(pid):
     try:
-        process = subprocess.run(
-            parse_args(command),
-            stdout=subprocess.PIPE,
-            check=True
-        )
-    except Exception:
-        raise subprocess.CalledProcessError(1, command)
-    out = process.stdout.decode('utf-8')
-    return out
-
-# Utility script that creates GDesktop files for Wine and other window backed applications.
-def handle_cli():
-
-    if CLI[1] == 'get_process':
-        process = spawn('cat /proc/{}/cmdline'.format(CLI[2]))
+        with open('/proc/{}/cmdline'.format(pid), 'rb') as f:
+            return f.read().decode('utf-8', errors='replace')
+    except OSError:
+        return None
 
-        if '.exe' in process:
-            if 'Z:' in process:
-                process = process.split('Z:')[1]
+def get_process_command(cmdline):
+    """ turns the NUL separated command line of a window's process into something to launch it with"""
+    process = cmdline
 
-            process = process.replace('\\', '/')
-            process = process.split('.exe')[0] + '.exe'
-            process = 'wine '+process.replace(' ', r'\ ')
+    if '.exe' in process:
+        if 'Z:' in process:
+            process = process.split('Z:')[1]
 
-        process = json.dumps(process)
-        if '\\u0000' in process:
-            process = process.replace('\\u0000', ' ')
-        process = json.loads(process)
+        process = process.replace('\\', '/')
+        process = process.split('.exe')[0] + '.exe'
+        process = 'wine '+process.replace(' ', r'\ ')
 
-        if not '.exe' in process:
-            process = process[:-1]
+    process = process.replace('\0', ' ')
 
-        if process == 'python mainwindow.py':
-            process = 'playonlinux'
+    if not '.exe' in process:
+        process = process[:-1]
 
-        try:
-            proc_array = process.split('/')
-            pa_len = len(proc_array)
-            process_name = proc_array[pa_len - 1].title()
+    if process == 'python mainwindow.py':
+        process = 'playonlinux'
 
-            # Since this is a window backed app, make sure it has an icon association.
+    return process
 
-            icons_dir = '{}/.local/share/icons/hicolor/48x48/apps/'.format(os.getenv('HOME'))
+def get_process_name(process):
+    process_name = process.split('/')[-1].title()
 
-            if '\\ ' in process_name:
-                process_name = process_name.replace('\\ ', ' ')
+    if '\\ ' in process_name:
+        process_name = process_name.replace('\\ ', ' ')
 
-            if '.Exe' in process_name:
-                process_name = process_name.replace('.Exe', '')
+    if '.Exe' in process_name:
+        process_name = process_name.replace('.Exe', '')
 
-            icon_file = process_name+'.png'
+    return process_name
 
-            if ' ' in icon_file:
-                icon_file = icon_file.replace(' ', '')
 
-            icon = icons_dir+icon_file
+# Utility for creating GDesktop files for Wine and other window backed applications.
+class DesktopFileMaker(object):
+    def __init__(self, icon_queue_size=ICON_QUEUE_SIZE):
+        self.home = os.getenv('HOME')
+        self.icons_dir = '{}/.local/share/icons/hicolor/48x48/apps/'.format(self.home)
+        self.applications_dir = '{}/.local/share/applications/'.format(self.home)
 
-            try:
-                try:
-                    spawn('gnome-exe-thumbnailer {} {}'.format(process.split('wine ')[1], icon))
-                except IndexError:
-                    spawn('gnome-exe-thumbnailer {} {}'.format(process, icon))
-            except subprocess.CalledProcessError:
-                icon = None
+        # launch command -> desktop file name
+        self.desktop_files = {}
 
-            g_menu = '[Desktop Entry]\n' \
-                     'Type=Application\n' \
-                     'Encoding=UTF-8\n' \
-                     'Name={}\n' \
-                     'Comment={}\n' \
-                     'Exec={}\n' \
-                     'Terminal=false\n' \
-                     'StartupNotify=true\n'.format(process_name, process_name, process)
+        self.icon_queue_size = icon_queue_size
+        self.icon_executor = ThreadPoolExecutor(max_workers=1)
+        self.icon_jobs = 0
+        self.icon_lock = threading.Lock()
 
-            if icon:
-                g_menu += 'Icon={}\n'.format(icon)
+    def is_busy(self):
+        with self.icon_lock:
+            return self.icon_jobs > 0
 
+    def get_desktop_file(self, pid):
+        """ returns the name of the desktop file for the process, making it if needed, or None"""
+        cmdline = read_cmdline(pid)
+        if not cmdline:
+            return None
 
-            if '.exe' in process:
-                g_menu += 'GenericName=Wine application\n' \
-                          'Categories=Wine;\n' \
-                          'MimeType=application/x-ms-dos-executable;' \
-                          'application/x-msi;application/x-ms-shortcut; \n' \
+        process = get_process_command(cmdline)
+        desktop_file = self.desktop_files.get(process)
+        if desktop_file is not None and os.path.exists(self.applications_dir + desktop_file):
+            return desktop_file
 
-            desktop_file = '{}.cinnamon-generated.desktop'.format(process_name)
-            desktop_path = '{}/.local/share/applications/{}'.format(os.getenv('HOME'), desktop_file)
+        try:
+            desktop_file = self.make_desktop_file(process)
+        except OSError as err:
+            print(err)
+            return None
+
+        self.desktop_files[process] = desktop_file
+        return desktop_file
+
+    def make_desktop_file(self, process):
+        process_name = get_process_name(process)
+        icon = self.icons_dir + process_name.replace(' ', '') + '.png'
+        desktop_file = '{}.cinnamon-generated.desktop'.format(process_name)
+
+        # Since this is a window backed app, make sure it has an icon association. The desktop file is
+        # written again with it once it's extracted.
+        if os.path.exists(icon):
+            self.write_desktop_file(desktop_file, process, process_name, icon)
+        else:
+            self.write_desktop_file(desktop_file, process, process_name, None)
+            self.queue_icon(desktop_file, process, process_name, icon)
+
+        return desktop_file
+
+    def write_desktop_file(self, desktop_file, process, process_name, icon):
+        g_menu = '[Desktop Entry]\n' \
+                 'Type=Application\n' \
+                 'Encoding=UTF-8\n' \
+                 'Name={}\n' \
+                 'Comment={}\n' \
+                 'Exec={}\n' \
+                 'Terminal=false\n' \
+                 'StartupNotify=true\n'.format(process_name, process_name, process)
+
+        if icon:
+            g_menu += 'Icon={}\n'.format(icon)
 
-            with open(desktop_path, 'w', encoding='utf-8') as desktop:
-                print(g_menu)
-                desktop.write(g_menu)
-                spawn('chmod +x {}'.format(desktop_path))
-                print(desktop_file)
+        if '.exe' in process:
+            g_menu += 'GenericName=Wine application\n' \
+                      'Categories=Wine;\n' \
+                      'MimeType=application/x-ms-dos-executable;' \
+                      'application/x-msi;application/x-ms-shortcut; \n' \
+
+        desktop_path = self.applications_dir + desktop_file
+        os.makedirs(self.applications_dir, exist_ok=True)
+        with open(desktop_path + '.tmp', 'w', encoding='utf-8') as desktop:
+            desktop.write(g_menu)
+        os.chmod(desktop_path + '.tmp', 0o755)
+        os.replace(desktop_path + '.tmp', desktop_path)
+
+    def queue_icon(self, desktop_file, process, process_name, icon):
+        with self.icon_lock:
+            if self.icon_jobs >= self.icon_queue_size:
+                return
+            self.icon_jobs += 1
+        self.icon_executor.submit(self.make_icon, desktop_file, process, process_name, icon)
+
+    def make_icon(self, desktop_file, process, process_name, icon):
+        try:
+            executable = process.split('wine ')[1] if process.startswith('wine ') else process
+            os.makedirs(self.icons_dir, exist_ok=True)
+            subprocess.run(['gnome-exe-thumbnailer', executable.replace('\\ ', ' '), icon],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           timeout=ICON_TIMEOUT, check=True)
+            if os.path.exists(icon):
+                self.write_desktop_file(desktop_file, process, process_name, icon)
+        except (OSError, subprocess.SubprocessError):
+            pass
+        finally:
+            with self.icon_lock:
+                self.icon_jobs -= 1
+
+
+class HelperService(object):
+    def __init__(self):
+        self.maker = DesktopFileMaker()
+        self.loop = GLib.MainLoop()
+        self.node_info = Gio.DBusNodeInfo.new_for_xml(HELPER_INTERFACE)
+        self.idle_id = 0
+
+        Gio.bus_own_name(Gio.BusType.SESSION, HELPER_BUS_NAME, Gio.BusNameOwnerFlags.NONE,
+                         self.on_bus_acquired, None, self.on_name_lost)
+
+    def run(self):
+        self.reset_idle_timeout()
+        self.loop.run()
+
+    def on_bus_acquired(self, connection, name):
+        connection.register_object(HELPER_PATH, self.node_info.interfaces[0], self.on_method_call, None, None)
+
+    def on_name_lost(self, connection, name):
+        self.loop.quit()
+
+    def on_method_call(self, connection, sender, path, interface, method, parameters, invocation):
+        if method == 'GetDesktopFiles':
+            # All the pids of a batch are resolved in one go, "" stands for the ones that couldn't be
+            (pids,) = parameters.unpack()
+            desktop_files = [self.maker.get_desktop_file(pid) or '' for pid in pids]
+            invocation.return_value(GLib.Variant('(as)', (desktop_files,)))
+        self.reset_idle_timeout()
+
+    def reset_idle_timeout(self):
+        if self.idle_id > 0:
+            GLib.source_remove(self.idle_id)
+        self.idle_id = GLib.timeout_add_seconds(HELPER_IDLE_TIMEOUT, self.on_idle_timeout)
+
+    def on_idle_timeout(self):
+        self.idle_id = 0
+        if self.maker.is_busy():
+            # icons are still being extracted
+            self.reset_idle_timeout()
+        else:
+            self.loop.quit()
+        return False
 
-        except KeyError as err:
-            print(err)
-            return
 
-handle_cli()
+def handle_cli():
+    if len(CLI) > 1 and CLI[1] == 'service':
+        HelperService().run()
+
+    elif len(CLI) > 2 and CLI[1] == 'get_process':
+        maker = DesktopFileMaker()
+        for pid in CLI[2:]:
+            print(maker.get_desktop_file(pid) or '')
+        # wait for the icons
+        maker.icon_executor.shutdown(wait=True)
+
+    else:
+        print('Usage: {} service | get_process PID...'.format(CLI[0]))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    handle_cli()
@@ -1,5 +1,6 @@
 const Lang = imports.lang;
 const Gio = imports.gi.Gio;
+const GLib = imports.gi.GLib;
 const St = imports.gi.St;
 const Main = imports.ui.main;
 const Applet = imports.ui.applet;
@@ -12,6 +13,7 @@ class CinnamonSlideshowApplet extends Applet.IconApplet {
 
         this._slideshowSettings = new Gio.Settings({ schema_id: "org.cinnamon.desktop.background.slideshow" });
         this._backgroundSettings = new Gio.Settings({ schema_id: "org.cinnamon.desktop.background" });
+        this._sourceSettings = new Gio.Settings({ schema_id: "org.cinnamon.background" });
 
         if (this._slideshowSettings.get_boolean("slideshow-enabled")) {
             if (!this._slideshowSettings.get_boolean("slideshow-paused")) {
@@ -114,7 +116,13 @@ class CinnamonSlideshowApplet extends Applet.IconApplet {
     
 
     _update_background_name() {
-        const file = decodeURIComponent(this._backgroundSettings.get_string("picture-uri") || "");
+        let uri = this._backgroundSettings.get_string("picture-uri") || "";
+        // The slideshow may show a copy of the picture that was scaled down for the screen
+        let renderDir = GLib.build_filenamev([GLib.get_user_data_dir(), "cinnamon-slideshow", "renders"]);
+        let path = uri.startsWith("file://") ? Gio.File.new_for_uri(uri).get_path() : null;
+        if (path && GLib.path_get_dirname(path) == renderDir)
+            uri = this._sourceSettings.get_string("slideshow-source-uri") || uri;
+        const file = decodeURIComponent(uri);
         const background = file.split("/").pop();
         this._current_background_menu.label.set_text(_("Current background: ") + background);
     }
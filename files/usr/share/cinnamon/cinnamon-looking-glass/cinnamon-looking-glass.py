@@ -13,16 +13,17 @@
 #   - auto-completion ?
 
 import os
+import re
 import signal
 import sys
 import dbus
 import dbus.service
 from dbus.mainloop.glib import DBusGMainLoop
-import pyinotify
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gio, Gtk, GObject, Gdk, GLib
 from setproctitle import setproctitle
+from collections import deque
 
 import pageutils
 from lookingglass_proxy import LookingGlassProxy
@@ -32,6 +33,12 @@ signal.signal(signal.SIGINT, signal.SIG_DFL)
 MELANGE_DBUS_NAME = "org.Cinnamon.Melange"
 MELANGE_DBUS_PATH = "/org/Cinnamon/Melange"
 
+# A file watcher shows (at most) the last FILE_WATCHER_MAX_LINES lines of the file. When it's opened,
+# no more than FILE_TAIL_MAX_SIZE bytes from the end are read to find them
+FILE_WATCHER_MAX_LINES = 10000
+FILE_TAIL_MAX_SIZE = 4 * 1024 * 1024
+FILE_TAIL_BLOCK_SIZE = 64 * 1024
+
 class MenuButton(Gtk.Button):
     def __init__(self, text):
         Gtk.Button.__init__(self, text)
@@ -215,76 +222,196 @@ class NewLogDialog(Gtk.Dialog):
 
         return result
 
-class FileWatchHandler(pyinotify.ProcessEvent):
-    def my_init(self, view):
-        self.view = view
-
-    def process_IN_CLOSE_WRITE(self, event):
-        self.view.get_updates()
-
-    def process_IN_CREATE(self, event):
-        self.view.get_updates()
-
-    def process_IN_DELETE(self, event):
-        self.view.get_updates()
-
-    def process_IN_MODIFY(self, event):
-        self.view.get_updates()
-
-class FileWatcherView(Gtk.ScrolledWindow):
+class FileTail():
+    """ reads what's been added to a file since the last time. The file is reopened if it's replaced
+        (e.g. rotated), and read from the start again if it's truncated"""
+    def __init__(self, filename, max_lines):
+        self.filename = filename
+        self.max_lines = max_lines
+        self.file = None
+        self.file_id = None
+        self.offset = 0
+        self.partial = b""
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _find_start(self, size):
+        # Only the last max_lines lines of the file are read when it's opened, they're found by
+        # going back from the end a block at a time
+        position = size
+        newlines = 0
+        while position > 0 and size - position < FILE_TAIL_MAX_SIZE:
+            block_size = min(FILE_TAIL_BLOCK_SIZE, position)
+            position -= block_size
+            self.file.seek(position)
+            block = self.file.read(block_size)
+            newlines += block.count(b"\n")
+            if newlines > self.max_lines:
+                # start right after the newline that ends the line before the ones that are wanted
+                index = -1
+                for i in range(newlines - self.max_lines):
+                    index = block.index(b"\n", index + 1)
+                return position + index + 1
+
+        if position > 0:
+            # the lines are very long, start at the first whole one
+            self.file.seek(position)
+            block = self.file.read(FILE_TAIL_BLOCK_SIZE)
+            if b"\n" in block:
+                position += block.index(b"\n") + 1
+        return position
+
+    def read(self):
+        """ returns (reset, lines): reset is True if what was read before is no longer in the file, and
+            lines are the lines added since"""
+        reset = False
+        try:
+            info = os.stat(self.filename)
+        except OSError:
+            # gone for now, it may be created again
+            self.close()
+            return (False, [])
+
+        if self.file is None or self.file_id != (info.st_dev, info.st_ino):
+            self.close()
+            try:
+                self.file = open(self.filename, "rb")
+            except OSError as exc:
+                print(exc)
+                return (False, [])
+            reset = self.file_id is not None
+            self.file_id = (info.st_dev, info.st_ino)
+            self.offset = self._find_start(info.st_size)
+            self.partial = b""
+        elif info.st_size < self.offset:
+            reset = True
+            self.offset = 0
+            self.partial = b""
+
+        self.file.seek(self.offset)
+        data = self.file.read()
+        self.offset += len(data)
+
+        # a line is only shown once it's complete
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        return (reset, [line.decode("utf-8", errors="replace") for line in lines])
+
+class FileWatcherView(Gtk.Box):
     def __init__(self, filename):
-        Gtk.ScrolledWindow.__init__(self)
+        Gtk.Box.__init__(self, orientation=Gtk.Orientation.VERTICAL)
 
         self.filename = filename
-        self.changed = 0
         self.update_id = 0
-        self.set_shadow_type(Gtk.ShadowType.ETCHED_IN)
-        self.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+
+        # The last lines of the file, the view shows them all or only those that match the filter
+        self.lines = deque(maxlen=FILE_WATCHER_MAX_LINES)
+        self.tail = FileTail(filename, FILE_WATCHER_MAX_LINES)
+        self.pattern = None
+        self.filter_lines = False
+
+        self.scrolled = Gtk.ScrolledWindow()
+        self.scrolled.set_shadow_type(Gtk.ShadowType.ETCHED_IN)
+        self.scrolled.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        self.pack_start(self.scrolled, True, True, 0)
 
         self.textview = Gtk.TextView()
         self.textview.set_editable(False)
-        self.add(self.textview)
+        self.scrolled.add(self.textview)
 
         self.textbuffer = self.textview.get_buffer()
+        self.scroll_mark = self.textbuffer.create_mark(None, self.textbuffer.get_end_iter(), False)
+        self.match_tag = self.textbuffer.create_tag("match", background="#f4e74f", foreground="#000000")
+
+        bar = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6, border_width=2)
+        self.pattern_entry = Gtk.SearchEntry()
+        self.pattern_entry.set_placeholder_text("Highlight (regular expression)")
+        self.pattern_entry.connect("search-changed", self.on_pattern_changed)
+        bar.pack_start(self.pattern_entry, True, True, 0)
+        self.filter_check = Gtk.CheckButton.new_with_label("Only show matching lines")
+        self.filter_check.connect("toggled", self.on_pattern_changed)
+        bar.pack_start(self.filter_check, False, False, 0)
+        self.pack_start(bar, False, False, 0)
 
         self.show_all()
-        self.get_updates()
+        self.update()
 
-        handler = FileWatchHandler(view=self)
-        watch_manager = pyinotify.WatchManager()
-        self.notifier = pyinotify.ThreadedNotifier(watch_manager, handler)
-        watch_manager.add_watch(filename, (pyinotify.IN_CLOSE_WRITE |
-                                           pyinotify.IN_CREATE |
-                                           pyinotify.IN_DELETE |
-                                           pyinotify.IN_MODIFY))
-        self.notifier.start()
+        # The file is watched by name, so it keeps being followed when it's replaced
+        self.monitor = Gio.File.new_for_path(filename).monitor_file(Gio.FileMonitorFlags.WATCH_MOVES, None)
+        self.monitor.connect("changed", self.on_file_changed)
         self.connect("destroy", self.on_destroy)
-        self.connect("size-allocate", self.on_size_changed)
 
     def on_destroy(self, widget):
-        if self.notifier:
-            self.notifier.stop()
-            self.notifier = None
-
-    def on_size_changed(self, widget, bla):
-        if self.changed > 0:
-            end_iter = self.textbuffer.get_end_iter()
-            self.textview.scroll_to_iter(end_iter, 0, False, 0, 0)
-            self.changed -= 1
+        if self.monitor:
+            self.monitor.cancel()
+            self.monitor = None
+        if self.update_id > 0:
+            GLib.source_remove(self.update_id)
+            self.update_id = 0
+        self.tail.close()
+
+    def on_file_changed(self, monitor, file, other_file, event_type):
+        self.get_updates()
 
     def get_updates(self):
-        # only update 2 times per second max
-        # without this rate limiting, certain file modifications can cause
-        # a crash at Gtk.TextBuffer.set_text()
+        # only update 2 times per second max, whatever was written in the meantime is added at once
         if self.update_id == 0:
             self.update_id = GLib.timeout_add(500, self.update)
 
     def update(self):
-        self.changed = 2 # on_size_changed will be called twice, but only the second time is final
-        self.textbuffer.set_text(open(self.filename, 'r').read())
         self.update_id = 0
+        reset, lines = self.tail.read()
+        if reset:
+            self.lines.clear()
+            self.textbuffer.set_text("")
+        if lines:
+            self.lines.extend(lines)
+            self.append_lines(lines[-FILE_WATCHER_MAX_LINES:])
+            self.textview.scroll_to_mark(self.scroll_mark, 0, True, 1, 1)
         return False
 
+    def append_lines(self, lines):
+        if self.filter_lines and self.pattern is not None:
+            lines = [line for line in lines if self.pattern.search(line)]
+        if not lines:
+            return
+
+        text_iter = self.textbuffer.get_end_iter()
+        start_offset = text_iter.get_offset()
+        text = "\n".join(lines) + "\n"
+        self.textbuffer.insert(text_iter, text)
+
+        if self.pattern is not None:
+            for match in self.pattern.finditer(text):
+                if match.end() > match.start():
+                    self.textbuffer.apply_tag(self.match_tag,
+                                              self.textbuffer.get_iter_at_offset(start_offset + match.start()),
+                                              self.textbuffer.get_iter_at_offset(start_offset + match.end()))
+
+        # the buffer ends with an empty line after the last newline
+        excess = self.textbuffer.get_line_count() - 1 - FILE_WATCHER_MAX_LINES
+        if excess > 0:
+            self.textbuffer.delete(self.textbuffer.get_start_iter(), self.textbuffer.get_iter_at_line(excess))
+
+    def on_pattern_changed(self, widget):
+        context = self.pattern_entry.get_style_context()
+        text = self.pattern_entry.get_text()
+        try:
+            self.pattern = re.compile(text, re.MULTILINE) if text else None
+            context.remove_class("error")
+        except re.error:
+            self.pattern = None
+            context.add_class("error")
+        self.filter_lines = self.filter_check.get_active()
+
+        # only the lines that are kept anyway are gone through again, never the whole file
+        self.textbuffer.set_text("")
+        self.append_lines(list(self.lines))
+        self.textview.scroll_to_mark(self.scroll_mark, 0, True, 1, 1)
+
 class ClosableTabLabel(Gtk.Box):
     __gsignals__ = {
         "close-clicked": (GObject.SignalFlags.RUN_FIRST, GObject.TYPE_NONE, ()),
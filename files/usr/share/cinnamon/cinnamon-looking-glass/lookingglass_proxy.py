@@ -1,17 +1,22 @@
 #!/usr/bin/python3
 
 import dbus
-from gi.repository import Gio
+from gi.repository import Gio, GLib
 
 LG_DBUS_NAME = "org.Cinnamon.LookingGlass"
 LG_DBUS_PATH = "/org/Cinnamon/LookingGlass"
 
+# How long to wait for Cinnamon to answer, in ms
+LG_CALL_TIMEOUT = 5000
+
 
 class LookingGlassProxy:
     def __init__(self):
         self._signals = []
         self._status_change_callbacks = []
         self._proxy = None
+        # method name -> callbacks waiting for the call after the one that's in progress
+        self._calls = {}
         Gio.bus_watch_name(Gio.BusType.SESSION,
                            LG_DBUS_NAME,
                            Gio.BusNameWatcherFlags.NONE,
@@ -68,6 +73,51 @@ class LookingGlassProxy:
         self._proxy.connect("g-signal", self.on_signal)
         self.set_status(True)
 
+    def _call_async(self, method, callbacks, default):
+        if not self._proxy:
+            for callback in callbacks:
+                callback(*default)
+            return
+
+        self._calls[method] = []
+        self._proxy.call(method,
+                         None,
+                         Gio.DBusCallFlags.NONE,
+                         LG_CALL_TIMEOUT,
+                         None,
+                         self._on_call_done,
+                         (method, callbacks, default))
+
+    def _on_call_done(self, proxy, result, data):
+        method, callbacks, default = data
+        try:
+            value = proxy.call_finish(result).unpack()
+        except GLib.Error as exc:
+            print(exc)
+            value = default
+
+        # Whoever asked while the call was in progress needs the newer data, they're all answered by
+        # the one next call. It's made even if a callback fails, or the method would never be called again
+        queued = self._calls.pop(method, [])
+        try:
+            for callback in callbacks:
+                callback(*value)
+        finally:
+            for callback in queued:
+                # a callback may have asked for the method again already
+                self.get_async(method, callback, default)
+
+    def get_async(self, method, callback, default):
+        """ calls method (one that takes no arguments) without waiting for the answer, callback is
+            called with the result, or with default if the call fails or times out. If the method is
+            already being called it's only called once more when that's done, however many times it
+            was asked for in the meantime"""
+        if method in self._calls:
+            if callback not in self._calls[method]:
+                self._calls[method].append(callback)
+            return
+        self._call_async(method, [callback], default)
+
 # Proxy Methods:
     def Eval(self, code):
         if self._proxy:
@@ -84,6 +134,9 @@ class LookingGlassProxy:
                 pass
         return (False, "")
 
+    def GetResultsAsync(self, callback):
+        self.get_async("GetResults", callback, (False, []))
+
     def AddResult(self, code):
         if self._proxy:
             try:
@@ -99,6 +152,14 @@ class LookingGlassProxy:
                 pass
         return (False, "")
 
+    def GetErrorStackSince(self, since):
+        if self._proxy:
+            try:
+                return self._proxy.GetErrorStackSince('(u)', since)
+            except Exception:
+                pass
+        return (False, "", 0, [])
+
     def GetMemoryInfo(self):
         if self._proxy:
             try:
@@ -130,6 +191,9 @@ class LookingGlassProxy:
                 pass
         return (False, "")
 
+    def GetLatestWindowListAsync(self, callback):
+        self.get_async("GetLatestWindowList", callback, (False, []))
+
     def StartInspector(self):
         if self._proxy:
             try:
@@ -145,6 +209,9 @@ class LookingGlassProxy:
                 pass
         return (False, "")
 
+    def GetExtensionListAsync(self, callback):
+        self.get_async("GetExtensionList", callback, (False, []))
+
     def ReloadExtension(self, uuid, xlet_type):
         if self._proxy:
             try:
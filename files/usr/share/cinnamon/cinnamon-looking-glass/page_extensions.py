@@ -86,16 +86,17 @@ class ModulePage(pageutils.BaseListView):
             self.get_updates()
 
     def get_updates(self):
-        success, data = self.parent.lg_proxy.GetExtensionList()
+        self.parent.lg_proxy.GetExtensionListAsync(self.on_updates)
+
+    def on_updates(self, success, data):
         if success:
-            self.store.clear()
-            for item in data:
-                self.store.append([item["status"],
-                                   item["type"],
-                                   item["name"],
-                                   item["description"],
-                                   item["uuid"],
-                                   item["folder"],
-                                   item["url"],
-                                   item["error"] == "true",
-                                   item["error_message"]])
+            rows = [[item["status"],
+                     item["type"],
+                     item["name"],
+                     item["description"],
+                     item["uuid"],
+                     item["folder"],
+                     item["url"],
+                     item["error"] == "true",
+                     item["error_message"]] for item in data]
+            self.update_store(rows, 4)
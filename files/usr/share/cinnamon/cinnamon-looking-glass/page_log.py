@@ -1,9 +1,15 @@
 #!/usr/bin/python3
 
 import datetime
-from gi.repository import Gtk
+import itertools
+import os
+from collections import deque
+from gi.repository import Gio, GLib, GObject, Gtk
 import pageutils
 
+# The spill file is started over (keeping the previous one as .old) once it's this big
+LOG_SPILL_MAX_SIZE = 64 * 1024 * 1024
+
 class LogEntry():
     def __init__(self, category, time, message):
         self.category = category
@@ -12,7 +18,37 @@ class LogEntry():
         self.message = message
         self.formatted_text = "%s t=%s %s\n" % (category, self.timestr, message)
 
+class LogSpillFile():
+    """ where the messages that don't fit in the view anymore go"""
+    def __init__(self):
+        self.path = os.path.join(GLib.get_user_cache_dir(), "cinnamon-looking-glass", "log.txt")
+        self.file = None
+        self.size = 0
+
+    def write(self, entries):
+        text = "".join(entry.formatted_text for entry in entries)
+        try:
+            if self.file is None:
+                # what's left from the last time is overwritten
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.file = open(self.path, "w", encoding="utf-8")
+            self.file.write(text)
+            self.file.flush()
+            self.size += len(text)
+
+            if self.size > LOG_SPILL_MAX_SIZE:
+                self.file.close()
+                os.replace(self.path, self.path + ".old")
+                self.file = open(self.path, "w", encoding="utf-8")
+                self.size = 0
+        except OSError as exc:
+            print(exc)
+
 class LogView(Gtk.ScrolledWindow):
+    __gsignals__ = {
+        'spilled': (GObject.SignalFlags.RUN_FIRST, None, ())
+    }
+
     def __init__(self, proxy):
         Gtk.ScrolledWindow.__init__(self)
         self.proxy = proxy
@@ -28,9 +64,20 @@ class LogView(Gtk.ScrolledWindow):
         self.textbuffer = self.textview.get_buffer()
         self.scroll_mark = self.textbuffer.create_mark(None, self.textbuffer.get_end_iter(), False)
 
-        self.log = []
-        self.added_messages = 0
-        self.first_message_time = None
+        # Only the latest messages are kept in the view, the older ones are written to the spill file
+        self.settings = Gio.Settings.new("org.cinnamon")
+        self.max_entries = self.settings.get_int("looking-glass-log-lines")
+        self.settings.connect("changed::looking-glass-log-lines", self.on_max_entries_changed)
+        self.log = deque()
+        self.spill = LogSpillFile()
+
+        # Messages that were fetched, waiting for the next frame to be added to the view
+        self.pending = []
+        self.tick_id = 0
+
+        # Where the view is in Cinnamon's log: only the messages from next_seq on are fetched
+        self.log_id = None
+        self.next_seq = 0
 
         self.enabled_types = {'info': True, 'warning': True, 'error': True, 'trace': False}
         self.type_tags = {
@@ -62,9 +109,60 @@ class LogView(Gtk.ScrolledWindow):
 
     def append(self, category, time, message):
         entry = LogEntry(category, time, message)
-        self.log.append(entry)
+        self.pending.append(entry)
+
+        # There's no point in holding on to more than fits in the view (the view isn't drawn while
+        # it's hidden, so nothing is added to it then)
+        if len(self.pending) > self.max_entries:
+            self.spill_entries(self.pending[:-self.max_entries])
+            del self.pending[:-self.max_entries]
+
+        if self.tick_id == 0:
+            self.tick_id = self.textview.add_tick_callback(self.on_tick)
         return entry
 
+    def on_tick(self, widget, frame_clock):
+        self.tick_id = 0
+        self.insert_pending()
+        return False
+
+    def insert_pending(self):
+        entries = self.pending
+        self.pending = []
+
+        # runs of messages of the same type are inserted in one go
+        text_iter = self.textbuffer.get_end_iter()
+        for category, run in itertools.groupby(entries, key=lambda entry: entry.category):
+            self.textbuffer.insert_with_tags(text_iter,
+                                             "".join(entry.formatted_text for entry in run),
+                                             self.type_tags[category])
+        self.log.extend(entries)
+        self.trim()
+        self.textview.scroll_to_mark(self.scroll_mark, 0, True, 1, 1)
+
+    def trim(self):
+        if len(self.log) <= self.max_entries:
+            return
+
+        spilled = [self.log.popleft() for i in range(len(self.log) - self.max_entries)]
+        length = sum(len(entry.formatted_text) for entry in spilled)
+        self.textbuffer.delete(self.textbuffer.get_start_iter(), self.textbuffer.get_iter_at_offset(length))
+        self.spill_entries(spilled)
+
+    def spill_entries(self, entries):
+        self.spill.write(entries)
+        self.emit("spilled")
+
+    def clear(self):
+        start, end = self.textbuffer.get_bounds()
+        self.textbuffer.delete(start, end)
+        self.log.clear()
+        self.pending = []
+
+    def on_max_entries_changed(self, settings, key):
+        self.max_entries = self.settings.get_int("looking-glass-log-lines")
+        self.trim()
+
     def on_button_toggled(self, button, data):
         active = button.get_active()
         self.enabled_types[data] = active
@@ -72,50 +170,40 @@ class LogView(Gtk.ScrolledWindow):
         self.textbuffer.set_modified(True)
 
     def on_status_change(self, online):
-        text_iter = self.textbuffer.get_end_iter()
         if online:
-            entry = self.append("info",
-                                0,
-                                "================ DBus connection established ===============")
+            self.append("info",
+                        0,
+                        "================ DBus connection established ===============")
+            self.get_updates()
         else:
-            entry = self.append("warning",
-                                0,
-                                "================ DBus connection lost ===============")
-        self.textbuffer.insert_with_tags(text_iter,
-                                         entry.formatted_text,
-                                         self.type_tags[entry.category])
-        self.get_updates(True)
-
-    def get_updates(self, reread=False):
-        success, data = self.proxy.GetErrorStack()
-        if success:
-            try:
-                data_size = len(data)
-                if data_size > 0:
-                    # If this is a completely new log, start reading at the beginning
-                    first_message_time = data[0]["timestamp"]
-                    if (self.added_messages > data_size or
-                            self.first_message_time != first_message_time or
-                            reread):
-                        self.first_message_time = first_message_time
-                        self.added_messages = 0
-
-                    if reread:
-                        start, end = self.textbuffer.get_bounds()
-                        self.textbuffer.delete(start, end)
-
-                    text_iter = self.textbuffer.get_end_iter()
-                    for item in data[self.added_messages:]:
-                        entry = self.append(item["category"],
-                                            float(item["timestamp"]) * 0.001,
-                                            item["message"])
-                        self.textbuffer.insert_with_tags(text_iter,
-                                                         entry.formatted_text,
-                                                         self.type_tags[entry.category])
-                        self.added_messages += 1
-                    self.textview.scroll_to_mark(self.scroll_mark, 0, True, 1, 1)
-            except Exception as exc:
-                print(exc)
+            self.append("warning",
+                        0,
+                        "================ DBus connection lost ===============")
+
+    def get_updates(self):
+        success, log_id, next_seq, data = self.proxy.GetErrorStackSince(self.next_seq)
+        if not success:
+            return
+
+        if log_id != self.log_id:
+            # Cinnamon was restarted, this is a new log and has to be read from the beginning
+            first_read = self.log_id is None
+            self.log_id = log_id
+            if not first_read:
+                self.clear()
+            if self.next_seq != 0:
+                self.next_seq = 0
+                self.get_updates()
+                return
+
+        try:
+            for item in data:
+                self.append(item["category"],
+                            float(item["timestamp"]) * 0.001,
+                            item["message"])
+        except Exception as exc:
+            print(exc)
+        self.next_seq = next_seq
 
 class ModulePage(pageutils.WindowAndActionBars):
     def __init__(self, parent):
@@ -136,9 +224,26 @@ class ModulePage(pageutils.WindowAndActionBars):
                                "dialog-question-symbolic",
                                "Show/Hide Messages tagged as 'trace'")
 
+        self.spill_button = pageutils.ImageButton("document-open-symbolic")
+        self.spill_button.set_tooltip_text("Open the older messages that no longer fit in the log")
+        self.spill_button.set_sensitive(False)
+        self.spill_button.connect("clicked", self.on_spill_button_clicked)
+        self.view.connect("spilled", self.on_spilled)
+        self.add_to_left_bar(self.spill_button, 1)
+
     def add_toggle_button(self, log_type, icon, tooltip):
         button = pageutils.ImageToggleButton(icon)
         button.connect("toggled", self.view.on_button_toggled, log_type)
         button.set_active(self.view.enabled_types[log_type])
         button.set_tooltip_text(tooltip)
         self.add_to_left_bar(button, 1)
+
+    def on_spilled(self, view):
+        self.spill_button.set_sensitive(True)
+
+    def on_spill_button_clicked(self, button):
+        uri = Gio.File.new_for_path(self.view.spill.path).get_uri()
+        try:
+            Gio.AppInfo.launch_default_for_uri(uri, None)
+        except GLib.Error as exc:
+            print(exc)
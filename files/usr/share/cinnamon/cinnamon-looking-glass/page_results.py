@@ -50,19 +50,20 @@ class ModulePage(pageutils.BaseListView):
             self.get_updates()
 
     def get_updates(self):
-        self.store.clear()
-        success, data = self.parent.lg_proxy.GetResults()
+        self.parent.lg_proxy.GetResultsAsync(self.on_updates)
+
+    def on_updates(self, success, data):
         if success:
             try:
-                for item in data:
-                    self.store.append([int(item["index"]),
-                                       item["command"],
-                                       item["type"],
-                                       pageutils.shorten_value(item["object"]),
-                                       item["tooltip"],
-                                       item["object"]])
-                self._changed = True
-                self.parent.activate_page("results")
+                rows = [[int(item["index"]),
+                         item["command"],
+                         item["type"],
+                         pageutils.shorten_value(item["object"]),
+                         item["tooltip"],
+                         item["object"]] for item in data]
+                if self.update_store(rows, 0):
+                    self._changed = True
+                    self.parent.activate_page("results")
             except Exception as exc:
                 print(exc)
 
@@ -88,14 +88,15 @@ class ModulePage(pageutils.BaseListView):
             self.get_updates()
 
     def get_updates(self):
-        self.store.clear()
-        success, data = self.parent.lg_proxy.GetLatestWindowList()
+        self.parent.lg_proxy.GetLatestWindowListAsync(self.on_updates)
+
+    def on_updates(self, success, data):
         if success:
             try:
-                for item in data:
-                    self.store.append([int(item["id"]),
-                                       item["title"],
-                                       item["wmclass"],
-                                       item["app"]])
+                rows = [[int(item["id"]),
+                         item["title"],
+                         item["wmclass"],
+                         item["app"]] for item in data]
+                self.update_store(rows, 0)
             except Exception as exc:
                 print(exc)
@@ -61,6 +61,46 @@ class BaseListView(Gtk.ScrolledWindow):
         self.tree_view.append_column(column)
         return column
 
+    def update_store(self, rows, key_column):
+        """ makes the store hold rows, only changing the rows that differ. Rows are matched up by their
+            value in key_column, so the selection and scroll position stay where they are.
+            Returns True if anything changed"""
+        changed = False
+        keys = set(row[key_column] for row in rows)
+
+        iters = {}
+        tree_iter = self.store.get_iter_first()
+        while tree_iter is not None:
+            next_iter = self.store.iter_next(tree_iter)
+            key = self.store.get_value(tree_iter, key_column)
+            if key in keys and key not in iters:
+                iters[key] = tree_iter
+            else:
+                self.store.remove(tree_iter)
+                changed = True
+            tree_iter = next_iter
+
+        # Rows can only be moved around while the store isn't sorted by one of the columns
+        is_sorted = self.store.get_sort_column_id()[0] is not None
+        columns = range(self.store.get_n_columns())
+        for position, row in enumerate(rows):
+            tree_iter = iters.pop(row[key_column], None)
+            if tree_iter is None:
+                self.store.insert(position, row)
+                changed = True
+                continue
+
+            if not is_sorted and self.store.get_path(tree_iter).get_indices()[0] != position:
+                self.store.move_before(tree_iter, self.store.iter_nth_child(None, position))
+                changed = True
+
+            changed_columns = [column for column in columns if self.store.get_value(tree_iter, column) != row[column]]
+            if changed_columns:
+                self.store.set(tree_iter, changed_columns, [row[column] for column in changed_columns])
+                changed = True
+
+        return changed
+
 class WindowAndActionBars(Gtk.Table):
     def __init__(self, window):
         Gtk.Table.__init__(self, 2, 2, False)
@@ -1,12 +1,16 @@
 #!/usr/bin/python3
 
 import os
+import sys
 import pwd
 import grp
 import gettext
 import shutil
 import re
 import subprocess
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from random import randint
 from setproctitle import setproctitle
 
@@ -17,6 +21,10 @@ gi.require_version("Gtk", "3.0")
 gi.require_version("AccountsService", "1.0")
 from gi.repository import Gtk, GObject, Gio, GdkPixbuf, AccountsService, GLib
 
+sys.path.insert(0, '/usr/share/cinnamon/cinnamon-settings/bin')
+from ChooserButtonWidgets import PictureChooserButton, get_picture_loader
+from imtools import LRUCache
+
 gettext.install("cinnamon", "/usr/share/locale")
 
 class PrivHelper(object):
@@ -51,6 +59,305 @@ priv_helper = PrivHelper()
 (INDEX_USER_OBJECT, INDEX_USER_PICTURE, INDEX_USER_DESCRIPTION) = range(3)
 (INDEX_GID, INDEX_GROUPNAME) = range(2)
 
+GENERIC_FACE = "/usr/share/cinnamon/faces/user-generic.png"
+USER_LIST_FACE_SIZE = 48
+FACE_CACHE_SIZE = 64
+
+LOGIND_TIMEOUT = 1000
+UTMP_FILE = "/var/run/utmp"
+# struct utmp on Linux: ut_type, ut_pid, ut_line, ut_id, ut_user, and what isn't needed here
+UTMP_RECORD = struct.Struct("<h2xi32s4s32s256shhiii16s20s")
+UTMP_USER_PROCESS = 7
+
+GROUP_FILES = ("/etc/group", "/etc/passwd")
+GROUP_RELOAD_DELAY = 1000
+
+class UserGroupModel(GObject.Object):
+    """Who is in which group, indexed both ways.
+
+    Going through all the users and groups can take seconds on machines that
+    get them from a directory (LDAP, SSSD...), so it's only done in a thread:
+    once at startup and again when the local files change. Changes made from
+    here are applied right away by looking up just the users and groups
+    involved."""
+
+    __gsignals__ = {
+        'changed': (GObject.SignalFlags.RUN_LAST, None, ())
+    }
+
+    def __init__(self):
+        GObject.Object.__init__(self)
+
+        self.groups = {}            # group name -> gid
+        self.members = {}           # group name -> names of its (secondary) members
+        self.user_groups = {}       # user name -> names of the groups it's a (secondary) member of
+        self.user_gids = {}         # user name -> primary gid
+        self.primary_members = {}   # gid -> names of the users it's the primary group of
+        self.loaded = False
+
+        # Bumped by every change made here, so a reload that started before it is thrown away
+        self.serial = 0
+        self.reloading = False
+        self.reload_pending = False
+        self.reload_id = 0
+
+        self.monitors = []
+        for path in GROUP_FILES:
+            monitor = Gio.File.new_for_path(path).monitor_file(Gio.FileMonitorFlags.NONE, None)
+            monitor.connect("changed", self.on_file_changed)
+            self.monitors.append(monitor)
+
+    def read_all(self):
+        groups = {}
+        members = {}
+        user_groups = {}
+        for group in grp.getgrall():
+            # the same name can come from more than one source, the first one wins as with getgrnam()
+            if group.gr_name in groups:
+                continue
+            groups[group.gr_name] = group.gr_gid
+            members[group.gr_name] = set(group.gr_mem)
+            for username in group.gr_mem:
+                user_groups.setdefault(username, set()).add(group.gr_name)
+
+        user_gids = {}
+        primary_members = {}
+        for user in pwd.getpwall():
+            if user.pw_name in user_gids:
+                continue
+            user_gids[user.pw_name] = user.pw_gid
+            primary_members.setdefault(user.pw_gid, set()).add(user.pw_name)
+
+        return (groups, members, user_groups, user_gids, primary_members)
+
+    def reload(self):
+        """ reads all the users and groups again in a thread, 'changed' is emitted when it's done"""
+        if self.reloading:
+            self.reload_pending = True
+            return
+
+        self.reloading = True
+        thread = threading.Thread(target=self._reload_thread, args=(self.serial,))
+        thread.daemon = True
+        thread.start()
+
+    def _reload_thread(self, serial):
+        try:
+            data = self.read_all()
+        except Exception as detail:
+            print("Could not read the users and groups: %s" % detail)
+            data = None
+        GLib.idle_add(self._on_reload_done, data, serial)
+
+    def _on_reload_done(self, data, serial):
+        self.reloading = False
+        if data is not None and serial == self.serial:
+            self._set_data(data)
+        elif data is not None:
+            self.reload_pending = True
+
+        if self.reload_pending:
+            self.reload_pending = False
+            self.reload()
+        return False
+
+    def _set_data(self, data):
+        (self.groups, self.members, self.user_groups, self.user_gids, self.primary_members) = data
+        self.loaded = True
+        self.emit("changed")
+
+    def ensure_loaded(self):
+        """ reads everything right away if the thread isn't done yet"""
+        if not self.loaded:
+            self._set_data(self.read_all())
+
+    def on_file_changed(self, monitor, file, other_file, event_type):
+        if self.reload_id > 0:
+            GLib.source_remove(self.reload_id)
+        self.reload_id = GLib.timeout_add(GROUP_RELOAD_DELAY, self._on_reload_timeout)
+
+    def _on_reload_timeout(self):
+        self.reload_id = 0
+        self.reload()
+        return False
+
+    def _add_member(self, group_name, username):
+        self.members.setdefault(group_name, set()).add(username)
+        self.user_groups.setdefault(username, set()).add(group_name)
+
+    def _remove_member(self, group_name, username):
+        self.members.get(group_name, set()).discard(username)
+        self.user_groups.get(username, set()).discard(group_name)
+
+    def _set_primary_gid(self, username, gid):
+        old_gid = self.user_gids.pop(username, None)
+        if old_gid is not None:
+            self.primary_members.get(old_gid, set()).discard(username)
+        if gid is not None:
+            self.user_gids[username] = gid
+            self.primary_members.setdefault(gid, set()).add(username)
+
+    def _changed(self):
+        self.serial += 1
+        self.emit("changed")
+
+    def refresh_user(self, username):
+        """ looks up the groups of one user again and returns their names"""
+        names = self._lookup_user(username)
+        self._changed()
+        return names
+
+    def _lookup_user(self, username):
+        try:
+            user = pwd.getpwnam(username)
+        except KeyError:
+            self._forget_user(username)
+            return []
+
+        names = set()
+        for gid in os.getgrouplist(username, user.pw_gid):
+            try:
+                group = grp.getgrgid(gid)
+            except KeyError:
+                continue
+            self.groups[group.gr_name] = group.gr_gid
+            # the list includes the primary group, which the user may not be a member of
+            if username in group.gr_mem:
+                names.add(group.gr_name)
+
+        for name in self.user_groups.get(username, set()) - names:
+            self._remove_member(name, username)
+        for name in names:
+            self._add_member(name, username)
+        self._set_primary_gid(username, user.pw_gid)
+        return sorted(names)
+
+    def _forget_user(self, username):
+        for name in list(self.user_groups.pop(username, ())):
+            self.members.get(name, set()).discard(username)
+        self._set_primary_gid(username, None)
+
+    def remove_user(self, username):
+        self._forget_user(username)
+        self._changed()
+
+    def refresh_group(self, name):
+        """ looks up one group again, it's dropped if it doesn't exist anymore"""
+        try:
+            group = grp.getgrnam(name)
+        except KeyError:
+            for username in list(self.members.pop(name, ())):
+                self.user_groups.get(username, set()).discard(name)
+            self.groups.pop(name, None)
+            self._changed()
+            return
+
+        self.groups[name] = group.gr_gid
+        members = set(group.gr_mem)
+        for username in self.members.get(name, set()) - members:
+            self._remove_member(name, username)
+        for username in members:
+            self._add_member(name, username)
+        self._changed()
+
+    def get_group_names(self):
+        self.ensure_loaded()
+        return sorted(self.groups)
+
+    def get_user_groups(self, username):
+        """ returns the names of the groups the user is a (secondary) member of"""
+        if not self.loaded:
+            return self._lookup_user(username)
+        return sorted(self.user_groups.get(username, ()))
+
+    def get_primary_members(self, gid):
+        """ returns the names of the users whose primary group this is"""
+        self.ensure_loaded()
+        return sorted(self.primary_members.get(gid, ()))
+
+def count_logind_sessions(username):
+    bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+    result = bus.call_sync("org.freedesktop.login1", "/org/freedesktop/login1", "org.freedesktop.login1.Manager",
+                           "ListSessions", None, GLib.VariantType.new("(a(susso))"),
+                           Gio.DBusCallFlags.NONE, LOGIND_TIMEOUT, None)
+
+    count = 0
+    for (session_id, uid, user_name, seat, path) in result.unpack()[0]:
+        if user_name != username:
+            continue
+        # sessions stay around as "closing" while processes started from them are still running
+        state = bus.call_sync("org.freedesktop.login1", path, "org.freedesktop.DBus.Properties", "Get",
+                              GLib.Variant("(ss)", ("org.freedesktop.login1.Session", "State")),
+                              GLib.VariantType.new("(v)"), Gio.DBusCallFlags.NONE, LOGIND_TIMEOUT, None).unpack()[0]
+        if state != "closing":
+            count += 1
+    return count
+
+def count_utmp_sessions(username):
+    try:
+        with open(UTMP_FILE, "rb") as f:
+            data = f.read()
+    except OSError:
+        return 0
+
+    count = 0
+    for (ut_type, ut_pid, ut_line, ut_id, ut_user, *rest) in UTMP_RECORD.iter_unpack(data[:len(data) - len(data) % UTMP_RECORD.size]):
+        if ut_type == UTMP_USER_PROCESS and ut_user.rstrip(b"\0").decode("utf-8", "replace") == username:
+            # entries of processes that died without cleaning up are left behind
+            if os.path.exists("/proc/%d" % ut_pid):
+                count += 1
+    return count
+
+def count_user_sessions(username):
+    """ returns how many times the user is logged in, according to logind or else utmp. This blocks,
+        so it's called from a thread"""
+    try:
+        return count_logind_sessions(username)
+    except GLib.Error:
+        return count_utmp_sessions(username)
+
+class FaceCache(object):
+    """User pictures, scaled to the size they're shown at. They're decoded by
+    the picture loader threads and the most recently used ones are kept."""
+
+    def __init__(self, max_items=FACE_CACHE_SIZE):
+        self.pixbufs = LRUCache(max_items)
+
+    def _key(self, path, size):
+        # the user's picture is often replaced in place (~/.face), so it's looked up by date as well
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            path = GENERIC_FACE
+            mtime = 0
+        return (path, mtime, size)
+
+    def load(self, path, size, callback, *args):
+        """ calls callback(pixbuf, *args) with the picture scaled to size: right away if it's cached, or
+            from the main loop once it's decoded. The generic picture is used if it can't be loaded"""
+        key = self._key(path, size)
+        if key in self.pixbufs:
+            callback(self.pixbufs[key], *args)
+        else:
+            get_picture_loader().submit(self._decode, key, callback, args)
+
+    def _decode(self, key, callback, args):
+        (path, mtime, size) = key
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, size, size)
+        except GLib.Error as e:
+            print("Could not load pixbuf from '%s': %s" % (path, e.message))
+            pixbuf = None
+        GLib.idle_add(self._on_decoded, key, pixbuf, callback, args)
+
+    def _on_decoded(self, key, pixbuf, callback, args):
+        if pixbuf is not None:
+            self.pixbufs[key] = pixbuf
+            callback(pixbuf, *args)
+        elif key[0] != GENERIC_FACE:
+            self.load(GENERIC_FACE, key[2], callback, *args)
+        return False
+
 class GroupDialog (Gtk.Dialog):
     def __init__ (self, label, value, parent = None):
         super(GroupDialog, self).__init__(None, parent)
@@ -409,7 +716,7 @@ class NewUserDialog(Gtk.Dialog):
 
 class GroupsDialog(Gtk.Dialog):
 
-    def __init__ (self, username, parent = None):
+    def __init__ (self, username, group_model, parent = None):
         super(GroupsDialog, self).__init__(None, parent)
 
         try:
@@ -423,12 +730,12 @@ class GroupsDialog(Gtk.Dialog):
             viewport = Gtk.Viewport()
             vbox = Gtk.VBox()
             self.checkboxes = []
-            groups = sorted(grp.getgrall(), key=lambda x: x[0], reverse=False)
-            for group in groups:
-                checkbox = Gtk.CheckButton(group[0])
+            user_groups = set(group_model.get_user_groups(username))
+            for group in group_model.get_group_names():
+                checkbox = Gtk.CheckButton(group)
                 self.checkboxes.append(checkbox)
                 vbox.add(checkbox)
-                if username in group[3]:
+                if group in user_groups:
                     checkbox.set_active(True)
 
             viewport.add(vbox)
@@ -475,6 +782,16 @@ class Module:
 
             self.groups = Gtk.TreeStore(int, str)
             self.groups.set_sort_column_id(1, Gtk.SortType.ASCENDING)
+            self.group_iters = {}
+
+            self.group_model = UserGroupModel()
+            self.group_model.connect("changed", self.on_group_model_changed)
+
+            # What's shown about the selected user is partly loaded in the background, and only
+            # shown if it's still selected by then
+            self.selected_user = None
+            self.face_cache = FaceCache()
+            self.session_checker = ThreadPoolExecutor(max_workers=1)
 
             self.users_treeview = self.builder.get_object("treeview_users")
             self.users_treeview.set_rules_hint(True)
@@ -508,45 +825,23 @@ class Module:
             self.builder.get_object("button_edit_group").set_sensitive(False)
             self.builder.get_object("button_delete_group").set_sensitive(False)
 
-            self.face_button = Gtk.Button()
-            self.face_image = Gtk.Image()
-            self.face_image.set_size_request(96, 96)
-            self.face_button.set_image(self.face_image)
-            self.face_image.set_from_file("/usr/share/cinnamon/faces/user-generic.png")
+            self.face_button = PictureChooserButton(num_cols=4, button_picture_size=96, menu_pictures_size=48, keep_square=True)
+            self.face_button.set_picture_from_file("/usr/share/cinnamon/faces/user-generic.png")
             self.face_button.set_alignment(0.0, 0.5)
             self.face_button.set_tooltip_text(_("Click to change the picture"))
 
-            self.menu = Gtk.Menu()
-
-            separator = Gtk.SeparatorMenuItem()
-            face_browse_menuitem = Gtk.MenuItem(_("Browse for more pictures..."))
-            face_browse_menuitem.connect('activate', self._on_face_browse_menuitem_activated)
-            self.face_button.connect("button-release-event", self.menu_display)
-
-            row = 0
-            col = 0
-            num_cols = 4
             face_dirs = ["/usr/share/cinnamon/faces"]
             for face_dir in face_dirs:
                 if os.path.exists(face_dir):
                     pictures = sorted(os.listdir(face_dir))
                     for picture in pictures:
                         path = os.path.join(face_dir, picture)
-                        file = Gio.File.new_for_path(path)
-                        file_icon = Gio.FileIcon.new(file)
-                        image = Gtk.Image.new_from_gicon (file_icon, Gtk.IconSize.DIALOG)
-                        menuitem = Gtk.MenuItem()
-                        menuitem.add(image)
-                        menuitem.connect('activate', self._on_face_menuitem_activated, path)
-                        self.menu.attach(menuitem, col, col+1, row, row+1)
-                        col = (col+1) % num_cols
-                        if (col == 0):
-                            row = row + 1
+                        self.face_button.add_picture(path, self._on_face_menuitem_activated)
 
-            row = row + 1
-
-            self.menu.attach(separator, 0, 4, row, row+1)
-            self.menu.attach(face_browse_menuitem, 0, 4, row+2, row+3)
+            face_browse_menuitem = Gtk.MenuItem(_("Browse for more pictures..."))
+            face_browse_menuitem.connect('activate', self._on_face_browse_menuitem_activated)
+            self.face_button.add_separator()
+            self.face_button.add_menuitem(face_browse_menuitem)
 
             self.account_type_combo = Gtk.ComboBoxText()
             self.account_type_combo.append_text(_("Standard"))
@@ -587,7 +882,8 @@ class Module:
             self.accountService = AccountsService.UserManager.get_default()
             self.accountService.connect('notify::is-loaded', self.on_accounts_service_loaded)
 
-            self.load_groups()
+            self.groups_treeview.set_model(self.groups)
+            self.group_model.reload()
 
             self.window.show_all()
 
@@ -607,13 +903,12 @@ class Module:
         model, treeiter = self.users_treeview.get_selection().get_selected()
         if treeiter != None:
             user = model[treeiter][INDEX_USER_OBJECT]
-            dialog = GroupsDialog(user.get_user_name(), self.window)
+            dialog = GroupsDialog(user.get_user_name(), self.group_model, self.window)
             response = dialog.run()
             if response == Gtk.ResponseType.OK:
                 groups = dialog.get_selected_groups()
                 subprocess.call(["usermod", user.get_user_name(), "-G", ",".join(groups)])
-                groups.sort()
-                self.groups_label.set_text(", ".join(groups))
+                self.group_model.refresh_user(user.get_user_name())
             dialog.destroy()
 
     def _on_accounttype_changed(self, combobox):
@@ -625,12 +920,7 @@ class Module:
             else:
                 user.set_account_type(AccountsService.UserAccountType.STANDARD)
 
-            groups = []
-            for group in grp.getgrall():
-                if user.get_user_name() in group[3]:
-                    groups.append(group[0])
-            groups.sort()
-            self.groups_label.set_text(", ".join(groups))
+            self.group_model.refresh_user(user.get_user_name())
 
     def _on_realname_changed(self, widget, text):
         model, treeiter = self.users_treeview.get_selection().get_selected()
@@ -682,9 +972,8 @@ class Module:
                 finally:
                     priv_helper.restore_privs()
                 user.set_icon_file(face_path)
-                self.face_image.set_from_file(face_path)
-                model.set_value(treeiter, INDEX_USER_PICTURE, GdkPixbuf.Pixbuf.new_from_file_at_size(face_path, 48, 48))
-                model.row_changed(model.get_path(treeiter), treeiter)
+                self.face_button.set_picture_from_file(face_path)
+                self.load_user_row_face(treeiter, face_path)
 
             dialog.destroy()
 
@@ -706,13 +995,12 @@ class Module:
         preview.clear()
         self.frame.hide()
 
-    def _on_face_menuitem_activated(self, menuitem, path):
+    def _on_face_menuitem_activated(self, path):
         if os.path.exists(path):
             model, treeiter = self.users_treeview.get_selection().get_selected()
             if treeiter != None:
                 user = model[treeiter][INDEX_USER_OBJECT]
                 user.set_icon_file(path)
-                self.face_image.set_from_file(path)
                 face_path = os.path.join(user.get_home_dir(), ".face")
                 try:
                     try:
@@ -723,58 +1011,54 @@ class Module:
                     shutil.copy(path, face_path)
                 finally:
                     priv_helper.restore_privs()
-                model.set_value(treeiter, INDEX_USER_PICTURE, GdkPixbuf.Pixbuf.new_from_file_at_size(path, 48, 48))
-                model.row_changed(model.get_path(treeiter), treeiter)
-
-
-    def menu_display(self, widget, event):
-        if event.button == 1:
-            self.menu.popup(None, None, self.popup_menu_below_button, self.face_button, event.button, event.time)
-            self.menu.show_all()
-
-    def popup_menu_below_button (self, *args):
-        # the introspection for GtkMenuPositionFunc seems to change with each Gtk version,
-        # this is a workaround to make sure we get the menu and the widget
-        menu = args[0]
-        widget = args[-1]
-
-        # here I get the coordinates of the button relative to
-        # window (self.window)
-        button_x, button_y = widget.get_allocation().x, widget.get_allocation().y
-
-        # now convert them to X11-relative
-        unused_var, window_x, window_y = widget.get_window().get_origin()
-        x = window_x + button_x
-        y = window_y + button_y
-
-        # now move the menu below the button
-        y += widget.get_allocation().height
-
-        push_in = True # push_in is True so all menu is always inside screen
-        return (x, y, push_in)
+                self.load_user_row_face(treeiter, path)
+                return True
+        return False
 
     def on_accounts_service_loaded(self, user, param):
         self.load_users()
 
     def load_users(self):
         self.users.clear()
+        # Every row starts with the generic picture, the users' own are decoded in the background
+        generic_pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(GENERIC_FACE, USER_LIST_FACE_SIZE, USER_LIST_FACE_SIZE)
         users = self.accountService.list_users()
         for user in users:
-            if os.path.exists(user.get_icon_file()):
-                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(user.get_icon_file(), 48, 48)
-            else:
-                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size("/usr/share/cinnamon/faces/user-generic.png", 48, 48)
             description = "<b>%s</b>\n%s" % (user.get_real_name(), user.get_user_name())
-            piter = self.users.append(None, [user, pixbuf, description])
+            piter = self.users.append(None, [user, generic_pixbuf, description])
+            self.load_user_row_face(piter, user.get_icon_file())
         self.users_treeview.set_model(self.users)
 
+    def load_user_row_face(self, treeiter, path):
+        row = Gtk.TreeRowReference.new(self.users, self.users.get_path(treeiter))
+        self.face_cache.load(path, USER_LIST_FACE_SIZE, self.on_user_row_face_loaded, row)
+
+    def on_user_row_face_loaded(self, pixbuf, row):
+        # the row may be gone by now
+        if row.valid():
+            self.users[row.get_path()][INDEX_USER_PICTURE] = pixbuf
+
     def load_groups(self):
-        self.groups.clear()
-        groups = sorted(grp.getgrall(), key=lambda x: x[0], reverse=False)
-        for group in groups:
-            (gr_name, gr_passwd, gr_gid, gr_mem) = group
-            piter = self.groups.append(None, [gr_gid, gr_name])
-        self.groups_treeview.set_model(self.groups)
+        # Only the rows that changed are touched, so the selection stays put
+        groups = self.group_model.groups
+        for name in list(self.group_iters):
+            if name not in groups:
+                self.groups.remove(self.group_iters.pop(name))
+        for name, gid in groups.items():
+            if name not in self.group_iters:
+                self.group_iters[name] = self.groups.append(None, [gid, name])
+            elif self.groups[self.group_iters[name]][INDEX_GID] != gid:
+                self.groups[self.group_iters[name]][INDEX_GID] = gid
+
+    def on_group_model_changed(self, group_model):
+        self.load_groups()
+        self.update_groups_label()
+
+    def update_groups_label(self):
+        model, treeiter = self.users_treeview.get_selection().get_selected()
+        if treeiter != None:
+            user = model[treeiter][INDEX_USER_OBJECT]
+            self.groups_label.set_text(", ".join(self.group_model.get_user_groups(user.get_user_name())))
 
 #USER CALLBACKS
 
@@ -785,7 +1069,7 @@ class Module:
         model, treeiter = selection.get_selected()
         if treeiter != None:
             user = model[treeiter][INDEX_USER_OBJECT]
-            self.builder.get_object("button_delete_user").set_sensitive(True)
+            self.selected_user = user
             self.realname_entry.set_text(user.get_real_name())
 
             if user.get_password_mode() == AccountsService.UserPasswordMode.REGULAR:
@@ -800,57 +1084,49 @@ class Module:
             else:
                 self.account_type_combo.set_active(0)
 
-            pixbuf = None
-            path = user.get_icon_file()
-            message = ""
+            face_size = self.face_button.button_picture_size * self.face_button.scale
+            self.face_cache.load(user.get_icon_file(), face_size, self.on_user_face_loaded, user)
 
-            if os.path.exists(path):
-                try:
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
-                except GLib.Error as e:
-                    message = "Could not load pixbuf from '%s': %s" % (path, e.message)
-                    error = True
-
-                if pixbuf != None:
-                    if pixbuf.get_height() > 96 or pixbuf.get_width() > 96:
-                        try:
-                            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, 96, 96)
-                        except GLib.Error as e:
-                            message = "Could not scale pixbuf from '%s': %s" % (path, e.message)
-                            error = True
-
-            if pixbuf:
-                self.face_image.set_from_pixbuf(pixbuf)
-            else:
-                if message != "":
-                    print(message)
-                self.face_image.set_from_file("/usr/share/cinnamon/faces/user-generic.png")
-
-            groups = []
-            for group in grp.getgrall():
-                if user.get_user_name() in group[3]:
-                    groups.append(group[0])
-            groups.sort()
-            self.groups_label.set_text(", ".join(groups))
+            self.groups_label.set_text(", ".join(self.group_model.get_user_groups(user.get_user_name())))
             self.builder.get_object("box_users").show()
 
-            # Count the number of connections for the currently logged-in user
-            connections = int(subprocess.check_output(["w", "-hs", user.get_user_name()]).decode("utf-8").count("\n"))
-            if connections > 0:
-                self.builder.get_object("button_delete_user").set_sensitive(False)
-                self.builder.get_object("button_delete_user").set_tooltip_text(_("This user is currently logged in"))
-            else:
-                self.builder.get_object("button_delete_user").set_sensitive(True)
-                self.builder.get_object("button_delete_user").set_tooltip_text("")
+            # The user can't be deleted until it's known they aren't logged in
+            self.builder.get_object("button_delete_user").set_sensitive(False)
+            self.builder.get_object("button_delete_user").set_tooltip_text("")
+            self.session_checker.submit(self.check_user_sessions, user)
 
             if os.path.exists("/home/.ecryptfs/%s" % user.get_user_name()):
                 self.password_button.set_sensitive(False)
                 self.password_button.set_tooltip_text(_("The user's home directory is encrypted. To preserve access to the encrypted directory, only the user should change this password."))
 
         else:
+            self.selected_user = None
             self.builder.get_object("button_delete_user").set_sensitive(False)
             self.builder.get_object("box_users").hide()
 
+    def on_user_face_loaded(self, pixbuf, user):
+        if user == self.selected_user:
+            self.face_button.set_picture_from_pixbuf(pixbuf)
+
+    def check_user_sessions(self, user):
+        # runs in the session checker thread, users that were only passed over on the way are skipped
+        if user != self.selected_user:
+            return
+        connections = count_user_sessions(user.get_user_name())
+        GLib.idle_add(self.on_user_sessions_checked, user, connections)
+
+    def on_user_sessions_checked(self, user, connections):
+        if user != self.selected_user:
+            return False
+
+        if connections > 0:
+            self.builder.get_object("button_delete_user").set_sensitive(False)
+            self.builder.get_object("button_delete_user").set_tooltip_text(_("This user is currently logged in"))
+        else:
+            self.builder.get_object("button_delete_user").set_sensitive(True)
+            self.builder.get_object("button_delete_user").set_tooltip_text("")
+        return False
+
     def on_user_deletion(self, event):
         model, treeiter = self.users_treeview.get_selection().get_selected()
         if treeiter != None:
@@ -869,7 +1145,9 @@ class Module:
                 result = self.accountService.delete_user(user, True)
                 if result:
                     model.remove(treeiter)
-                    self.load_groups()
+                    self.group_model.remove_user(user.get_user_name())
+                    # the user's own group goes with it
+                    self.group_model.refresh_group(user.get_user_name())
 
     def on_user_addition(self, event):
         dialog = NewUserDialog(self.window)
@@ -883,7 +1161,7 @@ class Module:
             username = dialog.username_entry.get_text()
             new_user = self.accountService.create_user(username, fullname, account_type)
             new_user.set_password_mode(AccountsService.UserPasswordMode.NONE)
-            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size("/usr/share/cinnamon/faces/user-generic.png", 48, 48)
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(GENERIC_FACE, USER_LIST_FACE_SIZE, USER_LIST_FACE_SIZE)
             description = "<b>%s</b>\n%s" % (fullname, username)
             piter = self.users.append(None, [new_user, pixbuf, description])
             # Add the user to his/her own group and sudo if Administrator was selected
@@ -891,7 +1169,8 @@ class Module:
                 subprocess.call(["usermod", username, "-G", "%s,sudo,nopasswdlogin" % username])
             else:
                 subprocess.call(["usermod", username, "-G", "%s,nopasswdlogin" % username])
-            self.load_groups()
+            self.group_model.refresh_group(username)
+            self.group_model.refresh_user(username)
         dialog.destroy()
 
     def on_user_edition(self, event):
@@ -907,14 +1186,10 @@ class Module:
             self.builder.get_object("button_edit_group").set_sensitive(True)
             self.builder.get_object("button_delete_group").set_sensitive(True)
             self.builder.get_object("button_delete_group").set_tooltip_text("")
-            group = model[treeiter][INDEX_GROUPNAME]
-            for p in pwd.getpwall():
-                username = p[0]
-                primary_group = grp.getgrgid(p[3])[0]
-                if primary_group == group:
-                    self.builder.get_object("button_delete_group").set_sensitive(False)
-                    self.builder.get_object("button_delete_group").set_tooltip_text(_("This group is set as %s's primary group") % username)
-                    break
+            primary_members = self.group_model.get_primary_members(model[treeiter][INDEX_GID])
+            if len(primary_members) > 0:
+                self.builder.get_object("button_delete_group").set_sensitive(False)
+                self.builder.get_object("button_delete_group").set_tooltip_text(_("This group is set as %s's primary group") % primary_members[0])
 
         else:
             self.builder.get_object("button_edit_group").set_sensitive(False)
@@ -936,7 +1211,7 @@ class Module:
             r = d.run()
             if r == Gtk.ResponseType.YES:
                 subprocess.call(["groupdel", group])
-                self.load_groups()
+                self.group_model.refresh_group(group)
             d.destroy()
 
     def on_group_addition(self, event):
@@ -944,7 +1219,7 @@ class Module:
         response = dialog.run()
         if response == Gtk.ResponseType.OK:
             subprocess.call(["groupadd", dialog.entry.get_text().lower()])
-            self.load_groups()
+            self.group_model.refresh_group(dialog.entry.get_text().lower())
         dialog.destroy()
 
     def on_group_edition(self, event):
@@ -955,7 +1230,8 @@ class Module:
             response = dialog.run()
             if response == Gtk.ResponseType.OK:
                 subprocess.call(["groupmod", group, "-n", dialog.entry.get_text().lower()])
-                self.load_groups()
+                self.group_model.refresh_group(group)
+                self.group_model.refresh_group(dialog.entry.get_text().lower())
             dialog.destroy()
 
 
@@ -7,6 +7,10 @@ import os
 import math
 import gettext
 import datetime
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 gettext.install("cinnamon", "/usr/share/locale")
 
 TWEEN_SHAPES = ["Quad", "Cubic", "Quart", "Quint", "Sine", "Expo", "Circ", "Elastic", "Back", "Bounce"]
@@ -27,6 +31,19 @@ PREVIEW_WIDTH = 96
 ANIMATION_DURATION = 800
 ANIMATION_FRAME_RATE = 20
 
+# Menu pictures are decoded by these threads, shared by all PictureChooserButtons
+PICTURE_LOADER_THREADS = 2
+# Time in ms spent adding decoded pictures to a menu per main loop iteration
+PICTURE_BATCH_TIME = 8
+
+picture_loader = None
+
+def get_picture_loader():
+    global picture_loader
+    if picture_loader is None:
+        picture_loader = ThreadPoolExecutor(max_workers=PICTURE_LOADER_THREADS)
+    return picture_loader
+
 class BaseChooserButton(Gtk.Button):
     def __init__ (self, has_button_label=False):
         super(BaseChooserButton, self).__init__()
@@ -78,6 +95,10 @@ class BaseChooserButton(Gtk.Button):
             self.menu.popup(None, None, self.popup_menu_below_button, self, event.button, event.time)
 
 class PictureChooserButton(BaseChooserButton):
+    __gsignals__ = {
+        'pictures-loaded': (GObject.SignalFlags.RUN_FIRST, None, ())
+    }
+
     def __init__ (self, num_cols=4, button_picture_size=24, menu_pictures_size=24, has_button_label=False, keep_square=False):
         super(PictureChooserButton, self).__init__(has_button_label)
         self.num_cols = num_cols
@@ -89,6 +110,17 @@ class PictureChooserButton(BaseChooserButton):
         self.col = 0
         self.progress = 0.0
 
+        # Pictures in the menu (in the order they're laid out), and how many of them are shown already
+        self.pictures = []
+        self.n_pictures = 0
+        self.n_pictures_loaded = 0
+        self.update_id = 0
+
+        # Pictures decoded by the loader threads, waiting to be put in the menu
+        self.decoded = deque()
+        self.decoded_lock = threading.Lock()
+        self.decoded_id = 0
+
         context = self.get_style_context()
         context.add_class("gtkstyle-fallback")
 
@@ -138,36 +170,31 @@ class PictureChooserButton(BaseChooserButton):
         message = ""
 
         if os.path.exists(path):
+            # Only the header is read to get the size, the picture is decoded once at the size it's shown
             try:
-                pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
+                info, w, h = GdkPixbuf.Pixbuf.get_file_info(path)
+                if info is None:
+                    message = "Could not load pixbuf from '%s': unknown format" % path
+                elif (self.keep_square and (h > self.button_picture_size or w > self.button_picture_size)):
+                    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, self.button_picture_size * self.scale, self.button_picture_size * self.scale)
+                elif h > self.button_picture_size:
+                    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, -1, self.button_picture_size * self.scale)
+                else:
+                    pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
             except GLib.Error as e:
                 message = "Could not load pixbuf from '%s': %s" % (path, e.message)
-                error = True
-
-            if pixbuf != None:
-                h = pixbuf.get_height()
-                w = pixbuf.get_width()
-
-                if (self.keep_square and (h > self.button_picture_size or w > self.button_picture_size)):
-                    try:
-                        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, self.button_picture_size * self.scale, self.button_picture_size * self.scale)
-                    except GLib.Error as e:
-                        message = "Could not scale pixbuf from '%s': %s" % (path, e.message)
-                        error = True
-                elif h > self.button_picture_size:
-                    try:
-                        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, -1, self.button_picture_size * self.scale)
-                    except GLib.Error as e:
-                        message = "Could not scale pixbuf from '%s': %s" % (path, e.message)
-                        error = True
 
         if pixbuf:
-            surface = Gdk.cairo_surface_create_from_pixbuf(pixbuf, self.scale)
-            self.button_image.set_from_surface(surface)
+            self.set_picture_from_pixbuf(pixbuf)
         else:
             print(message)
             self.set_picture_from_file("/usr/share/cinnamon/faces/user-generic.png")
 
+    def set_picture_from_pixbuf(self, pixbuf):
+        """ shows a picture that's already decoded, at button_picture_size times the scale factor"""
+        surface = Gdk.cairo_surface_create_from_pixbuf(pixbuf, self.scale)
+        self.button_image.set_from_surface(surface)
+
     def set_button_label(self, label):
         self.button_label.set_markup(label)
 
@@ -185,54 +212,147 @@ class PictureChooserButton(BaseChooserButton):
         self.menu = Gtk.Menu()
         self.row = 0
         self.col = 0
+        self.pictures = []
+        self.n_pictures = 0
+        self.n_pictures_loaded = 0
         menu.destroy()
+        self._queue_update()
 
     def add_picture(self, path, callback, title=None, id=None):
+        """ adds a picture to the menu. Its place is taken right away, but it's decoded in the background,
+            straight at the size it's shown at"""
+        if not os.path.exists(path):
+            return
+
+        menuitem = self.add_pixbuf(None, path, callback, title, id)
+        get_picture_loader().submit(self._load_picture, self.menu, menuitem, path)
+
+    def _load_picture(self, menu, menuitem, path):
+        # runs in a loader thread
         pixbuf = None
-        if os.path.exists(path):
-            try:
+        try:
+            if self.menu_pictures_size is None:
                 pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
-            except GLib.Error as e:
-                message = "Could not load pixbuf from '%s': %s" % (path, e.message)
-                error = True
-
-            if pixbuf != None:
-                h = pixbuf.get_height()
-                w = pixbuf.get_width()
-
-                try:
-                    if self.menu_pictures_size is None:
-                        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, w, h)
-                    else:
-                        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, -1, self.menu_pictures_size)
-                except GLib.Error as e:
-                    print('Caught GLib.Error exception: {}\npath: {}'.format(e, str(path)))
-
-                if pixbuf is None:
-                    return
-
-                surface = Gdk.cairo_surface_create_from_pixbuf(pixbuf, self.scale)
-                image = Gtk.Image()
-                image.set_size_request(self.menu_pictures_size / self.scale, self.menu_pictures_size / self.scale)
-                image.set_from_surface(surface)
-                menuitem = Gtk.MenuItem()
-                if title is not None:
-                    vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=2)
-                    vbox.add(image)
-                    label = Gtk.Label()
-                    label.set_text(title)
-                    vbox.add(label)
-                    menuitem.add(vbox)
-                else:
-                    menuitem.add(image)
-                if id is not None:
-                    menuitem.connect('activate', self._on_picture_selected, path, callback, id)
-                else:
-                    menuitem.connect('activate', self._on_picture_selected, path, callback)
-                self.menu.attach(menuitem, self.col, self.col+1, self.row, self.row+1)
-                self.col = (self.col+1) % self.num_cols
-                if (self.col == 0):
-                    self.row = self.row + 1
+            else:
+                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, -1, self.menu_pictures_size)
+        except GLib.Error as e:
+            print("Could not load pixbuf from '%s': %s" % (path, e.message))
+
+        with self.decoded_lock:
+            self.decoded.append((menu, menuitem, pixbuf, path))
+            if self.decoded_id == 0:
+                self.decoded_id = GLib.idle_add(self._add_decoded_pictures)
+
+    def _add_decoded_pictures(self):
+        # Decoded pictures are put in the menu in batches, so the loader threads don't cause a redraw each
+        start = time.monotonic()
+        while time.monotonic() - start < PICTURE_BATCH_TIME / 1000.0:
+            with self.decoded_lock:
+                if len(self.decoded) == 0:
+                    self.decoded_id = 0
+                    return False
+                menu, menuitem, pixbuf, path = self.decoded.popleft()
+
+            if menu is not self.menu:
+                # the menu was cleared in the meantime
+                continue
+            if pixbuf is None:
+                # the pictures after it move up, so there's no hole in the grid
+                self.remove_picture(menuitem)
+            else:
+                self.set_menu_picture(menuitem, pixbuf, path)
+
+        return True
+
+    def add_pixbuf(self, pixbuf, path, callback, title=None, id=None, position=None):
+        """ adds an already decoded picture to the menu and returns its menu item. pixbuf can be None if the
+            picture isn't ready yet, in which case it's filled in later with set_menu_picture(). The picture
+            goes after the others, unless a position among them is given"""
+        image = Gtk.Image()
+        if self.menu_pictures_size is not None:
+            image.set_size_request(self.menu_pictures_size / self.scale, self.menu_pictures_size / self.scale)
+        menuitem = Gtk.MenuItem()
+        menuitem.image = image
+        menuitem.loaded = False
+        self.n_pictures += 1
+        if title is not None:
+            vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=2)
+            vbox.add(image)
+            label = Gtk.Label()
+            label.set_text(title)
+            vbox.add(label)
+            menuitem.add(vbox)
+        else:
+            menuitem.add(image)
+        if pixbuf is None:
+            menuitem.path = path
+        else:
+            self.set_menu_picture(menuitem, pixbuf, path)
+        menuitem.connect('activate', self._on_menu_picture_selected, callback, id)
+        self.menu.attach(menuitem, self.col, self.col+1, self.row, self.row+1)
+        self.col = (self.col+1) % self.num_cols
+        if (self.col == 0):
+            self.row = self.row + 1
+
+        if position is None or position >= len(self.pictures):
+            self.pictures.append(menuitem)
+        else:
+            self.pictures.insert(position, menuitem)
+            self._layout_pictures()
+        return menuitem
+
+    def remove_picture(self, menuitem):
+        """ takes a picture out of the menu, the ones after it move up to fill its place"""
+        self.pictures.remove(menuitem)
+        self.n_pictures -= 1
+        if menuitem.loaded:
+            self.n_pictures_loaded -= 1
+        menuitem.destroy()
+        self._layout_pictures()
+        self._queue_update()
+
+    def _layout_pictures(self):
+        # puts the pictures in consecutive cells again, in the order of self.pictures
+        for index, menuitem in enumerate(self.pictures):
+            col = index % self.num_cols
+            row = index // self.num_cols
+            self.menu.child_set(menuitem, left_attach=col, right_attach=col+1, top_attach=row, bottom_attach=row+1)
+
+        # the next picture goes after the last one, unless something else was added below the pictures
+        if len(self.menu.get_children()) == len(self.pictures):
+            self.col = len(self.pictures) % self.num_cols
+            self.row = len(self.pictures) // self.num_cols
+
+    def set_menu_picture(self, menuitem, pixbuf, path):
+        menuitem.path = path
+        if pixbuf is not None:
+            surface = Gdk.cairo_surface_create_from_pixbuf(pixbuf, self.scale)
+            menuitem.image.set_from_surface(surface)
+
+        # a placeholder that couldn't be filled in (pixbuf is None) counts as done too
+        if not menuitem.loaded:
+            menuitem.loaded = True
+            self.n_pictures_loaded += 1
+            self._queue_update()
+
+    def _queue_update(self):
+        # the progress is only redrawn once per main loop iteration, however many pictures came in
+        if self.update_id == 0:
+            self.update_id = GLib.idle_add(self._update_progress)
+
+    def _update_progress(self):
+        self.update_id = 0
+        if self.n_pictures_loaded >= self.n_pictures:
+            self.reset_loading_progress()
+            self.emit('pictures-loaded')
+        else:
+            self.progress = float(self.n_pictures_loaded) / self.n_pictures
+            self.queue_draw()
+        return False
+
+    def _on_menu_picture_selected(self, menuitem, callback, id):
+        if menuitem.path is not None:
+            self._on_picture_selected(menuitem, menuitem.path, callback, id)
 
     def add_separator(self):
         self.row = self.row + 1
@@ -28,6 +28,9 @@ SETTING_TYPE_EXTERNAL = 2
 
 ROW_SIZE = 32
 
+# Height given to download rows whose widgets haven't been built yet
+DOWNLOAD_ROW_HEIGHT = 64
+
 UNSAFE_ITEMS = ['spawn_sync', 'spawn_command_line_sync', 'GTop', 'get_file_contents_utf8_sync']
 
 curr_ver = subprocess.check_output(['cinnamon', '--version']).decode("utf-8").splitlines()[0].split(' ')[1]
@@ -653,13 +656,11 @@ class ManageSpicesPage(SettingsPage):
         self.search_entry.grab_focus()
 
 
-class DownloadSpicesRow(Gtk.ListBoxRow):
-    def __init__(self, uuid, data, spices, size_groups):
-        super().__init__()
-
+class DownloadSpicesItem(object):
+    """ what the download page shows about a spice from the index, with its sort keys worked out up front"""
+    def __init__(self, uuid, data, spices):
         self.uuid = uuid
         self.data = data
-        self.spices = spices
         self.name = data['name']
         self.description = data['description']
         self.score = data['score']
@@ -678,11 +679,47 @@ class DownloadSpicesRow(Gtk.ListBoxRow):
             if key in data['translations'].keys():
                 self.description = data['translations'][key]
 
-        self.has_update = False
+        self.installed = spices.get_is_installed(uuid)
+        self.has_update = self.installed and spices.get_has_update(uuid)
+
+        self.sort_name = self.name.lower()
+
+        # a row only needs to be replaced when one of these changes
+        self.signature = (self.timestamp, self.score, self.name, self.description, self.author, self.installed, self.has_update)
+
+
+class DownloadSpicesRow(Gtk.ListBoxRow):
+    def __init__(self, item, spices):
+        super().__init__()
+
+        self.item = item
+        self.spices = spices
+        # the sort and filter functions read these from the row
+        self.uuid = item.uuid
+        self.data = item.data
+        self.name = item.name
+        self.description = item.description
+        self.score = item.score
+        self.timestamp = item.timestamp
+        self.author = item.author
+        self.installed = item.installed
+        self.has_update = item.has_update
+        self.sort_name = item.sort_name
 
         self.status_ids = {}
+        self.built = False
+
+        # the widgets are only created once the row is scrolled into view
+        self.set_size_request(-1, DOWNLOAD_ROW_HEIGHT)
+
+    def build(self, size_groups):
+        if self.built:
+            return
+        self.built = True
+        self.set_size_request(-1, -1)
 
-        self.installed = self.spices.get_is_installed(uuid)
+        uuid = self.uuid
+        spices = self.spices
 
         widget = SettingsWidget()
         widget.set_spacing(15)
@@ -758,13 +795,14 @@ class DownloadSpicesRow(Gtk.ListBoxRow):
             self.button_box.pack_start(download_button, False, False, 0)
             download_button.connect('clicked', self.download)
             download_button.set_tooltip_text(_("Install"))
-        elif self.spices.get_has_update(uuid):
-            self.has_update = True
+        elif self.has_update:
             download_button = Gtk.Button.new_from_icon_name('view-refresh-symbolic', 2)
             self.button_box.pack_start(download_button, False, False, 0)
             download_button.connect('clicked', self.download)
             download_button.set_tooltip_text(_("Update"))
 
+        self.show_all()
+
     def download(self, *args):
         self.spices.install(self.uuid)
 
@@ -797,7 +835,9 @@ class DownloadSpicesPage(SettingsPage):
         self.spices = spices
         self.window = window
         self.has_filter = False
-        self.extension_rows = []
+        self.extension_rows = {}
+        self.size_groups = [Gtk.SizeGroup.new(Gtk.SizeGroupMode.HORIZONTAL) for i in range(4)]
+        self.build_rows_id = 0
         self._signals = []
 
         self.top_box = Gtk.Box()
@@ -849,11 +889,14 @@ class DownloadSpicesPage(SettingsPage):
         main_box.pack_start(scw, True, True, 0)
         self.box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
         scw.add(self.box)
+        self.vadjustment = scw.get_vadjustment()
+        self.vadjustment.connect('value-changed', self.queue_build_visible_rows)
 
         self.list_box = Gtk.ListBox()
         self.list_box.set_selection_mode(Gtk.SelectionMode.SINGLE)
         self.list_box.set_header_func(list_header_func, None)
         self.list_box.connect('row-selected', self.on_row_selected)
+        self.list_box.connect('size-allocate', self.queue_build_visible_rows)
         self.box.add(self.list_box)
 
         button_toolbar = Gtk.Toolbar.new()
@@ -924,11 +967,32 @@ class DownloadSpicesPage(SettingsPage):
             self.list_box.set_filter_func(filter_row, self.search_entry)
             self.has_filter = True
 
+    def queue_build_visible_rows(self, *args):
+        if self.build_rows_id == 0:
+            self.build_rows_id = GLib.idle_add(self.build_visible_rows)
+
+    def build_visible_rows(self):
+        # Creates the widgets of the rows that are on screen, plus a page above and below
+        self.build_rows_id = 0
+        page_size = self.vadjustment.get_page_size()
+        y = max(0, self.vadjustment.get_value() - page_size)
+        end = self.vadjustment.get_value() + 2 * page_size
+
+        while y < end:
+            row = self.list_box.get_row_at_y(y)
+            if row is None:
+                break
+            row.build(self.size_groups)
+            allocation = row.get_allocation()
+            y = max(y + 1, allocation.y + allocation.height)
+
+        return False
+
     def sort_changed(self, *args):
         def sort_name(row1, row2):
-            if row2.name.lower() == row1.name.lower():
+            if row2.sort_name == row1.sort_name:
                 return 0
-            elif row2.name.lower() < row1.name.lower():
+            elif row2.sort_name < row1.sort_name:
                 return 1
             else:
                 return -1
@@ -994,17 +1058,22 @@ class DownloadSpicesPage(SettingsPage):
         if spices_data == None:
             return
 
-        if len(self.extension_rows) > 0:
-            for row in self.extension_rows:
-                row.destroy()
-            self.extension_rows = []
-
-        size_groups = [Gtk.SizeGroup.new(Gtk.SizeGroupMode.HORIZONTAL) for i in range(4)]
+        # Only the rows of spices that changed (or whose installed state changed) are replaced
+        for uuid in list(self.extension_rows.keys()):
+            if uuid not in spices_data:
+                self.extension_rows.pop(uuid).destroy()
 
         for uuid, data in spices_data.items():
-            row = DownloadSpicesRow(uuid, data, self.spices, size_groups)
-            self.extension_rows.append(row)
+            item = DownloadSpicesItem(uuid, data, self.spices)
+            old_row = self.extension_rows.get(uuid)
+            if old_row is not None:
+                if old_row.item.signature == item.signature:
+                    continue
+                old_row.destroy()
+            row = DownloadSpicesRow(item, self.spices)
+            self.extension_rows[uuid] = row
             self.list_box.add(row)
+            row.show()
 
         updates_available = self.spices.get_n_updates()
         self.update_all_button.set_sensitive(updates_available)
@@ -1014,7 +1083,7 @@ class DownloadSpicesPage(SettingsPage):
             msg_text = _("No updates available")
         self.update_all_button.set_tooltip_text(msg_text)
         self.refresh_button.set_sensitive(True)
-        self.list_box.show_all()
+        self.queue_build_visible_rows()
 
     def get_more_info(self, *args):
         extension_row = self.list_box.get_selected_row()
@@ -4,6 +4,7 @@ try:
     from gi.repository import Gio, Gtk, GObject, Gdk, GdkPixbuf, GLib
     import tempfile
     import os
+    import re
     import sys
     import zipfile
     import shutil
@@ -13,14 +14,16 @@ try:
     import dbus
     from PIL import Image
     import datetime
+    import hashlib
     import proxygsettings
     import time
+    from collections import namedtuple
+    from concurrent.futures import ThreadPoolExecutor
 except Exception as detail:
     print(detail)
     sys.exit(1)
 
-from http.client import HTTPSConnection
-from urllib.parse import urlparse
+from downloader import Downloader
 
 try:
     import json
@@ -31,7 +34,8 @@ home = os.path.expanduser("~")
 locale_inst = '%s/.local/share/locale' % home
 settings_dir = '%s/.cinnamon/configs/' % home
 
-URL_SPICES_HOME = "https://cinnamon-spices.linuxmint.com"
+# Can be pointed at a local server for testing
+URL_SPICES_HOME = os.environ.get("CINNAMON_SPICES_URL", "https://cinnamon-spices.linuxmint.com")
 URL_MAP = {
     'applet': URL_SPICES_HOME + "/json/applets.json",
     'theme': URL_SPICES_HOME + "/json/themes.json",
@@ -43,6 +47,20 @@ ABORT_NONE = 0
 ABORT_ERROR = 1
 ABORT_USER = 2
 
+# Number of spices that are downloaded and unpacked at the same time when installing several at once
+MAX_PARALLEL_INSTALLS = 4
+
+METADATA_INDEX_VERSION = 1
+
+# Spices are unpacked into hidden .<uuid>-XXXXXXXX folders next to where they're installed, these are
+# left behind if an install is killed. Those that are older than this (in seconds) are cleaned up,
+# newer ones may belong to an install that's still running in another window
+STAGING_FOLDER_RE = re.compile(r'^\..+-[a-z0-9_]{8}$')
+STALE_STAGING_AGE = 60 * 60
+
+# Shared by all the Spice_Harvesters so they reuse each other's connections
+downloader = Downloader()
+
 def ui_thread_do(callback, *args):
     GLib.idle_add (callback, *args, priority=GLib.PRIORITY_DEFAULT)
 
@@ -125,6 +143,86 @@ class ThreadedTaskManager(GObject.GObject):
                 self.abort_status = True
                 del self.jobs[:]
 
+# One entry of enabled-applets, enabled-desklets or enabled-extensions. panel, box and position are only
+# set for applets, and instance_id is None for extensions. entry is the string as it's stored in the key.
+EnabledInstance = namedtuple('EnabledInstance', ('uuid', 'instance_id', 'panel', 'box', 'position', 'entry'))
+
+def parse_enabled_entry(collection_type, entry):
+    """ parses an entry of the enabled list of the given type into an EnabledInstance, or returns None if it's malformed"""
+    info = entry.split(':')
+    try:
+        if collection_type == 'applet':
+            # panel1:right:0:uuid:id
+            return EnabledInstance(info[3].strip('!'), info[4] if len(info) > 4 else None,
+                                   int(info[0][5:]), info[1], int(info[2]), entry)
+        elif collection_type == 'desklet':
+            # uuid:id:x:y
+            return EnabledInstance(info[0].strip('!'), info[1] if len(info) > 1 else None, None, None, None, entry)
+        else:
+            return EnabledInstance(entry.strip('!'), None, None, None, None, entry)
+    except (IndexError, ValueError):
+        return None
+
+def get_enabled_key(collection_type):
+    """ returns the name of the org.cinnamon key that lists the enabled spices of the given type"""
+    return 'enabled-%ss' % collection_type.replace('_', '-')
+
+class EnabledSpices(GObject.Object):
+    """ parsed view of the enabled list of a spice type. The key is only read again after it changed, and
+        'changed' is emitted once the new contents can be looked up."""
+    __gsignals__ = {
+        'changed': (GObject.SignalFlags.RUN_FIRST, None, ())
+    }
+
+    def __init__(self, collection_type, settings=None):
+        super(EnabledSpices, self).__init__()
+        self.collection_type = collection_type
+        self.key = get_enabled_key(collection_type)
+        self.settings = settings if settings is not None else Gio.Settings.new('org.cinnamon')
+
+        self._instances = []
+        self._by_uuid = {}
+        # GSettings aborts when asked for a key it doesn't know, a type without one has nothing enabled
+        if not self.settings.props.settings_schema.has_key(self.key):
+            return
+        self._load()
+        self.settings.connect('changed::%s' % self.key, self._on_changed)
+
+    def _load(self):
+        self._instances = []
+        self._by_uuid = {}
+        for entry in self.settings.get_strv(self.key):
+            instance = parse_enabled_entry(self.collection_type, entry)
+            if instance is None:
+                print("Ignoring malformed entry in %s: %s" % (self.key, entry))
+                continue
+            self._instances.append(instance)
+            self._by_uuid.setdefault(instance.uuid, []).append(instance)
+
+    def _on_changed(self, *args):
+        self._load()
+        self.emit('changed')
+
+    def get_all(self):
+        """ returns every enabled instance, in the order of the key"""
+        return self._instances
+
+    def get_instances(self, uuid):
+        """ returns the enabled instances of the given uuid"""
+        return self._by_uuid.get(uuid, [])
+
+    def get_count(self, uuid):
+        """ returns the number of enabled instances of the given uuid"""
+        return len(self._by_uuid.get(uuid, ()))
+
+# Every Spice_Harvester of a type (and anything else that needs the enabled list) shares one EnabledSpices
+_enabled_spices = {}
+
+def get_enabled_spices(collection_type):
+    if collection_type not in _enabled_spices:
+        _enabled_spices[collection_type] = EnabledSpices(collection_type)
+    return _enabled_spices[collection_type]
+
 class Spice_Harvester(GObject.Object):
     __gsignals__ = {
         'installed-changed': (GObject.SignalFlags.RUN_FIRST, None, ()),
@@ -140,6 +238,12 @@ class Spice_Harvester(GObject.Object):
         self.themes = collection_type == 'theme'
         self.index_cache = {}
         self.meta_map = {}
+        # Parsed metadata.json of every spice folder, so only the ones that changed are read again
+        self.metadata_index_path = os.path.join(GLib.get_user_cache_dir(), 'cinnamon-settings', 'spices-%s.json' % collection_type)
+        self.metadata_index = {}
+        self.metadata_index_dirty = False
+        self.changed_uuids = set()
+        self.changed_uuids_id = 0
         self.download_manager = ThreadedTaskManager(10)
         self._proxy = None
         self._proxy_deferred_actions = []
@@ -154,15 +258,27 @@ class Spice_Harvester(GObject.Object):
         self.total_jobs = 0
         self.download_total_files = 0
         self.download_current_file = 0
+        self.install_total = 0
+        self.install_done = 0
+        self.install_lock = threading.Lock()
         self.cache_folder = '%s/.cinnamon/spices.cache/%s/' % (home, self.collection_type)
+        # Interrupted spice downloads are kept here so they can be resumed
+        self.download_folder = '%s/.cinnamon/spices.cache/downloads/' % home
+        self.proxy = None
+        # ETag, Last-Modified and sha1 of index.json and of each thumbnail, by file name
+        self.validators = {}
+        self.validators_lock = threading.Lock()
 
         if self.themes:
             self.settings = Gio.Settings.new('org.cinnamon.theme')
             self.enabled_key = 'name'
+            self.enabled_spices = None
+            self.settings.connect('changed::%s' % self.enabled_key, self._update_status)
         else:
             self.settings = Gio.Settings.new('org.cinnamon')
-            self.enabled_key = 'enabled-%ss' % self.collection_type
-        self.settings.connect('changed::%s' % self.enabled_key, self._update_status)
+            self.enabled_key = get_enabled_key(self.collection_type)
+            self.enabled_spices = get_enabled_spices(self.collection_type)
+            self.enabled_spices.connect('changed', self._update_status)
 
         if self.themes:
             self.install_folder = '%s/.themes/' % (home)
@@ -171,18 +287,22 @@ class Spice_Harvester(GObject.Object):
             self.install_folder = '%s/.local/share/cinnamon/%ss/' % (home, self.collection_type)
             self.spices_directories = ('/usr/share/cinnamon/%ss/' % self.collection_type, self.install_folder)
 
+        self._load_metadata_index()
         self._load_metadata()
 
         self._load_cache()
+        self._load_validators()
 
         self.abort_download = ABORT_NONE
         self._sigLoadFinished = None
 
+        self._remove_stale_staging_folders()
+
         self.monitorId = 0
         self.monitor = None
         try:
             self.monitor = Gio.File.new_for_path(self.install_folder).monitor_directory(0, None)
-            self.monitorId = self.monitor.connect('changed', self._directory_changed)
+            self.monitorId = self.monitor.connect('changed', self._on_monitor_changed)
         except Exception as e:
             # File monitors can fail when the OS runs out of file handles
             print(e)
@@ -292,20 +412,33 @@ class Spice_Harvester(GObject.Object):
             progressbar.revealer.set_reveal_child(visible)
 
     # updates any progress bars with the download progress
-    def _update_progress(self, count, blockSize, totalSize):
+    def _update_progress(self, received, total):
         if self.download_manager.busy() and self.download_total_files > 1:
             total = self.download_total_files
             current = total - self.download_manager.get_n_jobs()
             fraction = float(current) / float(total)
             text = "%s %i/%i" % (_("Downloading images:"), current, total)
             self._set_progressbar_text(text)
+        elif self.install_total > 1:
+            # several spices are downloading at once, so show how many of them are done instead
+            fraction = float(self.install_done) / float(self.install_total)
+        elif total:
+            fraction = float(received) / float(total)
         else:
-            fraction = count * blockSize / float((totalSize / blockSize + 1) * (blockSize))
+            return
 
         self._set_progressbar_fraction(fraction)
 
-        while Gtk.events_pending():
-            Gtk.main_iteration()
+    # called from the download threads, no more than downloader.PROGRESS_RATE times per second per download
+    def _report_progress(self, received, total):
+        ui_thread_do(self._update_progress, received, total)
+
+    def _update_proxy(self):
+        try:
+            self.proxy = proxygsettings.get_proxy_settings().get('https')
+        except Exception as e:
+            print("Could not read the proxy settings: %s" % e)
+            self.proxy = None
 
     # Jobs are added by calling _push_job. _process_job and _advance_queue form a wrapper that runs the job in it's own thread.
     def _push_job(self, job):
@@ -325,6 +458,11 @@ class Spice_Harvester(GObject.Object):
         if self.monitorId > 0:
             self.monitor.disconnect(self.monitorId)
             self.monitorId = 0
+        # Everything is checked once the queue is done
+        if self.changed_uuids_id > 0:
+            GLib.source_remove(self.changed_uuids_id)
+            self.changed_uuids_id = 0
+            self.changed_uuids.clear()
 
         self.processing_jobs = True
         if self.is_downloading_image_cache:
@@ -350,82 +488,134 @@ class Spice_Harvester(GObject.Object):
             self._set_progressbar_text('')
             if self.monitor is not None:
                 try:
-                    self.monitorId = self.monitor.connect('changed', self._directory_changed)
+                    self.monitorId = self.monitor.connect('changed', self._on_monitor_changed)
                 except Exception as e:
                     # File monitors can fail when the OS runs out of file handles
                     print(e)
             self._directory_changed()
 
-    def _download(self, out_file, url, binary=True):
-        timestamp = round(time.time())
-        url = "%s?time=%d" % (url, timestamp)
+    def _download(self, out_file, url, resume=False, headers=None):
         print("Downloading from %s" % url)
         try:
-            open_args = 'wb' if binary else 'w'
-            with open(out_file, open_args) as outfd:
-                self._url_retrieve(url, outfd, self._update_progress, binary)
+            # With resume, whatever is already in out_file is kept and only the rest is requested
+            with open(out_file, 'ab' if resume else 'wb') as outfd:
+                result = downloader.fetch(url, outfd, self.proxy, headers=headers, offset=outfd.tell(),
+                                          reporthook=self._report_progress, is_aborted=self._is_aborted)
         except Exception as e:
-            try:
-                os.remove(out_file)
-            except OSError:
-                pass
+            if not resume:
+                try:
+                    os.remove(out_file)
+                except OSError:
+                    pass
             if not isinstance(e, KeyboardInterrupt) and not self.download_manager.abort_status:
                 self.errorMessage(_("An error occurred while trying to access the server. Please try again in a little while."), e)
             self.abort()
             return None
 
-        return out_file
+        return result
+
+    def _download_if_changed(self, out_file, url, force=False):
+        """ downloads url to out_file unless the copy we have is still current. Returns True if
+            out_file changed, False if it didn't and None if the download failed."""
+        name = os.path.basename(out_file)
+        with self.validators_lock:
+            validator = self.validators.get(name)
+
+        headers = {}
+        if validator is not None and not force and os.path.isfile(out_file):
+            if validator.get('etag'):
+                headers['If-None-Match'] = validator['etag']
+            if validator.get('last-modified'):
+                headers['If-Modified-Since'] = validator['last-modified']
+
+        tmp_file = out_file + '.part'
+        result = self._download(tmp_file, url, headers=headers)
+        if result is None:
+            return None
+
+        status, response_headers = result
+        if status == 304:
+            os.remove(tmp_file)
+            return False
+
+        with open(tmp_file, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        changed = force or validator is None or validator.get('sha1') != digest or not os.path.isfile(out_file)
+        os.replace(tmp_file, out_file)
 
-    def _url_retrieve(self, url, outfd, reporthook, binary):
-        #Like the one in urllib. Unlike urllib.retrieve url_retrieve
-        #can be interrupted. KeyboardInterrupt exception is raised when
-        #interrupted.
-        count = 0
-        blockSize = 1024 * 8
-        parsed_url = urlparse(url)
-        host = parsed_url.netloc
+        with self.validators_lock:
+            self.validators[name] = {
+                'etag': response_headers.get('ETag'),
+                'last-modified': response_headers.get('Last-Modified'),
+                'sha1': digest
+            }
+
+        return changed
+
+    def _load_metadata_index(self):
         try:
-            proxy = proxygsettings.get_proxy_settings()
-            if proxy and proxy.get('https'):
-                connection = HTTPSConnection(proxy.get('https'), timeout=15)
-                connection.set_tunnel(host)
-            else:
-                connection = HTTPSConnection(host, timeout=15)
-            headers = { "Accept-Encoding": "identity", "Host": host, "User-Agent": "Python/3" }
-            full_path = "%s?%s" % (parsed_url.path, parsed_url.query)
-            connection.request("GET", full_path, headers=headers)
-            urlobj = connection.getresponse()
-            assert urlobj.getcode() == 200
-
-            totalSize = int(urlobj.info()['content-length'])
-
-            while not self._is_aborted():
-                data = urlobj.read(blockSize)
-                count += 1
-                if not data:
-                    break
-                if not binary:
-                    data = data.decode("utf-8")
-                outfd.write(data)
-                ui_thread_do(reporthook, count, blockSize, totalSize)
-        except Exception as e:
-            raise e
+            with open(self.metadata_index_path, 'r') as f:
+                index = json.load(f)
+            if index['version'] == METADATA_INDEX_VERSION:
+                self.metadata_index = index['entries']
+        except (OSError, ValueError, KeyError, TypeError):
+            self.metadata_index = {}
+
+    def _save_metadata_index(self):
+        if not self.metadata_index_dirty:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.metadata_index_path), exist_ok=True)
+            with open(self.metadata_index_path + '.tmp', 'w') as f:
+                json.dump({'version': METADATA_INDEX_VERSION, 'entries': self.metadata_index}, f)
+            os.replace(self.metadata_index_path + '.tmp', self.metadata_index_path)
+            self.metadata_index_dirty = False
+        except OSError as detail:
+            print("Could not save the spices metadata index: %s" % detail)
+
+    def _forget_metadata(self, subdirectory):
+        if self.metadata_index.pop(subdirectory, None) is not None:
+            self.metadata_index_dirty = True
+
+    def _read_metadata(self, subdirectory):
+        # metadata.json is only parsed again if its mtime or size changed since it was indexed
+        meta_path = os.path.join(subdirectory, 'metadata.json')
+        try:
+            stat = os.stat(meta_path)
+        except OSError:
+            self._forget_metadata(subdirectory)
+            raise
+
+        entry = self.metadata_index.get(subdirectory)
+        if entry is None or entry['mtime'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+            with open(meta_path) as f:
+                json_data = f.read()
+            entry = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'metadata': json.loads(json_data)}
+            self.metadata_index[subdirectory] = entry
+            self.metadata_index_dirty = True
+
+        metadata = dict(entry['metadata'])
+        metadata['path'] = subdirectory
+        metadata['writable'] = os.access(subdirectory, os.W_OK)
+        return metadata
 
     def _load_metadata(self):
         self.meta_map = {}
+        found = set()
 
         for directory in self.spices_directories:
             if os.path.exists(directory):
                 extensions = os.listdir(directory)
 
                 for uuid in extensions:
+                    # hidden folders are installs in progress
+                    if uuid.startswith('.'):
+                        continue
                     subdirectory = os.path.join(directory, uuid)
+                    found.add(subdirectory)
                     try:
-                        json_data = open(os.path.join(subdirectory, 'metadata.json')).read()
-                        metadata = json.loads(json_data)
-                        metadata['path'] = subdirectory
-                        metadata['writable'] = os.access(subdirectory, os.W_OK)
-                        self.meta_map[uuid] = metadata
+                        self.meta_map[uuid] = self._read_metadata(subdirectory)
                     except Exception as detail:
                         print(detail)
                         print("Skipping %s: there was a problem trying to read metadata.json" % uuid)
@@ -433,6 +623,73 @@ class Spice_Harvester(GObject.Object):
                 print("%s does not exist! Creating it now." % directory)
                 subprocess.call(["mkdir", "-p", directory])
 
+        for subdirectory in list(self.metadata_index.keys()):
+            if subdirectory not in found:
+                self._forget_metadata(subdirectory)
+
+        self._save_metadata_index()
+
+    def _update_metadata(self, uuids):
+        # like _load_metadata, but only for the given uuids
+        for uuid in uuids:
+            self.meta_map.pop(uuid, None)
+
+            # a spice in the user folder overrides the system one
+            for directory in self.spices_directories:
+                subdirectory = os.path.join(directory, uuid)
+                if not os.path.isdir(subdirectory):
+                    self._forget_metadata(subdirectory)
+                    continue
+                try:
+                    self.meta_map[uuid] = self._read_metadata(subdirectory)
+                except Exception as detail:
+                    print(detail)
+                    print("Skipping %s: there was a problem trying to read metadata.json" % uuid)
+
+        self._save_metadata_index()
+
+    def _remove_stale_staging_folders(self):
+        try:
+            entries = list(os.scandir(self.install_folder))
+        except OSError:
+            return
+
+        for entry in entries:
+            try:
+                if STAGING_FOLDER_RE.match(entry.name) and entry.is_dir(follow_symlinks=False) and \
+                   time.time() - entry.stat(follow_symlinks=False).st_mtime > STALE_STAGING_AGE:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def _make_staging_folder(self, uuid):
+        # A fresh profile may not have the install folder yet
+        os.makedirs(self.install_folder, mode=0o755, exist_ok=True)
+        return tempfile.mkdtemp(prefix='.%s-' % uuid, dir=self.install_folder)
+
+    def _on_monitor_changed(self, monitor, file, other_file, event_type):
+        for changed_file in (file, other_file):
+            if changed_file is None or changed_file.get_path() is None:
+                continue
+            uuid = os.path.relpath(changed_file.get_path(), self.install_folder).split(os.sep)[0]
+            # hidden entries are the staging folders of installs, not spices
+            if not uuid.startswith('.'):
+                self.changed_uuids.add(uuid)
+
+        # the monitor usually sends several events for one change, so they're handled together
+        if self.changed_uuids and self.changed_uuids_id == 0:
+            self.changed_uuids_id = GLib.timeout_add(100, self._process_changed_uuids)
+
+    def _process_changed_uuids(self):
+        self.changed_uuids_id = 0
+        uuids = self.changed_uuids
+        self.changed_uuids = set()
+
+        self._update_metadata(uuids)
+        self._generate_update_list()
+        self.emit("installed-changed")
+        return False
+
     def _directory_changed(self, *args):
         self._load_metadata()
         self._generate_update_list()
@@ -458,17 +715,18 @@ class Spice_Harvester(GObject.Object):
 
     def get_enabled(self, uuid):
         """ returns the number of instances currently enabled"""
-        enabled_count = 0
         if not self.themes:
-            enabled_list = self.settings.get_strv(self.enabled_key)
-            for item in enabled_list:
-                item = item.replace("!", "")
-                if uuid in item.split(":"):
-                    enabled_count += 1
+            return self.enabled_spices.get_count(uuid)
         elif self.settings.get_string(self.enabled_key) == uuid:
-            enabled_count = 1
+            return 1
+
+        return 0
 
-        return enabled_count
+    def get_enabled_instances(self, uuid):
+        """ returns the EnabledInstances of the given uuid"""
+        if self.themes:
+            return []
+        return self.enabled_spices.get_instances(uuid)
 
     def get_is_running(self, uuid):
         """ checks whether the spice is currently running (it may be enabled but not running if
@@ -510,6 +768,24 @@ class Spice_Harvester(GObject.Object):
 
         self._generate_update_list()
 
+    def _load_validators(self):
+        try:
+            with open(os.path.join(self.cache_folder, 'validators.json'), 'r') as f:
+                self.validators = json.load(f)
+        except (OSError, ValueError):
+            self.validators = {}
+
+    def _save_validators(self):
+        with self.validators_lock:
+            validators = dict(self.validators)
+        try:
+            filename = os.path.join(self.cache_folder, 'validators.json')
+            with open(filename + '.tmp', 'w') as f:
+                json.dump(validators, f)
+            os.replace(filename + '.tmp', filename)
+        except OSError as detail:
+            print("Could not save the spices cache validators: %s" % detail)
+
     def _generate_update_list(self):
         self.updates_available = []
         for uuid in self.index_cache:
@@ -528,10 +804,13 @@ class Spice_Harvester(GObject.Object):
         download_url = URL_MAP[self.collection_type]
 
         filename = os.path.join(self.cache_folder, "index.json")
-        if self._download(filename, download_url, binary=False) is None:
+        self._update_proxy()
+        changed = self._download_if_changed(filename, download_url, force=not self.has_cache)
+        if changed is None:
             return
 
-        self._load_cache()
+        if changed:
+            self._load_cache()
         self._download_image_cache()
 
     def _download_image_cache(self):
@@ -553,9 +832,13 @@ class Spice_Harvester(GObject.Object):
 
             icon_path = os.path.join(self.cache_folder, icon_basename)
 
-            # if the image doesn't exist, is corrupt, or may have changed we want to download it
-            if not os.path.isfile(icon_path) or self._is_bad_image(icon_path) or self.old_cache[uuid]["last_edited"] != self.index_cache[uuid]["last_edited"]:
-                self.download_manager.push(self._download, self._check_download_image_cache_complete, (icon_path, download_url))
+            # if the image doesn't exist or is corrupt we want to download it, and if the spice was edited
+            # we ask the server for it in case the image changed too
+            if not os.path.isfile(icon_path) or self._is_bad_image(icon_path):
+                self.download_manager.push(self._download_if_changed, self._check_download_image_cache_complete, (icon_path, download_url, True))
+                self.download_total_files += 1
+            elif uuid not in self.old_cache or self.old_cache[uuid]["last_edited"] != info["last_edited"]:
+                self.download_manager.push(self._download_if_changed, self._check_download_image_cache_complete, (icon_path, download_url))
                 self.download_total_files += 1
 
         ui_thread_do(self._check_download_image_cache_complete)
@@ -569,7 +852,7 @@ class Spice_Harvester(GObject.Object):
         trash = []
         flist = os.listdir(self.cache_folder)
         for f in flist:
-            if f not in self.used_thumbs and f != "index.json":
+            if f not in self.used_thumbs and f not in ("index.json", "validators.json"):
                 trash.append(f)
         for t in trash:
             try:
@@ -577,6 +860,12 @@ class Spice_Harvester(GObject.Object):
             except:
                 pass
 
+        with self.validators_lock:
+            for name in list(self.validators.keys()):
+                if name not in self.used_thumbs and name != "index.json":
+                    del self.validators[name]
+        self._save_validators()
+
         self.download_total_files = 0
         self.download_current_file = 0
         self.is_downloading_image_cache = False
@@ -601,43 +890,120 @@ class Spice_Harvester(GObject.Object):
 
     def install(self, uuid):
         """ downloads and installs the given extension"""
-        job = {'uuid': uuid, 'func': self._install, 'callback': self._install_finished}
-        job['progress_text'] = _("Installing %s") % uuid
-        self._push_job(job)
+        self._push_install([uuid])
+
+    def _push_install(self, uuids):
+        # Installs queued one after the other are merged into a single job so they are downloaded
+        # in parallel. Only the last job is considered, so the order relative to uninstalls is kept.
+        if len(self.jobs) > 0 and self.jobs[-1]['func'] == self._install:
+            job = self.jobs[-1]
+            job['uuids'] += [uuid for uuid in uuids if uuid not in job['uuids']]
+        else:
+            job = {'uuids': list(uuids), 'func': self._install, 'callback': self._install_finished}
+
+        if len(job['uuids']) == 1:
+            job['progress_text'] = _("Installing %s") % job['uuids'][0]
+        else:
+            job['progress_text'] = ngettext("Installing %d spice", "Installing %d spices", len(job['uuids'])) % len(job['uuids'])
+
+        if job not in self.jobs:
+            self._push_job(job)
 
     def _install(self, job):
-        uuid = job['uuid']
+        uuids = [uuid for uuid in job['uuids'] if uuid in self.index_cache]
+
+        self._update_proxy()
+        self.install_total = len(uuids)
+        self.install_done = 0
 
+        # Downloads and extraction run in the pool. Each spice is unpacked next to its final location,
+        # so committing it is just a rename and a failed install leaves the installed version untouched.
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL_INSTALLS) as pool:
+            staged = list(pool.map(self._download_and_stage, uuids))
+
+        job['installed'] = []
+        for uuid, tempfolder in zip(uuids, staged):
+            if tempfolder is None:
+                continue
+            try:
+                self._commit_install(uuid, os.path.join(tempfolder, uuid))
+                job['installed'].append(uuid)
+            except Exception as detail:
+                self.errorMessage(_("An error occurred during the installation of %s. Please report this incident to its developer.") % uuid, str(detail))
+            shutil.rmtree(tempfolder, ignore_errors=True)
+
+        self.install_total = 0
+        self.install_done = 0
+
+    def _download_and_stage(self, uuid):
+        """ downloads, verifies and unpacks a spice from the server. Returns the temporary folder
+            holding the unpacked spice, or None if something went wrong"""
         download_url = URL_SPICES_HOME + self.index_cache[uuid]['file']
-        self.current_uuid = uuid
 
-        fd, ziptempfile = tempfile.mkstemp()
+        # The version is part of the name, so a partial download is only ever resumed from the same file
+        ziptempfile = self._get_partial_download(uuid, self.index_cache[uuid].get('last_edited', 0))
 
-        if self._download(ziptempfile, download_url) is None:
-            return
+        result = self._download(ziptempfile, download_url, resume=True)
+        if result is not None:
+            tempfolder = None
+            try:
+                with zipfile.ZipFile(ziptempfile) as zip:
+                    bad_file = zip.testzip()
+                    if bad_file is not None:
+                        raise zipfile.BadZipFile("%s is corrupt" % bad_file)
+
+                    tempfolder = self._make_staging_folder(uuid)
+                    zip.extractall(tempfolder)
+
+                self._prepare_install(os.path.join(tempfolder, uuid), uuid, True)
+            except Exception as detail:
+                if tempfolder is not None:
+                    shutil.rmtree(tempfolder, ignore_errors=True)
+                tempfolder = None
+                if not self.abort_download:
+                    self.errorMessage(_("An error occurred during the installation of %s. Please report this incident to its developer.") % uuid, str(detail))
+
+            # Either it's unpacked or it's broken, the zip isn't needed anymore
+            try:
+                os.remove(ziptempfile)
+            except OSError:
+                pass
+        else:
+            tempfolder = None
 
-        try:
-            zip = zipfile.ZipFile(ziptempfile)
+        with self.install_lock:
+            self.install_done += 1
+        self._report_progress(0, 0)
 
-            tempfolder = tempfile.mkdtemp()
-            zip.extractall(tempfolder)
+        return tempfolder
 
-            uuidfolder = os.path.join(tempfolder, uuid)
+    def _get_partial_download(self, uuid, version):
+        os.makedirs(self.download_folder, mode=0o755, exist_ok=True)
+        filename = '%s-%s.zip.part' % (uuid, version)
 
-            self.install_from_folder(uuidfolder, uuid, True)
-        except Exception as detail:
-            if not self.abort_download:
-                self.errorMessage(_("An error occurred during the installation of %s. Please report this incident to its developer.") % uuid, str(detail))
-            return
+        # Partial downloads of other versions of this spice are useless now
+        for f in os.listdir(self.download_folder):
+            if f != filename and f.endswith('.zip.part') and f.rsplit('-', 1)[0] == uuid:
+                try:
+                    os.remove(os.path.join(self.download_folder, f))
+                except OSError:
+                    pass
 
-        try:
-            shutil.rmtree(tempfolder)
-            os.remove(ziptempfile)
-        except Exception:
-            pass
+        return os.path.join(self.download_folder, filename)
 
     def install_from_folder(self, folder, uuid, from_spices=False):
         """ installs a spice from a specified folder"""
+        tempfolder = self._make_staging_folder(uuid)
+        try:
+            staged = os.path.join(tempfolder, uuid)
+            shutil.copytree(folder, staged)
+            self._prepare_install(staged, uuid, from_spices)
+            self._commit_install(uuid, staged)
+        finally:
+            shutil.rmtree(tempfolder, ignore_errors=True)
+
+    def _prepare_install(self, folder, uuid, from_spices):
+        # gets an unpacked spice ready to be moved into place
         contents = os.listdir(folder)
 
         if not self.themes:
@@ -651,18 +1017,12 @@ class Spice_Harvester(GObject.Object):
                         os.makedirs(locale_dir, mode=0o755, exist_ok=True)
                         subprocess.call(['msgfmt', '-c', os.path.join(po_dir, file), '-o', os.path.join(locale_dir, '%s.mo' % uuid)])
 
-        dest = os.path.join(self.install_folder, uuid)
-        if os.path.exists(dest):
-            shutil.rmtree(dest)
-        shutil.copytree(folder, dest)
-
-        if not self.themes:
             # ensure proper file permissions
-            for root, dirs, files in os.walk(dest):
+            for root, dirs, files in os.walk(folder):
                 for file in files:
                     os.chmod(os.path.join(root, file), 0o755)
 
-        meta_path = os.path.join(dest, 'metadata.json')
+        meta_path = os.path.join(folder, 'metadata.json')
         if self.themes and not os.path.exists(meta_path):
             md = {}
         else:
@@ -681,10 +1041,29 @@ class Spice_Harvester(GObject.Object):
         file.write(raw_meta)
         file.close()
 
+    def _commit_install(self, uuid, folder):
+        # swaps the prepared folder in for the installed one, both live in install_folder so these are renames
+        dest = os.path.join(self.install_folder, uuid)
+        old = None
+        if os.path.exists(dest):
+            old = self._make_staging_folder(uuid)
+            os.rename(dest, os.path.join(old, uuid))
+
+        try:
+            os.rename(folder, dest)
+        except OSError:
+            if old is not None:
+                os.rename(os.path.join(old, uuid), dest)
+                shutil.rmtree(old, ignore_errors=True)
+            raise
+
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+
     def _install_finished(self, job):
-        uuid = job['uuid']
-        if self.get_enabled(uuid):
-            self.send_proxy_signal('ReloadXlet', '(ss)', uuid, self.collection_type.upper())
+        for uuid in job.get('installed', []):
+            if self.get_enabled(uuid):
+                self.send_proxy_signal('ReloadXlet', '(ss)', uuid, self.collection_type.upper())
 
     def uninstall(self, uuid):
         """ uninstalls and removes the given extension"""
@@ -714,8 +1093,7 @@ class Spice_Harvester(GObject.Object):
 
     def update_all(self):
         """ applies all available updates"""
-        for uuid in self.updates_available:
-            self.install(uuid)
+        self._push_install(self.updates_available)
 
     def abort(self, abort_type=ABORT_USER):
         """ trigger in-progress download to halt"""
@@ -778,18 +1156,11 @@ class Spice_Harvester(GObject.Object):
             self.settings.set_strv(self.enabled_key, enabled)
 
     def disable_extension(self, uuid):
-        enabled_extensions = self.settings.get_strv(self.enabled_key)
         new_list = []
-        for enabled_extension in enabled_extensions:
-            if self.collection_type == 'applet':
-                enabled_uuid = enabled_extension.split(':')[3].strip('!')
-            elif self.collection_type == 'desklet':
-                enabled_uuid = enabled_extension.split(':')[0].strip('!')
-            else:
-                enabled_uuid = enabled_extension
-
-            if enabled_uuid != uuid:
-                new_list.append(enabled_extension)
+        for entry in self.settings.get_strv(self.enabled_key):
+            instance = parse_enabled_entry(self.collection_type, entry)
+            if instance is None or instance.uuid != uuid:
+                new_list.append(entry)
         self.settings.set_strv(self.enabled_key, new_list)
 
     def get_icon(self, uuid):
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+
+# HTTPS download engine used by Spices.
+#
+# Connections are kept alive and shared between downloads to the same host
+# (through the same proxy), reads use a buffer that grows while the
+# connection keeps up, progress is reported at most PROGRESS_RATE times per
+# second, and downloads can continue from an offset using a Range request.
+#
+# It doesn't depend on Gtk, so it can be used (and tried out against a local
+# HTTPS server) on its own.
+
+import threading
+import time
+from http.client import HTTPSConnection, HTTPException
+from urllib.parse import urlparse
+
+MIN_BLOCK_SIZE = 16 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+PROGRESS_RATE = 30
+MAX_IDLE_CONNECTIONS = 4
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadAborted(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    def __init__(self, timeout=15, ssl_context=None, max_idle=MAX_IDLE_CONNECTIONS):
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, host, proxy=None):
+        """ returns a (connection, reused) tuple for host, reusing an idle connection if there is one"""
+        with self._lock:
+            idle = self._idle.get((host, proxy))
+            if idle:
+                return idle.pop(), True
+
+        if proxy:
+            connection = HTTPSConnection(proxy, timeout=self.timeout, context=self.ssl_context)
+            connection.set_tunnel(host)
+        else:
+            connection = HTTPSConnection(host, timeout=self.timeout, context=self.ssl_context)
+        return connection, False
+
+    def put(self, host, proxy, connection):
+        """ gives back a connection whose last response was read completely"""
+        with self._lock:
+            idle = self._idle.setdefault((host, proxy), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for connection in idle:
+                    connection.close()
+            self._idle = {}
+
+
+class Downloader(object):
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else ConnectionPool()
+
+    def _request(self, host, proxy, path, headers):
+        while True:
+            connection, reused = self.pool.get(host, proxy)
+            try:
+                connection.request("GET", path, headers=headers)
+                return connection, connection.getresponse()
+            except (HTTPException, OSError):
+                connection.close()
+                # The server may have closed an idle connection, in which
+                # case we just move on to the next one
+                if not reused:
+                    raise
+
+    def _read_body(self, response, outfd, offset, reporthook, is_aborted):
+        if response.status == 200:
+            if offset > 0:
+                outfd.seek(0)
+                outfd.truncate()
+            received = 0
+        elif response.status == 206 and offset > 0:
+            received = offset
+        else:
+            raise DownloadError("%d %s" % (response.status, response.reason))
+
+        length = response.getheader("content-length")
+        total = received + int(length) if length is not None else None
+
+        block_size = MIN_BLOCK_SIZE
+        last_report = 0
+        while True:
+            if is_aborted is not None and is_aborted():
+                raise DownloadAborted()
+
+            start = time.monotonic()
+            data = response.read(block_size)
+            if not data:
+                break
+            outfd.write(data)
+            received += len(data)
+
+            # Grow the buffer while full blocks come in quickly, shrink it
+            # again if the connection slows down
+            elapsed = time.monotonic() - start
+            if len(data) == block_size and elapsed < 0.05:
+                block_size = min(block_size * 2, MAX_BLOCK_SIZE)
+            elif elapsed > 0.5:
+                block_size = max(block_size // 2, MIN_BLOCK_SIZE)
+
+            now = time.monotonic()
+            if reporthook is not None and now - last_report >= 1.0 / PROGRESS_RATE:
+                last_report = now
+                reporthook(received, total)
+
+        if total is not None and received < total:
+            raise DownloadError("connection closed after %d of %d bytes" % (received, total))
+
+        if reporthook is not None:
+            reporthook(received, total)
+
+    def fetch(self, url, outfd, proxy=None, headers=None, offset=0, reporthook=None, is_aborted=None):
+        """ downloads url into the binary file object outfd and returns the response status and headers.
+
+            If offset is set, only the bytes from offset onwards are requested and appended. If the server
+            sends the whole file instead (status 200), outfd is truncated first.
+
+            reporthook(received, total) is called at most PROGRESS_RATE times per second, and once at the
+            end. total is None if the server didn't send a length. Raises DownloadAborted as soon as
+            is_aborted() returns True, and DownloadError for unexpected statuses. Statuses 200, 206 and 304
+            are returned to the caller."""
+        parsed_url = urlparse(url)
+        host = parsed_url.netloc
+        path = parsed_url.path or "/"
+        if parsed_url.query:
+            path = "%s?%s" % (path, parsed_url.query)
+
+        request_headers = {"Accept-Encoding": "identity", "Host": host, "User-Agent": "Python/3"}
+        if offset > 0:
+            request_headers["Range"] = "bytes=%d-" % offset
+        if headers:
+            request_headers.update(headers)
+
+        connection, response = self._request(host, proxy, path, request_headers)
+
+        try:
+            status = response.status
+            if status == 416 and offset > 0:
+                # What we have is not a prefix of the file anymore, start over
+                response.read()
+                self.pool.put(host, proxy, connection)
+                outfd.seek(0)
+                outfd.truncate()
+                return self.fetch(url, outfd, proxy, headers, 0, reporthook, is_aborted)
+            elif status == 304:
+                response.read()
+            else:
+                self._read_body(response, outfd, offset, reporthook, is_aborted)
+        except:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.put(host, proxy, connection)
+
+        return status, response.headers
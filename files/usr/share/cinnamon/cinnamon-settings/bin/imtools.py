@@ -16,13 +16,21 @@
 # along with this program.  If not, see http://www.gnu.org/licenses/
 
 import os
+import threading
+from collections import OrderedDict
 from io import StringIO
 from itertools import cycle
 from PIL import Image
+from PIL import ImageColor
 from PIL import ImageDraw
 from PIL import ImageEnhance
 from PIL import ImageOps, ImageChops, ImageFilter
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 ALL_PALETTE_INDICES = set(range(256))
 CHECKBOARD = {}
 COLOR_MAP = [255] * 128 + [0] * 128
@@ -52,6 +60,55 @@ class InvalidWriteFormatError(Exception):
     pass
 
 
+class LRUCache(object):
+    """A thread-safe dictionary-like cache which only keeps the
+    ``max_items`` most recently used items. It can be passed as the
+    ``cache`` argument of :func:`round_image`, :func:`drop_shadow` and
+    :func:`create_rounded_rectangle`."""
+
+    def __init__(self, max_items=64):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __getitem__(self, key):
+        with self._lock:
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def get(self, key, default=None):
+        """Return the item for ``key`` (marking it as recently used), or
+        ``default``. Use this rather than ``in`` followed by ``[]``, another
+        thread can evict the item in between."""
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+#: Masks and shadows shared by everything that decorates images of the
+#: same few sizes (e.g. thumbnails)
+SHARED_CACHE = LRUCache(64)
+
+
 def drop_shadow(image, horizontal_offset=5, vertical_offset=5,
                 background_color=(255, 255, 255, 0), shadow_color=0x444444,
                 border=8, shadow_blur=3, force_background_color=False, cache=None):
@@ -101,9 +158,10 @@ def drop_shadow(image, horizontal_offset=5, vertical_offset=5,
                                        background_color, shadow_color]])
 
         #look up in cache
-        if id in cache:
+        cached = cache.get(id)
+        if cached is not None:
             #retrieve from cache
-            back, back_size = cache[id]
+            back, back_size = cached
 
     if back is None:
         #size of backdrop
@@ -158,6 +216,95 @@ def drop_shadow(image, horizontal_offset=5, vertical_offset=5,
 
     return back
 
+def create_shadow(mask, horizontal_offset=5, vertical_offset=5,
+                  shadow_color=0x444444, border=8, shadow_blur=3):
+    """Create the RGBA backdrop :func:`drop_shadow` draws behind an
+    RGBA image whose alpha channel is ``mask``."""
+    size = mask.size
+    back_size = (size[0] + abs(horizontal_offset) + 2 * border,
+                 size[1] + abs(vertical_offset) + 2 * border)
+
+    shadow = Image.new('L', back_size, 0)
+    shadow_left = border + max(horizontal_offset, 0)
+    shadow_top = border + max(vertical_offset, 0)
+    paste(shadow, mask, (shadow_left, shadow_top,
+                         shadow_left + size[0], shadow_top + size[1]))
+
+    n = 0
+    while n < shadow_blur:
+        shadow = shadow.filter(ImageFilter.BLUR)
+        n += 1
+
+    back = Image.new('RGBA', back_size, shadow_color)
+    back.putalpha(shadow)
+    return back
+
+def round_and_shadow(image, radius=3, opacity=255, horizontal_offset=4,
+                     vertical_offset=4, shadow_color=0x444444, border=8,
+                     shadow_blur=3, back_color='#FFFFFF', cache=SHARED_CACHE):
+    """Round the corners of an image and add a drop shadow behind it.
+
+    This gives the same result as :func:`round_image` followed by
+    :func:`drop_shadow`, but the corner mask and the shadow are taken
+    from ``cache`` (keyed by size, radius, offsets, blur and colors) and,
+    when NumPy is available, the image is composited in a single pass.
+
+    :param image: The image to decorate.
+    :type image: PIL Image
+    :returns: RGBA image
+    """
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    size = image.size
+    mask = create_rounded_rectangle(size, cache, radius, opacity, ROUNDED_POS)
+
+    image_left = border - min(horizontal_offset, 0)
+    image_top = border - min(vertical_offset, 0)
+
+    if numpy is None:
+        # Same as round_image() followed by drop_shadow(), but everything
+        # that only depends on the size (the backdrop with its shadow and the
+        # back color) is taken from the cache, and the image itself is only
+        # blended twice.
+        shadow_id = ('rounded_shadow_back', size, radius, opacity, horizontal_offset,
+                     vertical_offset, border, shadow_blur, shadow_color, back_color)
+        cached = cache.get(shadow_id)
+        if cached is not None:
+            shadow, fill = cached
+        else:
+            shadow = create_shadow(mask, horizontal_offset, vertical_offset,
+                                   shadow_color, border, shadow_blur)
+            fill = Image.new('RGB', size, back_color)
+            cache[shadow_id] = shadow, fill
+        back = shadow.copy()
+        back.paste(Image.composite(image, fill, mask), (image_left, image_top), mask)
+        return back
+
+    composite_id = ('rounded_shadow', size, radius, opacity, horizontal_offset,
+                    vertical_offset, border, shadow_blur, shadow_color, back_color)
+    cached = cache.get(composite_id)
+    if cached is not None:
+        back, alpha, back_rgb = cached
+    else:
+        back = numpy.asarray(create_shadow(mask, horizontal_offset, vertical_offset,
+                                           shadow_color, border, shadow_blur),
+                             dtype=numpy.float32)
+        alpha = numpy.asarray(mask, dtype=numpy.float32)[..., None] / 255.0
+        back_rgb = numpy.array(ImageColor.getrgb(back_color)[:3], dtype=numpy.float32)
+        cache[composite_id] = back, alpha, back_rgb
+
+    # Same blending as round_image (paste the back color outside the mask)
+    # followed by paste() putting the opaque result onto the shadow through
+    # the mask.
+    result = back.copy()
+    region = result[image_top:image_top + size[1], image_left:image_left + size[0]]
+    rgb = numpy.asarray(image, dtype=numpy.float32) * alpha + back_rgb * (1 - alpha)
+    region[..., :3] = rgb * alpha + region[..., :3] * (1 - alpha)
+    region[..., 3:] = 255 * alpha + region[..., 3:] * (1 - alpha)
+
+    return Image.fromarray(numpy.rint(result).astype(numpy.uint8), 'RGBA')
+
 def round_image(image, cache={}, round_all=True, rounding_type=None,
                 radius=100, opacity=255, pos=ROUNDED_POS, back_color='#FFFFFF'):
 
@@ -179,14 +326,14 @@ def create_rounded_rectangle(size=(600, 400), cache={}, radius=100,
     #rounded_rectangle
     im_x, im_y = size
     rounded_rectangle_id = ROUNDED_RECTANGLE_ID % (radius, opacity, size, pos)
-    if rounded_rectangle_id in cache:
-        return cache[rounded_rectangle_id]
+    rounded_rectangle = cache.get(rounded_rectangle_id)
+    if rounded_rectangle is not None:
+        return rounded_rectangle
     else:
         #cross
         cross_id = ROUNDED_RECTANGLE_ID % (radius, opacity, size, CROSS_POS)
-        if cross_id in cache:
-            cross = cache[cross_id]
-        else:
+        cross = cache.get(cross_id)
+        if cross is None:
             cross = cache[cross_id] = Image.new('L', size, 0)
             draw = ImageDraw.Draw(cross)
             draw.rectangle((radius, 0, im_x - radius, im_y), fill=opacity)
@@ -195,9 +342,8 @@ def create_rounded_rectangle(size=(600, 400), cache={}, radius=100,
             return cross
         #corner
         corner_id = CORNER_ID % (radius, opacity)
-        if corner_id in cache:
-            corner = cache[corner_id]
-        else:
+        corner = cache.get(corner_id)
+        if corner is None:
             corner = cache[corner_id] = create_corner(radius, opacity)
         #rounded rectangle
         rectangle = Image.new('L', (radius, radius), 255)
@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+
+# Probes for the System Info page.
+#
+# The probes run in parallel, one thread each. /proc and /sys are read
+# directly; only lspci and lsblk are run, and they're killed if they take
+# longer than PROBE_TIMEOUT. The results that don't change from one session
+# to the next (processor, disks, graphics cards) are kept in a cache file, so
+# they can be shown right away while the probes run again.
+#
+# Stub mode: if CINNAMON_SYSINFO_STUB is set to a directory (or a root is
+# passed to SystemProbe), all files are read relative to that directory and
+# the output of a command is read from commands/<name> in it. That way the
+# probes can be tried without the hardware. tools/sysinfo-stub in the source
+# tree has an example:
+#
+#   ./sysinfo.py --stub <source tree>/tools/sysinfo-stub
+
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PROBE_TIMEOUT = 2.0
+CACHED_PROBES = ("cpu", "disks", "gpus")
+
+# For some platforms, 'model name' will no longer take effect.
+# We can try our best to detect it, but if all attempts failed just leave it to be "Unknown".
+# Source: https://github.com/dylanaraps/neofetch/blob/6dd85d67fc0d4ede9248f2df31b2cd554cca6c2f/neofetch#L2163
+CPU_NAME_KEYS = ("model name", "Hardware", "Processor", "cpu model", "chip type", "cpu type")
+
+
+class SystemProbe(object):
+    def __init__(self, root=None, cache_file=None):
+        if root is None:
+            root = os.environ.get("CINNAMON_SYSINFO_STUB")
+        self.root = root
+        self.cache_file = cache_file
+        self.probes = {
+            "os": self.probe_os,
+            "kernel": self.probe_kernel,
+            "cpu": self.probe_cpu,
+            "memory": self.probe_memory,
+            "disks": self.probe_disks,
+            "gpus": self.probe_gpus
+        }
+
+    def _path(self, path):
+        if self.root is None:
+            return path
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def _read_lines(self, path):
+        try:
+            with open(self._path(path), encoding="utf-8", errors="replace") as f:
+                return f.readlines()
+        except OSError:
+            return []
+
+    def _run(self, args):
+        if self.root is not None:
+            return self._read_lines(os.path.join("/commands", args[0]))
+
+        env = dict(os.environ)
+        env["PATH"] = env.get("PATH", "") + ":/usr/local/sbin:/usr/sbin:/sbin"
+        try:
+            out = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env, timeout=PROBE_TIMEOUT).stdout
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print("Could not run %s: %s" % (args[0], e))
+            return []
+        return out.decode("utf-8", errors="replace").splitlines(True)
+
+    def probe_os(self):
+        arch = platform.machine().replace("_", "-")
+
+        if os.path.exists(self._path("/etc/linuxmint/info")):
+            titles = [line.rstrip("\n").split("=")[1] for line in self._read_lines("/etc/linuxmint/info") if "GRUB_TITLE" in line and "=" in line]
+            return "\n".join(titles)
+
+        for release, default in (("/etc/arch-release", "Arch Linux"), ("/etc/manjaro-release", "Manjaro Linux")):
+            if os.path.exists(self._path(release)):
+                lines = self._read_lines(release)
+                contents = lines[0].split() if lines else []
+                return ' '.join(contents[:2]) or default
+
+        if self.root is not None:
+            name = None
+            for line in self._read_lines("/etc/os-release"):
+                if line.startswith("PRETTY_NAME="):
+                    name = line.split("=", 1)[1].strip().strip('"')
+            s = '%s (%s)' % (name, arch)
+        else:
+            import distro
+            s = '%s (%s)' % (' '.join(distro.linux_distribution()), arch)
+        # Normalize spacing in distribution name
+        return re.sub(r'\s{2,}', ' ', s)
+
+    def probe_kernel(self):
+        lines = self._read_lines("/proc/sys/kernel/osrelease")
+        if lines:
+            return lines[0].strip()
+        return platform.release()
+
+    def probe_cpu(self):
+        """ returns the processor's name and number of cores, either can be None"""
+        name = None
+        cores = None
+        for line in self._read_lines("/proc/cpuinfo"):
+            if line.startswith(CPU_NAME_KEYS):
+                name = line.split(':', 1)[1].strip()
+            elif line.startswith("cpu cores"):
+                cores = line.split(':', 1)[1].strip()
+        return {"name": name, "cores": cores}
+
+    def probe_memory(self):
+        """ returns the MemTotal line of /proc/meminfo (e.g. "16314140 kB"), or None"""
+        for line in self._read_lines("/proc/meminfo"):
+            if line.startswith("MemTotal"):
+                return line.split(':', 1)[1].strip()
+        return None
+
+    def probe_disks(self):
+        """ returns the total size of the disks in bytes and whether there's more than one, or None"""
+        out = self._run(("lsblk", "--json", "--output", "size", "--bytes", "--nodeps"))
+        try:
+            devices = json.loads(''.join(out))['blockdevices']
+            size = sum(int(device['size']) for device in devices)
+        except Exception:
+            return None
+        return {"size": size, "multiple": len(devices) > 1}
+
+    def probe_gpus(self):
+        """ returns the names of the graphics cards"""
+        cards = []
+        for line in self._run(("lspci",)):
+            # e.g. 01:00.0 VGA compatible controller: NVIDIA Corporation GP107 [GeForce GTX 1050 Ti] (rev a1)
+            if "VGA" not in line:
+                continue
+            fields = line.split(":")
+            if len(fields) > 2:
+                name = fields[2].split("(rev")[0].strip()
+                if name:
+                    cards.append(name)
+        return cards
+
+    def load_cache(self):
+        """ returns the results of the cached probes from the last run, if there are any"""
+        if self.cache_file is None or self.root is not None:
+            return {}
+
+        try:
+            with open(self.cache_file, "r") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        return {name: cache[name] for name in CACHED_PROBES if name in cache}
+
+    def save_cache(self, results):
+        if self.cache_file is None or self.root is not None:
+            return
+
+        cache = {name: results[name] for name in CACHED_PROBES if name in results}
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp_file = self.cache_file + ".tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            print("Could not save the system info cache: %s" % e)
+
+    def run(self, callback, done_callback=None):
+        """ runs all the probes at once. callback(name, result) is called from the probe's thread as
+            soon as a probe is done, and done_callback(results) once they all are"""
+        results = {}
+        lock = threading.Lock()
+        executor = ThreadPoolExecutor(max_workers=len(self.probes))
+
+        def run_probe(name, probe):
+            try:
+                result = probe()
+            except Exception as e:
+                print("System info probe '%s' failed: %s" % (name, e))
+                result = None
+
+            callback(name, result)
+
+            with lock:
+                results[name] = result
+                done = len(results) == len(self.probes)
+            if done:
+                self.save_cache(results)
+                if done_callback is not None:
+                    done_callback(results)
+
+        for name, probe in self.probes.items():
+            executor.submit(run_probe, name, probe)
+        executor.shutdown(wait=False)
+
+    def probe_all(self):
+        """ runs all the probes at once and waits for them"""
+        finished = threading.Event()
+        all_results = {}
+
+        def done(results):
+            all_results.update(results)
+            finished.set()
+
+        self.run(lambda name, result: None, done)
+        finished.wait()
+        return all_results
+
+
+if __name__ == "__main__":
+    root = None
+    if len(sys.argv) == 3 and sys.argv[1] == "--stub":
+        root = sys.argv[2]
+    elif len(sys.argv) != 1:
+        print("Usage: %s [--stub <dir>]" % sys.argv[0])
+        sys.exit(1)
+
+    print(json.dumps(SystemProbe(root=root).probe_all(), indent=4, sort_keys=True))
@@ -0,0 +1,394 @@
+#!/usr/bin/python3
+
+# Theme discovery for cs_themes.
+#
+# Finding out which folders hold icon, cursor, GTK, window border or desktop
+# themes takes several probes per folder (and a read of index.theme for icon
+# themes), which adds up with a few hundred themes installed. The catalog
+# scans in a worker thread and keeps what it found on disk, so a theme folder
+# is only listed again once its mtime changes, and a theme is only probed
+# again once the mtime of its own directory changes.
+#
+# ThemeThumbnails keeps the scaled previews shown in the theme choosers in a
+# ThumbnailCache. Entries are checked when they're looked up, and missing or
+# stale ones are made in a worker thread.
+
+import glob
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from gi.repository import GLib, GdkPixbuf
+
+from thumbcache import ThumbnailCache
+
+CATALOG_VERSION = 1
+CATALOG_PATH = os.path.join(GLib.get_user_cache_dir(), "cs_themes", "catalog.json")
+
+THUMBNAIL_CACHE_DIR = os.path.join(GLib.get_user_cache_dir(), "cs_themes", "thumbnails")
+THUMBNAIL_CACHE_SIZE = 32 * 1024 * 1024
+THUMBNAIL_WORKERS = 2
+
+# Where a folder icon can be found for some well known icon themes, relative to the icon folders
+ICON_HINTS_PATH = "/usr/share/cinnamon/cinnamon-settings/icons"
+
+ICON_KINDS = ("icons", "cursors")
+THEME_KINDS = ("gtk-3.0", "metacity-1", "cinnamon")
+KINDS = ICON_KINDS + THEME_KINDS
+
+
+def probe_icon_dir(path):
+    # returns which of ICON_KINDS the folder provides
+    kinds = []
+    if not os.path.isdir(path):
+        return kinds
+
+    if os.path.exists(os.path.join(path, "cursors")):
+        kinds.append("cursors")
+
+    index_path = os.path.join(path, "index.theme")
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, errors="replace") as f:
+                for line in f:
+                    if line.startswith("Directories="):
+                        kinds.append("icons")
+                        break
+        except Exception as e:
+            print(e)
+
+    return kinds
+
+
+def probe_theme_dir(path):
+    # returns which of THEME_KINDS the folder provides
+    kinds = []
+
+    # Only themes that have variations for gtk+-3 and gtk+-2
+    if os.path.exists(os.path.join(path, "gtk-2.0")):
+        if os.path.exists(os.path.join(path, "gtk-3.0")) or glob.glob("%s/gtk-3.*" % glob.escape(path)):
+            kinds.append("gtk-3.0")
+
+    if os.path.exists(os.path.join(path, "metacity-1/metacity-theme-3.xml")):
+        kinds.append("metacity-1")
+
+    if os.path.exists(os.path.join(path, "cinnamon")):
+        kinds.append("cinnamon")
+
+    return kinds
+
+
+class ThemeCatalog(object):
+    def __init__(self, icon_folders, theme_folders, path=CATALOG_PATH):
+        # Folders are in order of precedence, as Gtk and Cinnamon search them
+        self.folders = [(folder, probe_icon_dir) for folder in icon_folders] + \
+                       [(folder, probe_theme_dir) for folder in theme_folders]
+        self.path = path
+
+        self.themes = None
+        self._dirs = None
+        self._scanning = False
+        self._pending = []
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                catalog = json.load(f)
+            if catalog["version"] == CATALOG_VERSION:
+                return catalog["dirs"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return {}
+
+    def _save(self, dirs):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"version": CATALOG_VERSION, "dirs": dirs}, f)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as detail:
+            print("Failed to save the theme catalog %s: %s" % (self.path, detail))
+
+    def scan(self, callback):
+        """ looks for themes in a worker thread. Once done, callback(themes, changes) is called from the main
+            loop, where themes maps each of KINDS to its sorted list of (name, folder) tuples, and changes maps
+            the kinds that changed since the previous scan to (added, removed) lists. The first scan reports
+            every kind."""
+        if self._scanning:
+            # served by another scan once this one is done
+            self._pending.append(callback)
+            return
+
+        self._start([callback])
+
+    def _start(self, callbacks):
+        self._scanning = True
+        thread = threading.Thread(target=self._scan_thread, args=(callbacks,))
+        thread.daemon = True
+        thread.start()
+
+    def _scan_thread(self, callbacks):
+        try:
+            themes = self._scan()
+        except Exception as e:
+            print("Failed to scan for themes: %s" % e)
+            themes = None
+        GLib.idle_add(self._scan_done, themes, callbacks)
+
+    def _scan(self):
+        if self._dirs is None:
+            self._dirs = self._load()
+
+        dirs = {}
+        for folder, probe in self.folders:
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except OSError:
+                continue
+
+            cached = self._dirs.get(folder, {"mtime": None, "entries": {}})
+            if cached["mtime"] == mtime:
+                names = cached["entries"].keys()
+            else:
+                try:
+                    names = os.listdir(folder)
+                except OSError:
+                    continue
+
+            entries = {}
+            for name in names:
+                theme_path = os.path.join(folder, name)
+                try:
+                    theme_mtime = os.stat(theme_path).st_mtime_ns
+                except OSError:
+                    continue
+                entry = cached["entries"].get(name)
+                if entry is None or entry["mtime"] != theme_mtime:
+                    entry = {"mtime": theme_mtime, "kinds": probe(theme_path)}
+                entries[name] = entry
+
+            dirs[folder] = {"mtime": mtime, "entries": entries}
+
+        if dirs != self._dirs:
+            self._save(dirs)
+        self._dirs = dirs
+
+        themes = {}
+        for kind in KINDS:
+            # When a theme is in several folders, the last one wins
+            found = {}
+            for folder, probe in self.folders:
+                for name, entry in dirs.get(folder, {"entries": {}})["entries"].items():
+                    if kind in entry["kinds"]:
+                        found[name] = folder
+            themes[kind] = sorted(found.items(), key=lambda theme: theme[0].lower())
+
+        return themes
+
+    def _scan_done(self, themes, callbacks):
+        self._scanning = False
+
+        if themes is not None:
+            changes = {}
+            for kind in KINDS:
+                if self.themes is None:
+                    changes[kind] = (themes[kind], [])
+                elif themes[kind] != self.themes[kind]:
+                    old = set(self.themes[kind])
+                    new = set(themes[kind])
+                    changes[kind] = ([theme for theme in themes[kind] if theme not in old],
+                                     [theme for theme in self.themes[kind] if theme not in new])
+            self.themes = themes
+
+            for callback in callbacks:
+                callback(themes, changes)
+
+        if self._pending:
+            pending = self._pending
+            self._pending = []
+            self._start(pending)
+
+        return False
+
+
+def find_icon_file(icon_folders, theme_name, icon_name, size, seen=None):
+    """ finds the file of an icon in an icon theme, following the themes it inherits from. This is a simpler
+        version of what Gtk.IconTheme does (svg icons are preferred, then the closest size), but it doesn't
+        need Gtk so it can be used from a worker thread"""
+    if seen is None:
+        seen = set()
+    if theme_name in seen:
+        return None
+    seen.add(theme_name)
+
+    keyfile = GLib.KeyFile()
+    for folder in icon_folders:
+        try:
+            if keyfile.load_from_file(os.path.join(folder, theme_name, "index.theme"), GLib.KeyFileFlags.NONE):
+                break
+        except GLib.Error:
+            pass
+    else:
+        return None
+
+    def get(group, key, default):
+        try:
+            return keyfile.get_string(group, key)
+        except GLib.Error:
+            return default
+
+    best = None
+    best_distance = None
+    for directory in get("Icon Theme", "Directories", "").split(","):
+        directory = directory.strip()
+        if not directory:
+            continue
+        try:
+            dir_size = int(get(directory, "Size", "0"))
+            if get(directory, "Type", "Threshold") == "Scalable" and \
+               int(get(directory, "MinSize", dir_size)) <= size <= int(get(directory, "MaxSize", dir_size)):
+                distance = 0
+            else:
+                distance = abs(dir_size - size)
+        except ValueError:
+            continue
+
+        for ext in (".svg", ".png"):
+            for folder in icon_folders:
+                candidate = os.path.join(folder, theme_name, directory, icon_name + ext)
+                # the svg bonus makes an svg win over a png of the same size
+                candidate_distance = distance * 2 + (0 if ext == ".svg" else 1)
+                if (best_distance is None or candidate_distance < best_distance) and os.path.exists(candidate):
+                    best = candidate
+                    best_distance = candidate_distance
+
+    if best is not None:
+        return best
+
+    parents = [parent.strip() for parent in get("Icon Theme", "Inherits", "").split(",") if parent.strip()]
+    if theme_name != "hicolor":
+        parents.append("hicolor")
+    for parent in parents:
+        found = find_icon_file(icon_folders, parent, icon_name, size, seen)
+        if found is not None:
+            return found
+
+    return None
+
+
+class ThemeThumbnails(object):
+    def __init__(self, icon_folders, cache_dir=THUMBNAIL_CACHE_DIR):
+        self.icon_folders = icon_folders
+        self._cache = ThumbnailCache(cache_dir, THUMBNAIL_CACHE_SIZE)
+        self._pool = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+        self._pending = 0
+        self._hints = None
+
+    def _load_hints(self):
+        self._hints = {}
+        try:
+            with open(ICON_HINTS_PATH, "r") as f:
+                for line in f:
+                    theme_name, icon_path = line.strip().split(":")
+                    self._hints[theme_name] = icon_path
+        except (OSError, ValueError) as e:
+            print(e)
+
+    def _find_source(self, kind, theme_path, size):
+        # returns the file the preview of a theme is made from
+        theme_name = os.path.basename(theme_path)
+        if kind == "icons":
+            if self._hints is None:
+                self._load_hints()
+            if theme_name in self._hints:
+                for folder in self.icon_folders:
+                    path = os.path.join(folder, self._hints[theme_name])
+                    if os.path.exists(path):
+                        return path
+            return find_icon_file(self.icon_folders, theme_name, "folder", size)
+
+        for path in [os.path.join(theme_path, kind, "thumbnail.png"),
+                     "/usr/share/cinnamon/thumbnails/%s/%s.png" % (kind, theme_name),
+                     "/usr/share/cinnamon/thumbnails/%s/unknown.png" % kind]:
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _get_stamp(self, theme_path, source):
+        # what an entry is checked against: the theme folder and the file the preview was made from
+        try:
+            return [os.stat(theme_path).st_mtime_ns, os.stat(source).st_mtime_ns]
+        except OSError:
+            return None
+
+    def lookup(self, kind, theme_path, size):
+        """ returns a (pixbuf, source path) tuple for the preview of a theme, or (None, None) if it has to
+            be made with generate()"""
+        cached = self._cache.lookup(theme_path, size, kind)
+        if cached is None:
+            return None, None
+
+        width, height, data, info = cached
+        if info is None or self._get_stamp(theme_path, info["source"]) != info["stamp"]:
+            return None, None
+
+        return self._bytes_to_pixbuf(data, width, height), info["source"]
+
+    def generate(self, kind, theme_path, size, callback, *args):
+        """ makes the preview of a theme in a worker thread, then calls callback(pixbuf, source path, *args)
+            from the main loop. Themes whose preview can't be loaded get the generic one of their kind,
+            both are None if there's none (or it's an icon theme, which have no generic preview)."""
+        self._pending += 1
+        self._pool.submit(self._generate_thread, kind, theme_path, size, callback, args)
+
+    def _generate_thread(self, kind, theme_path, size, callback, args):
+        pixbuf = None
+        source = None
+        try:
+            source = self._find_source(kind, theme_path, size)
+            if source is not None:
+                pixbuf = self._make_preview(kind, theme_path, size, source)
+        except Exception as e:
+            print("Could not make a preview for %s: %s" % (theme_path, e))
+            pixbuf = None
+            source = None
+            # Icon themes without a usable folder icon aren't shown, the others get the generic preview
+            unknown = "/usr/share/cinnamon/thumbnails/%s/unknown.png" % kind
+            if kind != "icons" and os.path.exists(unknown):
+                try:
+                    pixbuf = self._make_preview(kind, theme_path, size, unknown)
+                    source = unknown
+                except Exception as e:
+                    print("Could not make a preview for %s: %s" % (theme_path, e))
+
+        GLib.idle_add(self._generate_done, pixbuf, source, callback, args)
+
+    def _make_preview(self, kind, theme_path, size, source):
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(source, -1, size)
+        if not pixbuf.get_has_alpha():
+            pixbuf = pixbuf.add_alpha(False, 0, 0, 0)
+        width = pixbuf.get_width()
+        height = pixbuf.get_height()
+        data = pixbuf.read_pixel_bytes().get_data()
+        if pixbuf.get_rowstride() != width * 4:
+            rowstride = pixbuf.get_rowstride()
+            data = b"".join(data[y * rowstride:y * rowstride + width * 4] for y in range(height))
+        stamp = self._get_stamp(theme_path, source)
+        if stamp is not None:
+            self._cache.store(theme_path, size, width, height, data,
+                              {"source": source, "stamp": stamp}, kind)
+        return pixbuf
+
+    def _generate_done(self, pixbuf, source, callback, args):
+        self._pending -= 1
+        if self._pending == 0:
+            self._pool.submit(self._cache.save)
+        callback(pixbuf, source, *args)
+        return False
+
+    def _bytes_to_pixbuf(self, data, w, h):
+        return GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(data),
+                                               GdkPixbuf.Colorspace.RGB,
+                                               True, 8, w, h,
+                                               w * 4)
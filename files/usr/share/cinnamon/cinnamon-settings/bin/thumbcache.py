@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+
+# Persistent thumbnail cache.
+#
+# Thumbnails are kept as raw RGBA pixels in one pack file per source directory,
+# and a single index.json describes where every thumbnail lives. The packs are
+# memory-mapped, so showing a directory that was already seen costs one index
+# read plus a copy out of the map per thumbnail.
+#
+# A directory's entries are only checked against the files on disk when the
+# directory's mtime changes, and the least recently used directories are
+# dropped once the packs grow past the configured size.
+
+import json
+import mmap
+import os
+import threading
+import time
+import uuid
+
+INDEX_VERSION = 1
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+class ThumbnailCache(object):
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.index_path = os.path.join(cache_dir, "index.json")
+
+        self._lock = threading.RLock()
+        self._dirs = None
+        self._maps = {}
+        self._dirty = False
+
+    # Index handling
+
+    def _load(self):
+        if self._dirs is not None:
+            return
+
+        self._dirs = {}
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                index = json.load(f)
+            if index["version"] == INDEX_VERSION:
+                self._dirs = index["dirs"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        # Remove anything the index doesn't know about (this includes the
+        # one-file-per-thumbnail cache used by older versions)
+        packs = set(d["pack"] for d in self._dirs.values())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for name in os.listdir(self.cache_dir):
+                if name != "index.json" and name not in packs:
+                    os.remove(os.path.join(self.cache_dir, name))
+        except OSError as detail:
+            print("Failed to clean up thumbnail cache %s: %s" % (self.cache_dir, detail))
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+
+            for dirname in list(self._dirs.keys()):
+                d = self._dirs[dirname]
+                if d["garbage"] > d["used"]:
+                    self._compact(dirname)
+
+            try:
+                tmp_path = self.index_path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"version": INDEX_VERSION, "dirs": self._dirs}, f)
+                os.replace(tmp_path, self.index_path)
+                self._dirty = False
+            except OSError as detail:
+                print("Failed to save thumbnail cache index %s: %s" % (self.index_path, detail))
+
+    # Pack handling
+
+    def _pack_path(self, d):
+        return os.path.join(self.cache_dir, d["pack"])
+
+    def _close_map(self, pack):
+        m = self._maps.pop(pack, None)
+        if m is not None:
+            m.close()
+
+    def _read(self, d, offset, length):
+        m = self._maps.get(d["pack"])
+        if m is None or offset + length > len(m):
+            self._close_map(d["pack"])
+            with open(self._pack_path(d), "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[d["pack"]] = m
+        if offset + length > len(m):
+            raise ValueError("thumbnail data is past the end of %s" % d["pack"])
+        return m[offset:offset + length]
+
+    def _compact(self, dirname):
+        # Rewrite the pack without the data of stale entries. The new pack
+        # gets a new name so that any other process still using the old
+        # index doesn't read the wrong pixels.
+        d = self._dirs[dirname]
+        new_pack = uuid.uuid4().hex + ".pack"
+        try:
+            entries = {}
+            with open(os.path.join(self.cache_dir, new_pack), "wb") as f:
+                for key, entry in d["entries"].items():
+                    data = self._read(d, entry["offset"], entry["length"])
+                    entries[key] = dict(entry, offset=f.tell())
+                    f.write(data)
+        except (OSError, ValueError) as detail:
+            print("Failed to compact thumbnail cache for %s: %s" % (dirname, detail))
+            self._drop_dir(dirname)
+            return
+
+        self._drop_pack(d)
+        d["pack"] = new_pack
+        d["entries"] = entries
+        d["garbage"] = 0
+
+    def _drop_pack(self, d):
+        self._close_map(d["pack"])
+        try:
+            os.remove(self._pack_path(d))
+        except OSError:
+            pass
+
+    def _drop_dir(self, dirname):
+        self._drop_pack(self._dirs.pop(dirname))
+        self._dirty = True
+
+    def _get_dir(self, dirname, create=False):
+        try:
+            mtime = os.path.getmtime(dirname)
+        except OSError:
+            mtime = 0
+
+        d = self._dirs.get(dirname)
+        if d is not None and d["mtime"] != mtime:
+            # Something in the directory changed, check every entry at once
+            for key in list(d["entries"].keys()):
+                entry = d["entries"][key]
+                try:
+                    file_mtime = os.path.getmtime(os.path.join(dirname, entry["name"]))
+                except OSError:
+                    file_mtime = None
+                if file_mtime != entry["mtime"]:
+                    del d["entries"][key]
+                    d["used"] -= entry["length"]
+                    d["garbage"] += entry["length"]
+            d["mtime"] = mtime
+            self._dirty = True
+
+        if d is None and create:
+            d = {"pack": uuid.uuid4().hex + ".pack", "mtime": mtime, "atime": 0,
+                 "used": 0, "garbage": 0, "entries": {}}
+            self._dirs[dirname] = d
+            self._dirty = True
+
+        if d is not None:
+            d["atime"] = time.time()
+
+        return d
+
+    def _evict(self, keep):
+        total = sum(d["used"] + d["garbage"] for d in self._dirs.values())
+        for dirname in sorted(self._dirs.keys(), key=lambda x: self._dirs[x]["atime"]):
+            if total <= self.max_size:
+                break
+            if dirname == keep:
+                continue
+            d = self._dirs[dirname]
+            total -= d["used"] + d["garbage"]
+            self._drop_dir(dirname)
+
+    def _key(self, name, size, tag):
+        if tag is None:
+            return "%d:%s" % (size or 0, name)
+        return "%d:%s:%s" % (size or 0, tag, name)
+
+    # Public API
+
+    def lookup(self, filename, size, tag=None):
+        # Returns (width, height, rgba_bytes, info) or None if there is no
+        # valid thumbnail for filename at the given size. tag tells apart
+        # different kinds of thumbnails made from the same file.
+        dirname, name = os.path.split(filename)
+        with self._lock:
+            self._load()
+            d = self._get_dir(dirname)
+            if d is None:
+                return None
+            entry = d["entries"].get(self._key(name, size, tag))
+            if entry is None:
+                return None
+            try:
+                data = self._read(d, entry["offset"], entry["length"])
+            except (OSError, ValueError) as detail:
+                print("Failed to read thumbnail cache for %s: %s" % (dirname, detail))
+                self._drop_dir(dirname)
+                return None
+            return (entry["width"], entry["height"], data, entry["info"])
+
+    def store(self, filename, size, width, height, data, info=None, tag=None):
+        # info is any small JSON-serializable value the caller wants back
+        # from lookup() (e.g. the dimensions of the original image).
+        dirname, name = os.path.split(filename)
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            return
+
+        with self._lock:
+            self._load()
+            d = self._get_dir(dirname, create=True)
+            key = self._key(name, size, tag)
+            try:
+                with open(self._pack_path(d), "ab") as f:
+                    offset = f.tell()
+                    f.write(data)
+            except OSError as detail:
+                print("Failed to save thumbnail for %s: %s" % (filename, detail))
+                return
+
+            old = d["entries"].get(key)
+            if old is not None:
+                d["used"] -= old["length"]
+                d["garbage"] += old["length"]
+            d["entries"][key] = {"name": name, "mtime": mtime, "offset": offset, "length": len(data),
+                                 "width": width, "height": height, "info": info}
+            d["used"] += len(data)
+            self._dirty = True
+
+            self._evict(dirname)
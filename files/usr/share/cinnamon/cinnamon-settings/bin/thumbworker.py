@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+# Wallpaper thumbnails for cs_backgrounds, made in a pool of worker processes.
+#
+# Each worker runs this file as its main program (see serve()), rather than
+# being forked from cinnamon-settings: forking a threaded GTK process could
+# leave the workers stuck on locks held by other threads, and
+# multiprocessing's other start methods import the settings app's main
+# module into every worker. A worker only loads PIL and GdkPixbuf.
+#
+# ThumbnailWorkers is the side cinnamon-settings uses. Requests and results
+# are pickled over the workers' stdin and stdout.
+
+import mimetypes
+import os
+import pickle
+import queue
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+import gi
+gi.require_version("GdkPixbuf", "2.0")
+from gi.repository import GdkPixbuf
+
+import imtools
+
+# EXIF utility functions (source: http://stackoverflow.com/questions/4228530/pil-thumbnail-is-rotating-my-image)
+def flip_horizontal(im): return im.transpose(Image.FLIP_LEFT_RIGHT)
+def flip_vertical(im): return im.transpose(Image.FLIP_TOP_BOTTOM)
+def rotate_180(im): return im.transpose(Image.ROTATE_180)
+def rotate_90(im): return im.transpose(Image.ROTATE_90)
+def rotate_270(im): return im.transpose(Image.ROTATE_270)
+def transpose(im): return rotate_90(flip_horizontal(im))
+def transverse(im): return rotate_90(flip_vertical(im))
+orientation_funcs = [None,
+                     lambda x: x,
+                     flip_horizontal,
+                     rotate_180,
+                     flip_vertical,
+                     transpose,
+                     rotate_270,
+                     transverse,
+                     rotate_90
+                     ]
+def apply_orientation(im):
+    """
+    Extract the oritentation EXIF tag from the image, which should be a PIL Image instance,
+    and if there is an orientation tag that would rotate the image, apply that rotation to
+    the Image instance given to do an in-place rotation.
+
+    :param Image im: Image instance to inspect
+    :return: A possibly transposed image instance
+    """
+
+    try:
+        kOrientationEXIFTag = 0x0112
+        if hasattr(im, '_getexif'): # only present in JPEGs
+            e = im._getexif()       # returns None if no EXIF data
+            if e is not None:
+                #log.info('EXIF data found: %r', e)
+                orientation = e[kOrientationEXIFTag]
+                f = orientation_funcs[orientation]
+                return f(im)
+    except:
+        # We'd be here with an invalid orientation value or some random error?
+        pass # log.exception("Error applying EXIF Orientation tag")
+    return im
+
+def make_thumbnail(filename, size):
+    # Runs in the thumbnail worker processes, so it must only return plain data
+    if mimetypes.guess_type(filename)[0] == "image/svg+xml":
+        # rasterize svg with Gdk-Pixbuf and convert to PIL Image
+        tmp_pix = GdkPixbuf.Pixbuf.new_from_file(filename)
+        mode = "RGBA" if tmp_pix.props.has_alpha else "RGB"
+        img = Image.frombytes(mode, (tmp_pix.props.width, tmp_pix.props.height),
+                              tmp_pix.read_pixel_bytes().get_data(), "raw",
+                              mode, tmp_pix.props.rowstride)
+    else:
+        img = Image.open(filename)
+        img = apply_orientation(img)
+
+    # generate thumbnail
+    (width, height) = img.size
+    if img.mode != "RGB":
+        if img.mode == "RGBA":
+            bg_img = Image.new("RGBA", img.size, (255,255,255,255))
+            img = Image.alpha_composite(bg_img, img)
+        img = img.convert("RGB")
+    if size:
+        img.thumbnail((size, size), Image.ANTIALIAS)
+    img = imtools.round_and_shadow(img, radius=3, opacity=255, horizontal_offset=4, vertical_offset=4,
+                                   shadow_color=0x444444, border=8, shadow_blur=3)
+
+    return (img.size[0], img.size[1], img.tobytes(), width, height)
+
+class ThumbnailWorkers(object):
+    """ runs make_thumbnail() in up to n_workers worker processes, started when they're first needed"""
+    def __init__(self, n_workers):
+        self._executor = ThreadPoolExecutor(max_workers=n_workers)
+        self._idle = queue.Queue()
+
+    def submit(self, filename, size):
+        """ returns a Future for the result of make_thumbnail(filename, size)"""
+        return self._executor.submit(self._run, filename, size)
+
+    def _start(self):
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def _run(self, filename, size):
+        # runs in one of the executor's threads, each of which uses one worker at a time
+        try:
+            process = self._idle.get_nowait()
+        except queue.Empty:
+            process = self._start()
+
+        try:
+            (success, result) = self._request(process, filename, size)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # The worker died (e.g. it was killed while idle), try once more with a new one
+            process.kill()
+            process.wait()
+            process = self._start()
+            try:
+                (success, result) = self._request(process, filename, size)
+            except (OSError, EOFError, pickle.UnpicklingError) as e:
+                process.kill()
+                process.wait()
+                raise RuntimeError("The thumbnail worker stopped: %s" % e)
+
+        self._idle.put(process)
+        if not success:
+            raise RuntimeError(result)
+        return result
+
+    def _request(self, process, filename, size):
+        pickle.dump((filename, size), process.stdin)
+        process.stdin.flush()
+        return pickle.load(process.stdout)
+
+def serve():
+    # Results go to the real stdout, anything printed ends up on stderr
+    out = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+
+    while True:
+        try:
+            (filename, size) = pickle.load(sys.stdin.buffer)
+        except EOFError:
+            # cinnamon-settings is gone
+            return
+
+        try:
+            reply = (True, make_thumbnail(filename, size))
+        except Exception as e:
+            reply = (False, str(e))
+        pickle.dump(reply, out)
+        out.flush()
+
+if __name__ == "__main__":
+    serve()
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 import getopt
+import json
 import sys
 
 import os
@@ -18,7 +19,7 @@ from setproctitle import setproctitle
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('XApp', '1.0')
-from gi.repository import Gio, Gtk, Pango, Gdk, XApp
+from gi.repository import Gio, Gtk, Pango, Gdk, GLib, XApp
 
 sys.path.append(config.currentPath + "/modules")
 sys.path.append(config.currentPath + "/bin")
@@ -42,8 +43,6 @@ for mod_file in mod_files:
     if mod_file[0:3] != "cs_":
         raise Exception("Settings modules must have a prefix of 'cs_' !!")
 
-modules = map(__import__, mod_files)
-
 # i18n for menu item
 menuName = _("System Settings")
 menuComment = _("Control Center")
@@ -59,6 +58,10 @@ MAX_PIX_WIDTH = 160
 
 MOUSE_BACK_BUTTON = 8
 
+# Bump this whenever the layout of the module index entries changes
+MODULE_INDEX_VERSION = 1
+MODULE_INDEX_PATH = os.path.join(GLib.get_user_cache_dir(), "cinnamon-settings", "modules.json")
+
 CATEGORIES = [
     #        Display name                         ID              Show it? Always False to start              Icon
     {"label": _("Appearance"),            "id": "appear",      "show": False,                       "icon": "cs-cat-appearance"},
@@ -163,6 +166,60 @@ def touch(fname, times=None):
         os.utime(fname, times)
 
 
+def get_module_index_stamp():
+    # Anything that changes what the index holds: the module files themselves
+    # and the language the labels and keywords were translated into.
+    stamp = {
+        "version": MODULE_INDEX_VERSION,
+        "languages": GLib.get_language_names(),
+        "modules": {}
+    }
+    for mod_file in mod_files:
+        try:
+            stamp["modules"][mod_file] = os.path.getmtime(os.path.join(config.currentPath, "modules", mod_file + ".py"))
+        except OSError:
+            stamp["modules"][mod_file] = 0
+    return stamp
+
+
+def load_module_index():
+    # Returns the list of index entries, or None if the index is missing or stale
+    if os.environ.get("CINNAMON_SETTINGS_EAGER_LOAD"):
+        return None
+    try:
+        with open(MODULE_INDEX_PATH, encoding="utf-8") as f:
+            index = json.load(f)
+        if index["stamp"] != get_module_index_stamp():
+            return None
+        return index["modules"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_module_index(entries):
+    index = {"stamp": get_module_index_stamp(), "modules": entries}
+    try:
+        os.makedirs(os.path.dirname(MODULE_INDEX_PATH), exist_ok=True)
+        tmp_path = MODULE_INDEX_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, MODULE_INDEX_PATH)
+    except OSError as detail:
+        print("Could not save the settings module index: %s" % detail)
+
+
+class LazySidePage:
+    # Stands in for a module's SidePage in the icon view until the page is
+    # first opened, at which point the real module is imported and built.
+    def __init__(self, entry):
+        self.mod_file = entry["module"]
+        self.name = entry["label"]
+        self.icon = entry["icon"]
+        self.keywords = entry["keywords"]
+        self.is_standalone = False
+        self.module = None
+
+
 class MainWindow:
     # Change pages
     def side_view_nav(self, side_view, path, cat):
@@ -182,6 +239,11 @@ class MainWindow:
     def go_to_sidepage(self, cat, path, user_action=True):
         iterator = self.store[cat].get_iter(path)
         sidePage = self.store[cat].get_value(iterator, 2)
+        if isinstance(sidePage, LazySidePage):
+            sidePage = self.load_lazy_sidepage(sidePage)
+            if sidePage is None:
+                return
+            self.store[cat].set_value(iterator, 2, sidePage)
         if not sidePage.is_standalone:
             if not user_action:
                 self.window.set_title(sidePage.name)
@@ -307,14 +369,11 @@ class MainWindow:
         self.content_box.c_manager = self.c_manager
         self.bar_heights = 0
 
-        for module in modules:
-            try:
-                mod = module.Module(self.content_box)
-                if self.loadCheck(mod) and self.setParentRefs(mod):
-                    self.unsortedSidePages.append((mod.sidePage, mod.name, mod.category))
-            except:
-                print("Failed to load module %s" % module)
-                traceback.print_exc()
+        module_index = load_module_index()
+        if module_index is None:
+            self.load_all_modules()
+        else:
+            self.load_module_index(module_index)
 
         for item in CONTROL_CENTER_MODULES:
             ccmodule = SettingsWidgets.CCModule(item[0], item[1], item[2], item[3], item[4], self.content_box)
@@ -445,6 +504,61 @@ class MainWindow:
 
             self.window.show()
 
+        if os.environ.get("CINNAMON_SETTINGS_BENCHMARK"):
+            # Used by tools/benchmark-settings-startup.py: quit as soon as the
+            # first frame has been drawn.
+            GLib.idle_add(self.quit)
+
+    def load_all_modules(self):
+        modules = map(__import__, mod_files)
+
+        index = []
+        for module in modules:
+            try:
+                mod = module.Module(self.content_box)
+                if self.loadCheck(mod) and self.setParentRefs(mod):
+                    self.unsortedSidePages.append((mod.sidePage, mod.name, mod.category))
+                index.append({
+                    "module": module.__name__,
+                    "name": mod.name,
+                    "category": mod.category,
+                    "label": mod.sidePage.name,
+                    "icon": mod.sidePage.icon,
+                    "keywords": mod.sidePage.keywords,
+                    "load_check": hasattr(mod, "_loadCheck")
+                })
+            except:
+                print("Failed to load module %s" % module)
+                traceback.print_exc()
+
+        save_module_index(index)
+
+    def load_module_index(self, module_index):
+        for entry in module_index:
+            # Whether these modules are shown depends on the system, so they
+            # still need to be checked at startup.
+            if entry["load_check"]:
+                try:
+                    mod = __import__(entry["module"]).Module(self.content_box)
+                    if self.loadCheck(mod) and self.setParentRefs(mod):
+                        self.unsortedSidePages.append((mod.sidePage, mod.name, mod.category))
+                except:
+                    print("Failed to load module %s" % entry["module"])
+                    traceback.print_exc()
+                continue
+
+            self.unsortedSidePages.append((LazySidePage(entry), entry["name"], entry["category"]))
+
+    def load_lazy_sidepage(self, lazy_sidepage):
+        try:
+            mod = __import__(lazy_sidepage.mod_file).Module(self.content_box)
+            self.setParentRefs(mod)
+            return mod.sidePage
+        except:
+            print("Failed to load module %s" % lazy_sidepage.mod_file)
+            traceback.print_exc()
+            return None
+
     def on_keypress(self, widget, event):
         grab = False
         device = Gtk.get_current_event_device()
@@ -1,24 +1,22 @@
 #!/usr/bin/python3
 
 import os
-import imtools
 import gettext
 import _thread as thread
+import threading
 import subprocess
 import locale
-import time
-import hashlib
 import mimetypes
-import pickle
-from io import BytesIO
+from collections import deque
 from xml.etree import ElementTree
 
-from PIL import Image
 import gi
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gio, Gtk, Gdk, GdkPixbuf, Pango, GLib
 
 from SettingsWidgets import SidePage
+from thumbcache import ThumbnailCache
+from thumbworker import ThumbnailWorkers
 from xapp.GSettingsWidgets import *
 
 gettext.install("cinnamon", "/usr/share/locale")
@@ -44,55 +42,14 @@ BACKGROUND_ICONS_SIZE = 100
 BACKGROUND_COLLECTION_TYPE_DIRECTORY = "directory"
 BACKGROUND_COLLECTION_TYPE_XML = "xml"
 
-# even though pickle supports higher protocol versions, we want to version 2 because it's the latest
-# version supported by python2 which (at this time) is still used by older versions of Cinnamon.
-# When those versions are no longer supported, we can consider using a newer version.
-PICKLE_PROTOCOL_VERSION = 2
+# How much disk space the wallpaper thumbnails may use in ~/.cache/cs_backgrounds
+BACKGROUND_CACHE_SIZE = 256 * 1024 * 1024
 
-(STORE_IS_SEPARATOR, STORE_ICON, STORE_NAME, STORE_PATH, STORE_TYPE) = range(5)
-
-# EXIF utility functions (source: http://stackoverflow.com/questions/4228530/pil-thumbnail-is-rotating-my-image)
-def flip_horizontal(im): return im.transpose(Image.FLIP_LEFT_RIGHT)
-def flip_vertical(im): return im.transpose(Image.FLIP_TOP_BOTTOM)
-def rotate_180(im): return im.transpose(Image.ROTATE_180)
-def rotate_90(im): return im.transpose(Image.ROTATE_90)
-def rotate_270(im): return im.transpose(Image.ROTATE_270)
-def transpose(im): return rotate_90(flip_horizontal(im))
-def transverse(im): return rotate_90(flip_vertical(im))
-orientation_funcs = [None,
-                     lambda x: x,
-                     flip_horizontal,
-                     rotate_180,
-                     flip_vertical,
-                     transpose,
-                     rotate_270,
-                     transverse,
-                     rotate_90
-                     ]
-def apply_orientation(im):
-    """
-    Extract the oritentation EXIF tag from the image, which should be a PIL Image instance,
-    and if there is an orientation tag that would rotate the image, apply that rotation to
-    the Image instance given to do an in-place rotation.
-
-    :param Image im: Image instance to inspect
-    :return: A possibly transposed image instance
-    """
-
-    try:
-        kOrientationEXIFTag = 0x0112
-        if hasattr(im, '_getexif'): # only present in JPEGs
-            e = im._getexif()       # returns None if no EXIF data
-            if e is not None:
-                #log.info('EXIF data found: %r', e)
-                orientation = e[kOrientationEXIFTag]
-                f = orientation_funcs[orientation]
-                return f(im)
-    except:
-        # We'd be here with an invalid orientation value or some random error?
-        pass # log.exception("Error applying EXIF Orientation tag")
-    return im
+# Thumbnails are decoded and scaled in a pool of worker processes (see thumbworker.py)
+THUMBNAIL_WORKERS = max(1, min(os.cpu_count() or 1, 8))
+MAX_THUMBNAILS_IN_FLIGHT = THUMBNAIL_WORKERS * 2
 
+(STORE_IS_SEPARATOR, STORE_ICON, STORE_NAME, STORE_PATH, STORE_TYPE) = range(5)
 
 class ColorsWidget(SettingsWidget):
     def __init__(self, size_group):
@@ -566,89 +523,60 @@ class PixCache(object):
 
     def __init__(self):
         self._data = {}
+        self._thumb_cache = ThumbnailCache(GLib.get_user_cache_dir() + '/cs_backgrounds/', BACKGROUND_CACHE_SIZE)
+        self._pool = None
 
-    def get_pix(self, filename, size=None):
-        if filename is None:
-            return None
+    def is_image(self, filename):
         mimetype = mimetypes.guess_type(filename)[0]
-        if mimetype is None or not mimetype.startswith("image/"):
+        return mimetype is not None and mimetype.startswith("image/")
+
+    def lookup(self, filename, size=None):
+        # Returns [pixbuf, width, height] if the thumbnail is in the memory or
+        # disk cache, None if it has to be generated.
+        if filename in self._data and size in self._data[filename]:
+            return self._data[filename][size]
+
+        cached = self._thumb_cache.lookup(filename, size)
+        if cached is None:
             return None
 
-        if filename not in self._data:
-            self._data[filename] = {}
-        if size in self._data[filename]:
-            pix = self._data[filename][size]
-        else:
-            try:
-                h = hashlib.sha1(('%f%s' % (os.path.getmtime(filename), filename)).encode()).hexdigest()
-                tmp_cache_path = GLib.get_user_cache_dir() + '/cs_backgrounds/'
-                if not os.path.exists(tmp_cache_path):
-                    os.mkdir(tmp_cache_path)
-                cache_filename = tmp_cache_path + h + "v2"
-
-                loaded = False
-                if os.path.exists(cache_filename):
-                    # load from disk cache
-                    try:
-                        with open(cache_filename, "rb") as cache_file:
-                            pix = pickle.load(cache_file)
-                        tmp_img = Image.open(BytesIO(pix[0]))
-                        pix[0] = self._image_to_pixbuf(tmp_img)
-                        loaded = True
-                    except Exception as detail:
-                        # most likely either the file is corrupted, or the file was pickled using the
-                        # python2 version of cinnamon settings. Either way, we want to ditch the current
-                        # cache file and generate a new one. This is still backward compatible with older
-                        # Cinnamon versions
-                        os.remove(cache_filename)
-
-                if not loaded:
-                    if mimetype == "image/svg+xml":
-                        # rasterize svg with Gdk-Pixbuf and convert to PIL Image
-                        tmp_pix = GdkPixbuf.Pixbuf.new_from_file(filename)
-                        mode = "RGBA" if tmp_pix.props.has_alpha else "RGB"
-                        img = Image.frombytes(mode, (tmp_pix.props.width, tmp_pix.props.height),
-                                              tmp_pix.read_pixel_bytes().get_data(), "raw",
-                                              mode, tmp_pix.props.rowstride)
-                    else:
-                        img = Image.open(filename)
-                        img = apply_orientation(img)
-
-                    # generate thumbnail
-                    (width, height) = img.size
-                    if img.mode != "RGB":
-                        if img.mode == "RGBA":
-                            bg_img = Image.new("RGBA", img.size, (255,255,255,255))
-                            img = Image.alpha_composite(bg_img, img)
-                        img = img.convert("RGB")
-                    if size:
-                        img.thumbnail((size, size), Image.ANTIALIAS)
-                    img = imtools.round_image(img, {}, False, None, 3, 255)
-                    img = imtools.drop_shadow(img, 4, 4, background_color=(255, 255, 255, 0),
-                                              shadow_color=0x444444, border=8, shadow_blur=3,
-                                              force_background_color=False, cache=None)
-
-                    # save to disk cache
-                    try:
-                        png_bytes = BytesIO()
-                        img.save(png_bytes, "png")
-                        with open(cache_filename, "wb") as cache_file:
-                            pickle.dump([png_bytes.getvalue(), width, height], cache_file, PICKLE_PROTOCOL_VERSION)
-                    except Exception as detail:
-                        print("Failed to save cache file: %s: %s" % (cache_filename, detail))
-
-                    pix = [self._image_to_pixbuf(img), width, height]
-            except Exception as detail:
-                print("Failed to convert %s: %s" % (filename, detail))
-                pix = None
-            if pix:
-                self._data[filename][size] = pix
+        (thumb_width, thumb_height, data, (width, height)) = cached
+        pix = [self._bytes_to_pixbuf(data, thumb_width, thumb_height), width, height]
+        self._data.setdefault(filename, {})[size] = pix
+        return pix
+
+    def generate(self, filename, size, callback):
+        # Generates the thumbnail in the worker pool. callback is called from
+        # a pool thread with [pixbuf, width, height], or None on failure.
+        future = self._get_pool().submit(filename, size)
+        future.add_done_callback(lambda f: callback(self._on_thumbnail_done(filename, size, f)))
+
+    def _get_pool(self):
+        if self._pool is None:
+            # The workers run thumbworker.py on its own, without anything of cinnamon-settings
+            self._pool = ThumbnailWorkers(THUMBNAIL_WORKERS)
+        return self._pool
+
+    def _on_thumbnail_done(self, filename, size, future):
+        try:
+            (thumb_width, thumb_height, data, width, height) = future.result()
+        except Exception as detail:
+            print("Failed to convert %s: %s" % (filename, detail))
+            return None
+
+        # save to disk cache
+        self._thumb_cache.store(filename, size, thumb_width, thumb_height, data, (width, height))
+
+        pix = [self._bytes_to_pixbuf(data, thumb_width, thumb_height), width, height]
+        self._data.setdefault(filename, {})[size] = pix
         return pix
 
-    # Convert RGBA PIL Image to Pixbuf
-    def _image_to_pixbuf(self, img):
-        [w, h] = img.size
-        return GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(img.tobytes()),
+    def save(self):
+        self._thumb_cache.save()
+
+    # Convert raw RGBA pixels to Pixbuf
+    def _bytes_to_pixbuf(self, data, w, h):
+        return GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(data),
                                                GdkPixbuf.Colorspace.RGB,
                                                True, 8, w, h,
                                                w * 4)
@@ -661,7 +589,8 @@ class ThreadedIconView(Gtk.IconView):
     def __init__(self):
         Gtk.IconView.__init__(self)
         self.set_item_width(BACKGROUND_ICONS_SIZE * 1.1)
-        self._model = Gtk.ListStore(object, GdkPixbuf.Pixbuf, str, str)
+        #                             picture  thumbnail          markup  path  job
+        self._model = Gtk.ListStore(object, GdkPixbuf.Pixbuf, str,    str,  int)
         self._model_filter = self._model.filter_new()
         self._model_filter.set_visible_func(self.visible_func)
         self.set_model(self._model_filter)
@@ -680,15 +609,31 @@ class ThreadedIconView(Gtk.IconView):
         self.add_attribute(text_renderer, "markup", 2)
         text_renderer.set_property("alignment", Pango.Alignment.CENTER)
 
-        self._loading_queue = []
+        # Shown until the real thumbnail is ready
+        self._placeholder = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8,
+                                                 BACKGROUND_ICONS_SIZE, BACKGROUND_ICONS_SIZE)
+        self._placeholder.fill(0)
+
+        # (job, picture, generation) tuples waiting for a thumbnail
+        self._loading_queue = deque()
         self._loading_queue_lock = thread.allocate_lock()
 
         self._loading_lock = thread.allocate_lock()
         self._loading = False
 
-        self._loaded_data = []
+        # (job, picture, pix) tuples waiting to be shown
+        self._loaded_data = deque()
         self._loaded_data_lock = thread.allocate_lock()
 
+        # Bumped by clear(), thumbnails that were asked for before that are dropped when they come in.
+        # Protected by _loaded_data_lock
+        self._generation = 0
+
+        # job -> model iter, only used from the main thread
+        self._rows = {}
+        self._next_job = 0
+        self._visible_range = None
+
     def visible_func(self, model, iter, data=None):
         item_path = model.get_value(iter, 3)
         return item_path == self.current_path
@@ -700,24 +645,52 @@ class ThreadedIconView(Gtk.IconView):
             self.add_picture(i, path)
 
     def clear(self):
+        # The loader isn't waited for: whatever it's still working on belongs to an
+        # old generation and is thrown away once it's done
         self._loading_queue_lock.acquire()
-        self._loading_queue = []
+        self._loading_queue.clear()
         self._loading_queue_lock.release()
 
-        self._loading_lock.acquire()
-        is_loading = self._loading
-        self._loading_lock.release()
-        while is_loading:
-            time.sleep(0.1)
-            self._loading_lock.acquire()
-            is_loading = self._loading
-            self._loading_lock.release()
+        self._loaded_data_lock.acquire()
+        self._generation += 1
+        self._loaded_data.clear()
+        self._loaded_data_lock.release()
 
+        self._rows = {}
+        self._visible_range = None
         self._model.clear()
 
+    def get_markup(self, picture, pix=None):
+        if "name" in picture:
+            label = picture["name"]
+        else:
+            label = os.path.split(picture["filename"])[1]
+        if "artist" in picture:
+            artist = "%s\n" % picture["artist"]
+        else:
+            artist = ""
+        if pix is not None:
+            dimensions = "%dx%d" % (pix[1], pix[2])
+        else:
+            dimensions = ""
+        return "<b>%s</b>\n<sub>%s%s</sub>" % (label, artist, dimensions)
+
     def add_picture(self, picture, path):
+        if not picture["filename"].endswith(".xml") and not PIX_CACHE.is_image(picture["filename"]):
+            return
+
+        # Add the row straight away so the pictures keep their order and the
+        # thumbnails in view can be generated first.
+        job = self._next_job
+        self._next_job += 1
+        self._rows[job] = self._model.append((picture, self._placeholder, self.get_markup(picture), path, job))
+
+        self._loaded_data_lock.acquire()
+        generation = self._generation
+        self._loaded_data_lock.release()
+
         self._loading_queue_lock.acquire()
-        self._loading_queue.append(picture)
+        self._loading_queue.append((job, picture, generation))
         self._loading_queue_lock.release()
 
         start_loading = False
@@ -729,57 +702,115 @@ class ThreadedIconView(Gtk.IconView):
 
         if start_loading:
             GLib.timeout_add(100, self._check_loading_progress)
-            thread.start_new_thread(self._do_load, (path,))
+            thread.start_new_thread(self._do_load, ())
+
+    def _prioritize_visible(self):
+        # Move the pictures currently in view to the front of the queue
+        visible_range = self.get_visible_range()
+        if not visible_range or not visible_range[0]:
+            return
+        (start, end) = visible_range[-2:]
+        key = (start.to_string(), end.to_string())
+        if key == self._visible_range:
+            return
+        self._visible_range = key
+
+        jobs = set()
+        for i in range(start.get_indices()[0], end.get_indices()[0] + 1):
+            jobs.add(self._model_filter[i][4])
+
+        self._loading_queue_lock.acquire()
+        visible = [item for item in self._loading_queue if item[0] in jobs]
+        if visible:
+            rest = [item for item in self._loading_queue if item[0] not in jobs]
+            self._loading_queue = deque(visible + rest)
+        self._loading_queue_lock.release()
 
     def _check_loading_progress(self):
         self._loading_lock.acquire()
         self._loaded_data_lock.acquire()
         res = self._loading
-        to_load = []
-        while len(self._loaded_data) > 0:
-            to_load.append(self._loaded_data[0])
-            self._loaded_data = self._loaded_data[1:]
+        to_load = self._loaded_data
+        self._loaded_data = deque()
         self._loading_lock.release()
         self._loaded_data_lock.release()
 
-        for i in to_load:
-            self._model.append(i)
+        for (job, picture, pix) in to_load:
+            iter = self._rows.pop(job, None)
+            if iter is None:
+                continue
+            if pix is None:
+                self._model.remove(iter)
+            else:
+                self._model.set_value(iter, 1, pix[0])
+                self._model.set_value(iter, 2, self.get_markup(picture, pix))
+
+        if res:
+            self._prioritize_visible()
 
         return res
 
-    def _do_load(self, path):
-        finished = False
-        while not finished:
+    def _add_loaded(self, job, picture, pix, generation):
+        self._loaded_data_lock.acquire()
+        if generation == self._generation:
+            self._loaded_data.append((job, picture, pix))
+        self._loaded_data_lock.release()
+
+    def _do_load(self):
+        # Thumbnails already on disk are read here, the others are handed to
+        # the worker pool with at most MAX_THUMBNAILS_IN_FLIGHT outstanding.
+        in_flight = threading.Semaphore(MAX_THUMBNAILS_IN_FLIGHT)
+
+        while True:
             self._loading_queue_lock.acquire()
-            if len(self._loading_queue) == 0:
-                finished = True
+            if len(self._loading_queue) > 0:
+                (job, to_load, generation) = self._loading_queue.popleft()
             else:
-                to_load = self._loading_queue[0]
-                self._loading_queue = self._loading_queue[1:]
+                job = None
             self._loading_queue_lock.release()
-            if not finished:
-                filename = to_load["filename"]
-                if filename.endswith(".xml"):
-                    filename = self.getFirstFileFromBackgroundXml(filename)
-                pix = PIX_CACHE.get_pix(filename, BACKGROUND_ICONS_SIZE)
-                if pix != None:
-                    if "name" in to_load:
-                        label = to_load["name"]
-                    else:
-                        label = os.path.split(to_load["filename"])[1]
-                    if "artist" in to_load:
-                        artist = "%s\n" % to_load["artist"]
-                    else:
-                        artist = ""
-                    dimensions = "%dx%d" % (pix[1], pix[2])
-
-                    self._loaded_data_lock.acquire()
-                    self._loaded_data.append((to_load, pix[0], "<b>%s</b>\n<sub>%s%s</sub>" % (label, artist, dimensions), path))
-                    self._loaded_data_lock.release()
 
-        self._loading_lock.acquire()
-        self._loading = False
-        self._loading_lock.release()
+            if job is None:
+                # Wait for the pool, then stop unless more pictures were
+                # queued in the meantime.
+                for i in range(MAX_THUMBNAILS_IN_FLIGHT):
+                    in_flight.acquire()
+                for i in range(MAX_THUMBNAILS_IN_FLIGHT):
+                    in_flight.release()
+
+                PIX_CACHE.save()
+
+                self._loading_queue_lock.acquire()
+                self._loading_lock.acquire()
+                finished = len(self._loading_queue) == 0
+                if finished:
+                    self._loading = False
+                self._loading_lock.release()
+                self._loading_queue_lock.release()
+                if finished:
+                    return
+                continue
+
+            filename = to_load["filename"]
+            if filename.endswith(".xml"):
+                filename = self.getFirstFileFromBackgroundXml(filename)
+            if filename is None or not PIX_CACHE.is_image(filename):
+                self._add_loaded(job, to_load, None, generation)
+                continue
+
+            pix = PIX_CACHE.lookup(filename, BACKGROUND_ICONS_SIZE)
+            if pix is not None:
+                self._add_loaded(job, to_load, pix, generation)
+                continue
+
+            in_flight.acquire()
+            def on_thumbnail_done(pix, job=job, to_load=to_load, generation=generation):
+                self._add_loaded(job, to_load, pix, generation)
+                in_flight.release()
+            try:
+                PIX_CACHE.generate(filename, BACKGROUND_ICONS_SIZE, on_thumbnail_done)
+            except Exception as detail:
+                print("Failed to convert %s: %s" % (filename, detail))
+                on_thumbnail_done(None)
 
     def getFirstFileFromBackgroundXml(self, filename):
         try:
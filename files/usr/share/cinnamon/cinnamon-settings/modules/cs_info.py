@@ -1,153 +1,100 @@
 #!/usr/bin/python3
 
-import platform
-import subprocess
-import shlex
 import os
-import re
-import threading
-from json import loads
 
 from SettingsWidgets import SidePage
+from sysinfo import SystemProbe
 from xapp.GSettingsWidgets import *
 
 
-def killProcess(process):
-    process.kill()
-
-
-def getProcessOut(command):
-    timeout = 2.0  # Timeout for any subprocess before aborting it
-
-    lines = []
-    p = subprocess.Popen(command, stdout=subprocess.PIPE)
-    timer = threading.Timer(timeout, killProcess, [p])
-    timer.start()
-    while True:
-        line = p.stdout.readline()
-        if not line:
-            break
-        if line != '':
-            lines.append(line.decode('utf-8'))
-    timer.cancel()
-    return lines
-
-
-def getGraphicsInfos():
-    cards = {}
-    count = 0
-    envpath = os.environ["PATH"]
-    os.environ["PATH"] = envpath + ":/usr/local/sbin:/usr/sbin:/sbin"
-    for card in getProcessOut(("lspci")):
-        if not "VGA" in card:
-            continue
-        cardId = card.split()[0]
-        cardName = None
-        for line in getProcessOut(("lspci", "-v", "-s", cardId)):
-            if line.startswith(cardId):
-                cardName = (line.split(":")[2].split("(rev")[0].strip())
-
-        if cardName:
-            cards[count] = (cardName)
-            count += 1
-    os.environ["PATH"] = envpath
-    return cards
-
-
-def getDiskSize():
-    disksize = 0
-    try:
-        out = getProcessOut(("lsblk", "--json", "--output", "size", "--bytes", "--nodeps"))
-        jsonobj = loads(''.join(out))
-    except Exception:
-        return _("Unknown size"), False
-
-    for blk in jsonobj['blockdevices']:
-        disksize += int(blk['size'])
-
-    return disksize, (len(jsonobj['blockdevices']) > 1)
-
-
-def getProcInfos():
-    # For some platforms, 'model name' will no longer take effect.
-    # We can try our best to detect it, but if all attempts failed just leave it to be "Unknown".
-    # Source: https://github.com/dylanaraps/neofetch/blob/6dd85d67fc0d4ede9248f2df31b2cd554cca6c2f/neofetch#L2163
-    cpudetect = ("model name", "Hardware", "Processor", "cpu model", "chip type", "cpu type")
-    infos = [
-        ("/proc/cpuinfo", [("cpu_name", cpudetect), ("cpu_siblings", ("siblings",)), ("cpu_cores", ("cpu cores",))]),
-        ("/proc/meminfo", [("mem_total", ("MemTotal",))])
-    ]
-
-    result = {}
-    for (proc, pairs) in infos:
-        for line in getProcessOut(("cat", proc)):
-            for (key, start) in pairs:
-                for item in start:
-                    if line.startswith(item):
-                        result[key] = line.split(':', 1)[1].strip()
-                        break
-    if "cpu_name" not in result:
-        result["cpu_name"] = _("Unknown CPU")
-    if "mem_total" not in result:
-        result["mem_total"] = _("Unknown size")
-    return result
-
-
-def createSystemInfos():
-    procInfos = getProcInfos()
-    infos = []
-    arch = platform.machine().replace("_", "-")
+def formatOs(title):
+    return [(_("Operating System"), title or _("Unknown"))]
+
+
+def formatKernel(release):
+    return [(_("Linux Kernel"), release or _("Unknown"))]
+
+
+def formatProcessor(cpu):
+    if cpu is None or cpu["name"] is None:
+        return [(_("Processor"), _("Unknown CPU"))]
+
+    processorName = cpu["name"].replace("(R)", "\u00A9").replace("(TM)", "\u2122")
+    if cpu["cores"] is not None:
+        processorName = processorName + " \u00D7 " + cpu["cores"]
+    return [(_("Processor"), processorName)]
+
+
+def formatMemory(memTotal):
+    if memTotal is None:
+        return [(_("Memory"), _("Unknown size"))]
+
     try:
-        (memsize, memunit) = procInfos['mem_total'].split(" ")
+        (memsize, memunit) = memTotal.split(" ")
         memsize = float(memsize)
     except ValueError:
-        memsize = procInfos['mem_total']
         memunit = ""
-    processorName = procInfos['cpu_name'].replace("(R)", "\u00A9").replace("(TM)", "\u2122")
-    if 'cpu_cores' in procInfos:
-        processorName = processorName + " \u00D7 " + procInfos['cpu_cores']
-
-    if os.path.exists("/etc/linuxmint/info"):
-        args = shlex.split("awk -F \"=\" '/GRUB_TITLE/ {print $2}' /etc/linuxmint/info")
-        title = subprocess.check_output(args).decode('utf-8').rstrip("\n")
-        infos.append((_("Operating System"), title))
-    elif os.path.exists("/etc/arch-release"):
-        contents = open("/etc/arch-release", 'r').readline().split()
-        title = ' '.join(contents[:2]) or "Arch Linux"
-        infos.append((_("Operating System"), title))
-    elif os.path.exists("/etc/manjaro-release"):
-        contents = open("/etc/manjaro-release", 'r').readline().split()
-        title = ' '.join(contents[:2]) or "Manjaro Linux"
-        infos.append((_("Operating System"), title))
-    else:
-        import distro
-        s = '%s (%s)' % (' '.join(distro.linux_distribution()), arch)
-        # Normalize spacing in distribution name
-        s = re.sub(r'\s{2,}', ' ', s)
-        infos.append((_("Operating System"), s))
-    if 'CINNAMON_VERSION' in os.environ:
-        infos.append((_("Cinnamon Version"), os.environ['CINNAMON_VERSION']))
-    infos.append((_("Linux Kernel"), platform.release()))
-    infos.append((_("Processor"), processorName))
+
     if memunit == "kB":
-        infos.append((_("Memory"), '%.1f %s' % ((float(memsize)/(1024*1024)), _("GiB"))))
-    else:
-        infos.append((_("Memory"), procInfos['mem_total']))
+        return [(_("Memory"), '%.1f %s' % ((memsize/(1024*1024)), _("GiB")))]
+    return [(_("Memory"), memTotal)]
+
 
-    diskSize, multipleDisks = getDiskSize()
-    if (multipleDisks):
+def formatDisks(disks):
+    if disks is None:
+        return [(_("Hard Drive"), _("Unknown size"))]
+
+    if disks["multiple"]:
         diskText = _("Hard Drives")
     else:
         diskText = _("Hard Drive")
-    try:
-        infos.append((diskText, '%.1f %s' % ((diskSize / (1000*1000*1000)), _("GB"))))
-    except:
-        infos.append((diskText, diskSize))
-    cards = getGraphicsInfos()
-    for card in cards:
-        infos.append((_("Graphics Card"), cards[card]))
+    return [(diskText, '%.1f %s' % ((disks["size"] / (1000*1000*1000)), _("GB")))]
+
+
+def formatGraphics(cards):
+    if not cards:
+        return [(_("Graphics Card"), _("Unknown"))]
+    return [(_("Graphics Card"), card) for card in cards]
+
+
+# The rows of the page, in order, with what they show until their probe is done
+INFO_ROWS = [
+    ("os", formatOs, _("Operating System")),
+    ("kernel", formatKernel, _("Linux Kernel")),
+    ("cpu", formatProcessor, _("Processor")),
+    ("memory", formatMemory, _("Memory")),
+    ("disks", formatDisks, _("Hard Drive")),
+    ("gpus", formatGraphics, _("Graphics Card"))
+]
+
+
+class InfoRow(SettingsWidget):
+    """ one or more key/value lines, or a spinner while the value isn't known yet"""
+    def __init__(self, key):
+        SettingsWidget.__init__(self)
+        self.set_orientation(Gtk.Orientation.VERTICAL)
+        self.set_infos([(key, None)])
+
+    def set_infos(self, infos):
+        for child in self.get_children():
+            child.destroy()
+
+        for (key, value) in infos:
+            box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=40)
+            labelKey = Gtk.Label.new(key)
+            box.pack_start(labelKey, False, False, 0)
+            labelKey.get_style_context().add_class("dim-label")
+            if value is None:
+                spinner = Gtk.Spinner(active=True)
+                box.pack_end(spinner, False, False, 0)
+            else:
+                labelValue = Gtk.Label.new(value)
+                labelValue.set_selectable(True)
+                labelValue.set_line_wrap(True)
+                box.pack_end(labelValue, False, False, 0)
+            self.pack_start(box, False, False, 0)
 
-    return infos
+        self.show_all()
 
 
 class Module:
@@ -164,24 +111,30 @@ class Module:
         if not self.loaded:
             print("Loading Info module")
 
-            infos = createSystemInfos()
-
             page = SettingsPage()
             self.sidePage.add_widget(page)
 
             settings = page.add_section(_("System info"))
 
-            for (key, value) in infos:
-                widget = SettingsWidget()
-                widget.set_spacing(40)
-                labelKey = Gtk.Label.new(key)
-                widget.pack_start(labelKey, False, False, 0)
-                labelKey.get_style_context().add_class("dim-label")
-                labelValue = Gtk.Label.new(value)
-                labelValue.set_selectable(True)
-                labelValue.set_line_wrap(True)
-                widget.pack_end(labelValue, False, False, 0)
-                settings.add_row(widget)
+            self.rows = {}
+            self.formatters = {}
+            for (name, formatter, key) in INFO_ROWS:
+                row = InfoRow(key)
+                settings.add_row(row)
+                self.rows[name] = row
+                self.formatters[name] = formatter
+
+                if name == "os" and 'CINNAMON_VERSION' in os.environ:
+                    row = InfoRow(_("Cinnamon Version"))
+                    row.set_infos([(_("Cinnamon Version"), os.environ['CINNAMON_VERSION'])])
+                    settings.add_row(row)
+
+            # What's cached from last time is shown until the probes come back with the current values
+            cache_file = os.path.join(GLib.get_user_cache_dir(), "cinnamon-settings", "system-info.json")
+            probe = SystemProbe(cache_file=cache_file)
+            for (name, result) in probe.load_cache().items():
+                self.show_info(name, result)
+            probe.run(lambda name, result: GLib.idle_add(self.show_info, name, result))
 
             if os.path.exists("/usr/bin/upload-system-info"):
                 widget = SettingsWidget()
@@ -195,6 +148,10 @@ class Module:
                 widget.pack_start(button, True, True, 0)
                 settings.add_row(widget)
 
+    def show_info(self, name, result):
+        self.rows[name].set_infos(self.formatters[name](result))
+        return False
+
     def on_button_clicked(self, button, spinner):
 
         try:
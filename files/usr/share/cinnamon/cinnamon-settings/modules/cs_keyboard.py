@@ -222,6 +222,118 @@ def ensureCustomListIsValid(custom_list):
 
     custom_list.append(DUMMY_CUSTOM_ENTRY);
 
+def getAccelKey(accel):
+    """ The (keyval, modifiers) an accelerator stands for, or None if it's empty or invalid.
+        Accelerators for keys without a keyval use their keycodes instead. """
+    if not accel or accel == "_invalid_":
+        return None
+
+    keyval, codes, mods = Gtk.accelerator_parse_with_keycode(accel)
+    if keyval != 0:
+        return (keyval, int(mods))
+    elif codes:
+        return (tuple(codes), int(mods))
+    return None
+
+def getAccelLabel(accel):
+    keyval, codes, mods = Gtk.accelerator_parse_with_keycode(accel)
+    if keyval == 0:
+        return accel
+    return Gtk.accelerator_get_label(keyval, mods)
+
+class KeyBindingIndex():
+    """ All the keybindings of the page, filed by the keys of their accelerators and by a search
+        text made of their name and accelerators. Each accelerator is parsed once, when its
+        keybinding is added or changes. Settings objects are shared by all keybindings of a
+        schema, and keybindings are reloaded when their keys change. """
+    def __init__(self):
+        self.settings = {}
+        self.watched = {}
+        self.keybindings = []
+        self.by_accel = {}
+        self.accel_keys = {}
+        self.search_texts = {}
+        self.changed_callback = None
+
+    def getSettings(self, schema, path=None):
+        if (schema, path) not in self.settings:
+            if path is None:
+                settings = Gio.Settings.new(schema)
+            else:
+                settings = Gio.Settings.new_with_path(schema, path)
+            settings.connect("changed", self.onSettingsChanged, (schema, path))
+            self.settings[(schema, path)] = settings
+            self.watched[(schema, path)] = {}
+        return self.settings[(schema, path)]
+
+    def add(self, keybinding, schema, path, keys):
+        """ adds keybinding, which is reloaded when one of the keys of its settings changes """
+        for key in keys:
+            self.watched[(schema, path)][key] = keybinding
+        self.keybindings.append(keybinding)
+        self.update(keybinding)
+
+    def forget(self, keybinding):
+        self.unfile(keybinding)
+        self.keybindings.remove(keybinding)
+        for watched in self.watched.values():
+            for key in [key for key in watched if watched[key] is keybinding]:
+                del watched[key]
+
+    def unfile(self, keybinding):
+        for accel_key in self.accel_keys.pop(keybinding, []):
+            keybindings = self.by_accel[accel_key]
+            keybindings.remove(keybinding)
+            if len(keybindings) == 0:
+                del self.by_accel[accel_key]
+        self.search_texts.pop(keybinding, None)
+
+    def update(self, keybinding):
+        """ files keybinding again, after its name or entries changed """
+        self.unfile(keybinding)
+
+        accel_keys = []
+        texts = [keybinding.label.lower()]
+        for entry in keybinding.entries:
+            accel_key = getAccelKey(entry)
+            if accel_key is None:
+                continue
+            accel_keys.append(accel_key)
+            self.by_accel.setdefault(accel_key, []).append(keybinding)
+            texts.append(entry.lower())
+            texts.append(getAccelLabel(entry).lower())
+
+        self.accel_keys[keybinding] = accel_keys
+        self.search_texts[keybinding] = "\n".join(texts)
+
+    def findConflicts(self, accel, keybinding):
+        """ returns the other keybindings that use accel, with the entry that does """
+        accel_key = getAccelKey(accel)
+        conflicts = []
+        for other in self.by_accel.get(accel_key, []):
+            if other is keybinding:
+                continue
+            for entry in other.entries:
+                if getAccelKey(entry) == accel_key:
+                    conflicts.append((other, entry))
+        return conflicts
+
+    def search(self, text):
+        """ returns the keybindings whose name or accelerators contain every word of text """
+        words = text.lower().split()
+        return [keybinding for keybinding in self.keybindings
+                if all(word in self.search_texts[keybinding] for word in words)]
+
+    def onSettingsChanged(self, settings, key, source):
+        keybinding = self.watched[source].get(key)
+        if keybinding is None:
+            return
+
+        keybinding.loadSettings()
+        self.update(keybinding)
+        if self.changed_callback is not None:
+            self.changed_callback(keybinding)
+
 class Module:
     comment = _("Manage keyboard settings and shortcuts")
     name = "keyboard"
@@ -272,7 +384,15 @@ class Module:
             vbox.set_spacing(6)
             self.sidePage.stack.add_titled(vbox, "shortcuts", _("Shortcuts"))
 
+            self.index = KeyBindingIndex()
+            self.index.changed_callback = self.onIndexChanged
+            self.searching = False
+
             headingbox = Gtk.Box.new(Gtk.Orientation.VERTICAL, 2)
+            self.search_entry = Gtk.SearchEntry()
+            self.search_entry.set_placeholder_text(_("Search shortcuts by name or keys"))
+            self.search_entry.connect("search-changed", self.onSearchChanged)
+            headingbox.pack_start(self.search_entry, False, False, 2)
             mainbox = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 2)
             headingbox.pack_start(mainbox, True, True, 2)
             headingbox.pack_end(Gtk.Label.new(_("To edit a keyboard binding, click it and press the new keys, or press backspace to clear it.")), False, False, 1)
@@ -384,7 +504,7 @@ class Module:
             for binding in KEYBINDINGS:
                 for category in self.main_store:
                     if category.int_name == binding[3]:
-                        category.add(KeyBinding(binding[0], binding[1], binding[2], binding[3]))
+                        category.add(KeyBinding(binding[0], binding[1], binding[2], binding[3], self.index))
 
             cat_iters = {}
             longest_cat_label = " "
@@ -434,6 +554,11 @@ class Module:
         self.tabs.append(tab)
 
     def onCategoryChanged(self, tree):
+        if self.searching:
+            # picking a category ends the search
+            self.searching = False
+            self.search_entry.set_text("")
+
         self.kb_store.clear()
         if tree.get_selection() is not None:
             categories, iter = tree.get_selection().get_selected()
@@ -449,26 +574,47 @@ class Module:
     def loadCustoms(self):
         for category in self.main_store:
             if category.int_name == "custom":
+                for keybinding in category.keybindings:
+                    self.index.forget(keybinding)
                 category.clear()
 
-        parent = Gio.Settings.new(CUSTOM_KEYS_PARENT_SCHEMA)
+        parent = self.index.getSettings(CUSTOM_KEYS_PARENT_SCHEMA)
         custom_list = parent.get_strv("custom-list")
 
         for entry in custom_list:
             if entry == DUMMY_CUSTOM_ENTRY:
                 continue
 
-            custom_path = CUSTOM_KEYS_BASENAME+"/"+entry+"/"
-            schema = Gio.Settings.new_with_path(CUSTOM_KEYS_SCHEMA, custom_path)
-            custom_kb = CustomKeyBinding(entry,
-                                         schema.get_string("name"),
-                                         schema.get_string("command"),
-                                         schema.get_strv("binding"))
+            custom_kb = CustomKeyBinding(entry, self.index)
             self.kb_store.append((custom_kb.label, custom_kb))
             for category in self.main_store:
                 if category.int_name == "custom":
                     category.add(custom_kb)
 
+    def onSearchChanged(self, entry):
+        text = entry.get_text().strip()
+        if text == "":
+            if self.searching:
+                self.searching = False
+                self.onCategoryChanged(self.cat_tree)
+            return
+
+        self.searching = True
+        self.kb_store.clear()
+        for keybinding in self.index.search(text):
+            self.kb_store.append((keybinding.label, keybinding))
+        self.remove_custom_button.set_property('sensitive', False)
+
+    def onIndexChanged(self, keybinding):
+        # The keybinding was changed, here or somewhere else
+        for row in self.kb_store:
+            if row[1] is keybinding:
+                row[0] = keybinding.label
+
+        keybindings, iter = self.kb_tree.get_selection().get_selected()
+        if iter and keybindings[iter][1] is keybinding:
+            self.onKeyBindingChanged(self.kb_tree)
+
     def onKeyBindingChanged(self, tree):
         self.entry_store.clear()
         if tree.get_selection() is not None:
@@ -487,31 +633,24 @@ class Module:
             current_keybinding = keybindings[kb_iter][1]
 
         # Check for duplicates
-        for category in self.main_store:
-            for keybinding in category.keybindings:
-                for entry in keybinding.entries:
-                    found = False
-                    if Gtk.accelerator_parse_with_keycode(accel_string) == Gtk.accelerator_parse_with_keycode(entry):
-                        found = True
-
-                    if found and keybinding.label != current_keybinding.label:
-                        dialog = Gtk.MessageDialog(None,
-                                                   Gtk.DialogFlags.DESTROY_WITH_PARENT,
-                                                   Gtk.MessageType.QUESTION,
-                                                   Gtk.ButtonsType.YES_NO,
-                                                   None)
-                        dialog.set_default_size(400, 200)
-                        msg = _("This key combination, <b>%(combination)s</b> is currently in use by <b>%(old)s</b>.  ")
-                        msg += _("If you continue, the combination will be reassigned to <b>%(new)s</b>.\n\n")
-                        msg += _("Do you want to continue with this operation?")
-                        dialog.set_markup(msg % {'combination':html.escape(accel_label), 'old':html.escape(keybinding.label), 'new':html.escape(current_keybinding.label)})
-                        dialog.show_all()
-                        response = dialog.run()
-                        dialog.destroy()
-                        if response == Gtk.ResponseType.YES:
-                            keybinding.setBinding(keybinding.entries.index(entry), None)
-                        else:
-                            return
+        for (keybinding, entry) in self.index.findConflicts(accel_string, current_keybinding):
+            dialog = Gtk.MessageDialog(None,
+                                       Gtk.DialogFlags.DESTROY_WITH_PARENT,
+                                       Gtk.MessageType.QUESTION,
+                                       Gtk.ButtonsType.YES_NO,
+                                       None)
+            dialog.set_default_size(400, 200)
+            msg = _("This key combination, <b>%(combination)s</b> is currently in use by <b>%(old)s</b>.  ")
+            msg += _("If you continue, the combination will be reassigned to <b>%(new)s</b>.\n\n")
+            msg += _("Do you want to continue with this operation?")
+            dialog.set_markup(msg % {'combination':html.escape(accel_label), 'old':html.escape(keybinding.label), 'new':html.escape(current_keybinding.label)})
+            dialog.show_all()
+            response = dialog.run()
+            dialog.destroy()
+            if response == Gtk.ResponseType.YES:
+                keybinding.setBinding(keybinding.entries.index(entry), None)
+            else:
+                return
         current_keybinding.setBinding(int(path), accel_string)
         self.onKeyBindingChanged(self.kb_tree)
         self.entry_tree.get_selection().select_path(path)
@@ -534,7 +673,7 @@ class Module:
             dialog.destroy()
             return
 
-        parent = Gio.Settings.new(CUSTOM_KEYS_PARENT_SCHEMA)
+        parent = self.index.getSettings(CUSTOM_KEYS_PARENT_SCHEMA)
         array = parent.get_strv("custom-list")
         num_array = []
         for entry in array:
@@ -557,7 +696,7 @@ class Module:
         parent.set_strv("custom-list", array)
 
         new_path = CUSTOM_KEYS_BASENAME + "/custom" + str(i) + "/"
-        new_schema = Gio.Settings.new_with_path(CUSTOM_KEYS_SCHEMA, new_path)
+        new_schema = self.index.getSettings(CUSTOM_KEYS_SCHEMA, new_path)
         new_schema.set_string("name", dialog.name_entry.get_text())
         new_schema.set_string("command", dialog.command_entry.get_text().replace("%20", "\ "))
         new_schema.set_strv("binding", ())
@@ -579,6 +718,7 @@ class Module:
             keybinding = keybindings[iter][1]
 
             custom_path = CUSTOM_KEYS_BASENAME + "/" + keybinding.path + "/"
+            # not the shared settings, this one is left in delay mode
             custom_schema = Gio.Settings.new_with_path(CUSTOM_KEYS_SCHEMA, custom_path)
             custom_schema.delay()
             custom_schema.reset("name")
@@ -587,7 +727,7 @@ class Module:
             custom_schema.apply()
             Gio.Settings.sync()
 
-            parent_settings = Gio.Settings(CUSTOM_KEYS_PARENT_SCHEMA)
+            parent_settings = self.index.getSettings(CUSTOM_KEYS_PARENT_SCHEMA)
             array = parent_settings.get_strv("custom-list")
 
             existing = False
@@ -625,6 +765,7 @@ class Module:
                 keybinding.label = dialog.name_entry.get_text()
                 keybinding.action = dialog.command_entry.get_text().replace("%20", "\ ")
                 keybinding.writeSettings();
+                self.index.update(keybinding)
 
                 i = 0
                 for cat in self.cat_store:
@@ -687,12 +828,14 @@ class KeyBindingCategory():
         del self.keybindings[:]
 
 class KeyBinding():
-    def __init__(self, label, schema, key, category):
+    def __init__(self, label, schema, key, category, index):
         self.key = key
         self.label = label
         self.entries = [ ]
-        self.settings = Gio.Settings.new(schema)
+        self.index = index
+        self.settings = index.getSettings(schema)
         self.loadSettings()
+        index.add(self, schema, None, [key])
 
     def loadSettings(self):
         del self.entries[:]
@@ -714,6 +857,7 @@ class KeyBinding():
         else:
             self.entries[index] = ""
         self.writeSettings()
+        self.index.update(self)
 
     def writeSettings(self):
         array = []
@@ -725,13 +869,20 @@ class KeyBinding():
     def resetDefaults(self):
         self.settings.reset(self.key)
         self.loadSettings()
+        self.index.update(self)
 
 class CustomKeyBinding():
-    def __init__(self, path, label, action, binding):
+    def __init__(self, path, index):
         self.path = path
-        self.label = label
-        self.action = action
-        self.entries = self.get_array(binding)
+        self.index = index
+        self.settings = index.getSettings(CUSTOM_KEYS_SCHEMA, CUSTOM_KEYS_BASENAME+"/"+path+"/")
+        self.loadSettings()
+        index.add(self, CUSTOM_KEYS_SCHEMA, CUSTOM_KEYS_BASENAME+"/"+path+"/", ["name", "command", "binding"])
+
+    def loadSettings(self):
+        self.label = self.settings.get_string("name")
+        self.action = self.settings.get_string("command")
+        self.entries = self.get_array(self.settings.get_strv("binding"))
 
     def get_array(self, raw_array):
         result = []
@@ -748,22 +899,23 @@ class CustomKeyBinding():
         else:
             self.entries[index] = ""
         self.writeSettings()
+        self.index.update(self)
 
     def writeSettings(self):
-        custom_path = CUSTOM_KEYS_BASENAME+"/"+self.path+"/"
-        settings = Gio.Settings.new_with_path(CUSTOM_KEYS_SCHEMA, custom_path)
-
-        settings.set_string("name", self.label)
-        settings.set_string("command", self.action)
-
+        # Writing a key reloads this keybinding from the settings, so everything is read before anything is written
+        label = self.label
+        action = self.action
         array = []
         for entry in self.entries:
             if entry != "":
                 array.append(entry)
-        settings.set_strv("binding", array)
+
+        self.settings.set_string("name", label)
+        self.settings.set_string("command", action)
+        self.settings.set_strv("binding", array)
 
         # Touch the custom-list key, this will trigger a rebuild in cinnamon
-        parent = Gio.Settings.new(CUSTOM_KEYS_PARENT_SCHEMA)
+        parent = self.index.getSettings(CUSTOM_KEYS_PARENT_SCHEMA)
         custom_list = parent.get_strv("custom-list")
         custom_list.reverse()
         ensureCustomListIsValid(custom_list);
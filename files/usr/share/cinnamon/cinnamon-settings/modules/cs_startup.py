@@ -4,10 +4,11 @@ import collections
 import os
 import glob
 import shutil
+import time
 
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gio, Gtk, Gdk, GdkPixbuf, GLib, Pango
+from gi.repository import Gio, Gtk, Gdk, GdkPixbuf, GLib, GObject, Pango
 
 from SettingsWidgets import SidePage
 from xapp.GSettingsWidgets import *
@@ -25,6 +26,11 @@ KEYFILE_FLAGS = GLib.KeyFileFlags.KEEP_COMMENTS and GLib.KeyFileFlags.KEEP_TRANS
 
 DELAY_GROUP = Gtk.SizeGroup.new(Gtk.SizeGroupMode.HORIZONTAL)
 
+# Time in ms spent adding rows to the application chooser per main loop iteration
+APP_BATCH_TIME = 10
+
+AppEntry = collections.namedtuple("AppEntry", ["app_id", "info", "name", "search_name", "icon_string", "icon"])
+
 def list_header_func(row, before, user_data):
     if before and not row.get_header():
         row.set_header(Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL))
@@ -48,6 +54,115 @@ def get_blacklisted_apps():
     return set(cs_settings['autostart-blacklist'])
 
 
+def get_autostart_dirs():
+    """ The user's autostart dir, followed by the system ones """
+    dirs = [os.path.join(GLib.get_user_config_dir(), "autostart")]
+    for d in GLib.get_system_config_dirs():
+        dirs.append(os.path.join(d, "autostart"))
+    return dirs
+
+
+def get_autostart_stamp(key):
+    """ The dirs that have a desktop file for key, with its mtime and size """
+    stamp = []
+    for d in get_autostart_dirs():
+        try:
+            info = os.stat(os.path.join(d, "%s.desktop" % key))
+        except OSError:
+            continue
+        stamp.append((d, info.st_mtime_ns, info.st_size))
+    return stamp
+
+
+def load_autostart_app(key, stamp):
+    """ Load the autostart entry for key, or return None if it has no desktop file """
+    user_dir = get_autostart_dirs()[0]
+    basename = "%s.desktop" % key
+    app = None
+    for d, mtime, size in stamp:
+        if d == user_dir:
+            app = AutostartApp(os.path.join(d, basename), user_position=d)
+        elif app is None:
+            app = AutostartApp(os.path.join(d, basename), system_position=d)
+        else:
+            app.system_position = d
+
+    if app is not None:
+        app.stamp = stamp
+    return app
+
+
+def get_app_icon(info):
+    icon = info.get_icon()
+    if isinstance(icon, Gio.ThemedIcon):
+        return Gio.ThemedIcon.new_from_names(icon.get_names() + [DEFAULT_ICON])
+    elif isinstance(icon, Gio.FileIcon) and os.path.exists(icon.get_file().get_path() or ""):
+        return icon
+    return Gio.ThemedIcon.new(DEFAULT_ICON)
+
+
+class AppCatalog(GObject.Object):
+    """ The applications that can be picked in the AppChooserDialog, sorted by name. The list is
+        kept up to date while applications are installed and removed """
+    __gsignals__ = {
+        'changed': (GObject.SignalFlags.RUN_FIRST, None, ())
+    }
+
+    def __init__(self):
+        GObject.Object.__init__(self)
+        self.entries = []
+        self.refresh_id = 0
+        self.refresh()
+
+        self.monitor = Gio.AppInfoMonitor.get()
+        self.monitor.connect("changed", self.on_apps_changed)
+
+    def on_apps_changed(self, monitor):
+        # package installs tend to change several desktop files in a row
+        if self.refresh_id == 0:
+            self.refresh_id = GLib.timeout_add(500, self.refresh)
+
+    def refresh(self):
+        self.refresh_id = 0
+        old_entries = {entry.app_id: entry for entry in self.entries}
+
+        entries = []
+        changed = False
+        for info in Gio.app_info_get_all():
+            if not info.should_show():
+                continue
+            name = info.get_name()
+            if not name:
+                continue
+
+            app_id = info.get_id()
+            icon = info.get_icon()
+            icon_string = icon.to_string() if icon else None
+            entry = old_entries.pop(app_id, None)
+            if entry is None or entry.name != name or entry.icon_string != icon_string:
+                # Only the new and changed applications have their icon looked up
+                entry = AppEntry(app_id, info, name, name.lower(), icon_string, get_app_icon(info))
+                changed = True
+            else:
+                entry = entry._replace(info=info)
+            entries.append(entry)
+
+        entries.sort(key=lambda entry: entry.search_name)
+        self.entries = entries
+
+        if changed or len(old_entries) > 0:
+            self.emit("changed")
+        return False
+
+app_catalog = None
+
+def get_app_catalog():
+    global app_catalog
+    if app_catalog is None:
+        app_catalog = AppCatalog()
+    return app_catalog
+
+
 class Module:
     name = "startup"
     comment = _("Manage your startup applications")
@@ -57,6 +172,8 @@ class Module:
         keywords = _("startup, programs, boot, init, session, autostart, apps")
         sidePage = SidePage(_("Startup Applications"), "cs-startup-programs", keywords, content_box, module=self)
         self.sidePage = sidePage
+        self.changed_apps = set()
+        self.reload_id = 0
 
     def on_module_selected(self):
         if not self.loaded:
@@ -70,14 +187,24 @@ class Module:
 
             settings = AutostartBox(_("Startup Applications"))
             page.pack_start(settings, True, True, 0)
+            self.autostart_box = settings
 
             self.gather_apps()
 
             for app in AUTOSTART_APPS.values():
-                if app.key_file_loaded and app.shown and not app.no_display and not app.hidden:
+                if app.is_listed():
                     row = AutostartRow(app)
                     settings.add_row(row)
 
+            self.monitor_autostart_dirs()
+
+            # Have the applications ready by the time the user wants to add one
+            GLib.idle_add(self.preload_app_catalog, priority=GLib.PRIORITY_LOW)
+
+    def preload_app_catalog(self):
+        get_app_catalog()
+        return False
+
     def ensure_user_autostart_dir(self):
         user_autostart_dir = os.path.join(GLib.get_user_config_dir(), "autostart")
         if not os.path.isdir(user_autostart_dir):
@@ -87,29 +214,60 @@ class Module:
                 print("Could not create autostart dir: %s" % user_autostart_dir)
 
     def gather_apps(self):
-        system_files = []
+        blacklisted_apps = get_blacklisted_apps()
 
+        for d in get_autostart_dirs():
+            for path in glob.glob(os.path.join(d, "*.desktop")):
+                key = get_appname(path)
+                if key in blacklisted_apps or key in AUTOSTART_APPS:
+                    continue
+                app = load_autostart_app(key, get_autostart_stamp(key))
+                if app is not None:
+                    AUTOSTART_APPS[key] = app
+
+    def monitor_autostart_dirs(self):
+        self.monitors = []
+        for d in get_autostart_dirs():
+            if os.path.isdir(d):
+                try:
+                    monitor = Gio.File.new_for_path(d).monitor_directory(Gio.FileMonitorFlags.SEND_MOVED, None)
+                    monitor.connect("changed", self.on_autostart_dir_changed)
+                    self.monitors.append(monitor)
+                except Exception as e:
+                    # File monitors can fail when the OS runs out of file handles
+                    print(e)
+
+    def on_autostart_dir_changed(self, monitor, file, other_file, event):
+        for changed_file in (file, other_file):
+            if changed_file is not None and changed_file.get_basename().endswith(".desktop"):
+                self.changed_apps.add(get_appname(changed_file.get_basename()))
+
+        if len(self.changed_apps) > 0 and self.reload_id == 0:
+            self.reload_id = GLib.timeout_add(200, self.reload_changed_apps)
+
+    def reload_changed_apps(self):
+        # Only the entries whose desktop files were touched are loaded again
+        self.reload_id = 0
         blacklisted_apps = get_blacklisted_apps()
 
-        user_files = glob.glob(os.path.join(GLib.get_user_config_dir(), "autostart", "*.desktop"))
-        for app in user_files:
-            key = get_appname(app)
+        for key in self.changed_apps:
             if key in blacklisted_apps:
                 continue
-            AUTOSTART_APPS[key] = AutostartApp(app, user_position=os.path.dirname(app))
 
-        for d in GLib.get_system_config_dirs():
-            system_files.extend(glob.glob(os.path.join(d, "autostart", "*.desktop")))
-
-        for sys_app in system_files:
-            key = get_appname(sys_app)
-            if key in blacklisted_apps:
+            stamp = get_autostart_stamp(key)
+            app = AUTOSTART_APPS.get(key)
+            if app is not None and app.stamp == stamp:
                 continue
-            if key in AUTOSTART_APPS:
-                AUTOSTART_APPS[key].system_position = os.path.dirname(sys_app)
+
+            app = load_autostart_app(key, stamp)
+            if app is None:
+                AUTOSTART_APPS.pop(key, None)
             else:
-                AUTOSTART_APPS[key] = AutostartApp(sys_app,
-                                                   system_position=os.path.dirname(sys_app))
+                AUTOSTART_APPS[key] = app
+            self.autostart_box.set_app(key, app)
+
+        self.changed_apps.clear()
+        return False
 
 class AutostartApp():
     def __init__(self, app, user_position=None, system_position=None):
@@ -122,6 +280,7 @@ class AutostartApp():
         self.path = app
         self.key_file_loaded = False
         self.basename = None
+        self.stamp = None
 
         self.load()
 
@@ -147,6 +306,9 @@ class AutostartApp():
         self.command = self.get_string(self.key_file, GLib.KEY_FILE_DESKTOP_KEY_EXEC, "")
         self.icon = self.get_locale_string(self.key_file, GLib.KEY_FILE_DESKTOP_KEY_ICON, DEFAULT_ICON)
 
+    def is_listed(self):
+        return self.key_file_loaded and self.shown and not self.no_display and not self.hidden
+
     def get_string(self, key_file, key, default_value=None):
         try:
             retval = key_file.get_string(D_GROUP, key)
@@ -397,6 +559,7 @@ class AutostartBox(Gtk.Box):
         self.infobar_holder = Gtk.Frame(shadow_type=Gtk.ShadowType.NONE)
         self.box.add(self.infobar_holder)
 
+        self.rows = {}
         self.list_box = Gtk.ListBox()
         self.list_box.set_selection_mode(Gtk.SelectionMode.SINGLE)
         self.list_box.set_activate_on_single_click(False)
@@ -447,8 +610,33 @@ class AutostartBox(Gtk.Box):
         box.add(self.run_button)
 
     def add_row(self, row):
+        self.rows[get_appname(row.app.app)] = row
         self.list_box.add(row)
 
+    def remove_row(self, row):
+        if row == self.list_box.get_selected_row():
+            self.edit_button.set_sensitive(False)
+            self.remove_button.set_sensitive(False)
+            self.run_button.set_sensitive(False)
+
+        self.rows.pop(get_appname(row.app.app), None)
+        self.list_box.remove(row)
+
+    def set_app(self, key, app):
+        """ shows app as the autostart entry key, after its desktop files changed on disk """
+        row = self.rows.get(key)
+        if app is None or not app.is_listed():
+            if row is not None:
+                self.remove_row(row)
+        elif row is None:
+            row = AutostartRow(app)
+            self.add_row(row)
+            row.show_all()
+        else:
+            row.app = app
+            row.update()
+            self.list_box.invalidate_sort()
+
     def sort_apps(self, a, b, user_data):
         aname = a.app.name.lower()
         bname = b.app.name.lower()
@@ -494,9 +682,7 @@ class AutostartBox(Gtk.Box):
         row = self.list_box.get_selected_row()
         app = row.app
         app.remove()
-        self.list_box.remove(row)
-        self.edit_button.set_sensitive(False)
-        self.remove_button.set_sensitive(False)
+        self.remove_row(row)
 
     def on_add_button_clicked(self, button):
         popup = Gtk.Menu()
@@ -727,10 +913,10 @@ class AutostartRow(Gtk.ListBoxRow):
         switch_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
         switch_box.set_margin_top(5)
         switch_box.set_margin_bottom(5)
-        switch = Gtk.Switch()
-        switch.set_active(self.app.enabled)
-        switch.connect("notify::active", self.on_switch_activated)
-        switch_box.add(switch)
+        self.switch = Gtk.Switch()
+        self.switch.set_active(self.app.enabled)
+        self.switch.connect("notify::active", self.on_switch_activated)
+        switch_box.add(self.switch)
         grid.attach_next_to(switch_box, self.delay_box, Gtk.PositionType.RIGHT, 1, 1)
 
         self.add(widget)
@@ -746,6 +932,10 @@ class AutostartRow(Gtk.ListBoxRow):
         self.delay_label.set_visible(delay_time_markup != "0")
         self.delay_time_label.set_visible(delay_time_markup != "0")
 
+        self.switch.set_active(self.app.enabled)
+        self.desc_box.set_sensitive(self.app.enabled)
+        self.delay_box.set_sensitive(self.app.enabled)
+
     def on_switch_activated(self, switch, gparam):
         active = switch.get_active()
         if active == self.app.enabled:
@@ -905,7 +1095,9 @@ class AppChooserDialog(Gtk.Dialog):
     def __init__(self):
         Gtk.Dialog.__init__(self, title=_("Applications"))
 
-        self.all = {}
+        self.catalog = get_app_catalog()
+        self.search_text = ""
+        self.populate_id = 0
 
         self.entry = Gtk.SearchEntry()
         self.entry.set_placeholder_text(_("Search Applications..."))
@@ -915,19 +1107,11 @@ class AppChooserDialog(Gtk.Dialog):
         self.search_bar.add(self.entry)
         self.search_bar.props.hexpand = True
 
+        # The catalog is sorted already, so the rows are simply added in order
         list_box = Gtk.ListBox()
-        list_box.set_sort_func(self.sort_apps, None)
         list_box.set_header_func(list_header_func, None)
         list_box.set_filter_func(self.list_filter_func, None)
-        self.entry.connect("search-changed", lambda e: list_box.invalidate_filter())
-
-        apps = Gio.app_info_get_all()
-        for a in apps:
-            if a.should_show():
-                widget = self.build_widget(a)
-                if widget:
-                    self.all[widget] = a
-                    list_box.add(widget)
+        self.entry.connect("search-changed", self.on_search_changed)
 
         frame = Gtk.Frame()
         frame.set_border_width(6)
@@ -952,48 +1136,59 @@ class AppChooserDialog(Gtk.Dialog):
         self.set_size_request(400,300)
 
         self.list_box = list_box
+        self.populate()
 
+        self.catalog_changed_id = self.catalog.connect("changed", self.on_catalog_changed)
+        self.connect("destroy", self.on_destroy)
         self.connect("key-press-event", self.on_key_press)
 
-    def sort_apps(self, a, b, user_data):
-        aname = self.all.get(a).get_name()
-        bname = self.all.get(b).get_name()
+    def on_destroy(self, widget):
+        self.catalog.disconnect(self.catalog_changed_id)
+        if self.populate_id > 0:
+            GLib.source_remove(self.populate_id)
+            self.populate_id = 0
 
-        if aname < bname:
-            return -1
-        elif aname > bname:
-            return 1
-        else:
-            return 0
+    def on_catalog_changed(self, catalog):
+        self.populate()
+
+    def populate(self):
+        if self.populate_id > 0:
+            GLib.source_remove(self.populate_id)
 
-    def build_widget(self, a):
+        for row in self.list_box.get_children():
+            row.destroy()
+
+        # The rows are added a batch at a time, the first ones show up right away
+        self.pending_entries = iter(self.catalog.entries)
+        self.populate_id = 0
+        if self.add_rows():
+            self.populate_id = GLib.idle_add(self.add_rows)
+
+    def add_rows(self):
+        start = time.monotonic()
+        for entry in self.pending_entries:
+            row = self.build_widget(entry)
+            row.show_all()
+            self.list_box.add(row)
+            if time.monotonic() - start > APP_BATCH_TIME / 1000.0:
+                return True
+
+        self.populate_id = 0
+        return False
+
+    def build_widget(self, entry):
         row = Gtk.ListBoxRow()
+        row.entry = entry
         grid = Gtk.Grid()
         grid.set_column_spacing(10)
-        if not a.get_name():
-            return None
-
-        screen = Gdk.Screen.get_default()
-        icon_theme = Gtk.IconTheme.get_for_screen(screen)
 
-        icon = a.get_icon()
-        if icon:
-            try:
-                if GLib.path_is_absolute(icon.to_string()):
-                    iconfile = icon.to_string()
-                    shown_icon = GdkPixbuf.Pixbuf.new_from_file_at_scale(iconfile, 24, 24, True)
-                    img = Gtk.Image.new_from_pixbuf(shown_icon)
-                else:
-                    pixbuf = icon_theme.load_icon(icon.to_string(), 24, Gtk.IconLookupFlags.FORCE_SIZE)
-                    img = Gtk.Image.new_from_pixbuf(pixbuf)
-            except:
-                img = Gtk.Image.new_from_gicon(Gio.ThemedIcon.new(DEFAULT_ICON), Gtk.IconSize.LARGE_TOOLBAR)
-        else:
-            img = Gtk.Image.new_from_gicon(Gio.ThemedIcon.new(DEFAULT_ICON), Gtk.IconSize.LARGE_TOOLBAR)
+        # Gtk only loads the icon once the row is drawn
+        img = Gtk.Image.new_from_gicon(entry.icon, Gtk.IconSize.LARGE_TOOLBAR)
+        img.set_pixel_size(24)
         grid.attach(img, 0, 0, 1, 1)
         img.props.hexpand = False
 
-        label = Gtk.Label(label=a.get_name(), xalign=0)
+        label = Gtk.Label(label=entry.name, xalign=0)
         grid.attach_next_to(label, img, Gtk.PositionType.RIGHT, 1, 1)
         label.props.hexpand = True
         label.props.halign = Gtk.Align.START
@@ -1004,15 +1199,12 @@ class AppChooserDialog(Gtk.Dialog):
 
         return row
 
+    def on_search_changed(self, entry):
+        self.search_text = entry.get_text().lower()
+        self.list_box.invalidate_filter()
+
     def list_filter_func(self, row, unused):
-        text = self.entry.get_text().lower()
-        grid = row.get_child()
-        for child in grid.get_children():
-            if type(child) == Gtk.Label:
-                if text in child.get_text().lower():
-                    return True
-                return False
-        return False
+        return self.search_text in row.entry.search_name
 
     def on_key_press(self, widget, event):
         key_name = Gdk.keyval_name(event.keyval)
@@ -1037,5 +1229,5 @@ class AppChooserDialog(Gtk.Dialog):
     def get_selected_app(self):
         row = self.list_box.get_selected_row()
         if row:
-            return self.all.get(row)
+            return row.entry.info
         return None
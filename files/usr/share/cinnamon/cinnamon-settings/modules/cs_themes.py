@@ -6,12 +6,11 @@ from gi.repository import Gtk
 
 from xapp.GSettingsWidgets import *
 from CinnamonGtkSettings import CssRange, CssOverrideSwitch, GtkSettingsSwitch, PreviewWidget, Gtk2ScrollbarSizeEditor
-from SettingsWidgets import LabelRow, SidePage, walk_directories
+from SettingsWidgets import LabelRow, SidePage
 from ChooserButtonWidgets import PictureChooserButton
 from ExtensionCore import DownloadSpicesPage
 from Spices import Spice_Harvester
-
-import glob
+from themecatalog import ThemeCatalog, ThemeThumbnails
 
 ICON_SIZE = 48
 
@@ -47,6 +46,10 @@ class Module:
             print("Loading Themes module")
 
             self.spices = Spice_Harvester('theme', self.window)
+            self.theme_catalog = ThemeCatalog(ICON_FOLDERS, THEME_FOLDERS)
+            self.theme_thumbnails = ThemeThumbnails(ICON_FOLDERS)
+            # theme name -> menu item, for each chooser's kind of theme
+            self.theme_items = {}
 
             self.sidePage.stack = SettingsStack()
             self.sidePage.add_widget(self.sidePage.stack)
@@ -183,112 +186,86 @@ class Module:
         GLib.timeout_add_seconds(5, self.refresh)
 
     def refresh(self):
+        # The themes are looked for in the background, see on_themes_scanned
+        self.refreshing = False
+        self.theme_catalog.scan(self.on_themes_scanned)
+
+    def on_themes_scanned(self, themes, changes):
         choosers = []
-        choosers.append((self.cursor_chooser, "cursors", self._load_cursor_themes(), self._on_cursor_theme_selected))
-        choosers.append((self.theme_chooser, "gtk-3.0", self._load_gtk_themes(), self._on_gtk_theme_selected))
-        choosers.append((self.metacity_chooser, "metacity-1", self._load_metacity_themes(), self._on_metacity_theme_selected))
-        choosers.append((self.cinnamon_chooser, "cinnamon", self._load_cinnamon_themes(), self._on_cinnamon_theme_selected))
-        choosers.append((self.icon_chooser, "icons", self._load_icon_themes(), self._on_icon_theme_selected))
+        choosers.append((self.cursor_chooser, "cursors", themes["cursors"], self._on_cursor_theme_selected))
+        choosers.append((self.theme_chooser, "gtk-3.0", themes["gtk-3.0"], self._on_gtk_theme_selected))
+        choosers.append((self.metacity_chooser, "metacity-1", themes["metacity-1"], self._on_metacity_theme_selected))
+        choosers.append((self.cinnamon_chooser, "cinnamon", themes["cinnamon"], self._on_cinnamon_theme_selected))
+        choosers.append((self.icon_chooser, "icons", themes["icons"], self._on_icon_theme_selected))
         for chooser in choosers:
-            chooser[0].clear_menu()
-            chooser[0].set_sensitive(False)
-            chooser[0].progress = 0.0
+            path_suffix = chooser[1]
+            # Choosers whose themes didn't change are left alone
+            if path_suffix not in changes:
+                continue
 
             chooser_obj = chooser[0]
-            path_suffix = chooser[1]
             themes = chooser[2]
             callback = chooser[3]
+            if path_suffix in self.theme_items:
+                # Only the themes that came or went are added to or taken out of the menu
+                (added, removed) = changes[path_suffix]
+                self.update_chooser(chooser_obj, path_suffix, added, removed, callback)
+                continue
+
+            chooser_obj.clear_menu()
+            chooser_obj.set_sensitive(False)
+            chooser_obj.progress = 0.0
+
             payload = (chooser_obj, path_suffix, themes, callback)
             self.refresh_chooser(payload)
-        self.refreshing = False
 
     def refresh_chooser(self, payload):
         (chooser, path_suffix, themes, callback) = payload
 
-        inc = 1.0
-        if len(themes) > 0:
-            inc = 1.0 / len(themes)
-
-        if path_suffix == 'icons':
-            cache_folder = GLib.get_user_cache_dir() + '/cs_themes/'
-            icon_cache_path = os.path.join(cache_folder, 'icons')
-
-            # Retrieve list of known themes/locations for faster loading (icon theme loading and lookup are very slow)
-            if os.path.exists(icon_cache_path):
-                read_path = icon_cache_path
-            else:
-                read_path = '/usr/share/cinnamon/cinnamon-settings/icons'
-
-            icon_paths = {}
-            with open(read_path, 'r') as cache_file:
-                for line in cache_file:
-                    theme_name, icon_path = line.strip().split(':')
-                    icon_paths[theme_name] = icon_path
-
-            dump = False
-            for theme in themes:
-                theme_path = None
-
-                if theme in icon_paths:
-                    # loop through all possible locations until we find a match
-                    # (user folders should override system ones)
-                    for theme_folder in ICON_FOLDERS:
-                        possible_path = os.path.join(theme_folder, icon_paths[theme])
-                        if os.path.exists(possible_path):
-                            theme_path = possible_path
-                            break
-
-                if theme_path is None:
-                    icon_theme = Gtk.IconTheme()
-                    icon_theme.set_custom_theme(theme)
-                    folder = icon_theme.lookup_icon('folder', ICON_SIZE, Gtk.IconLookupFlags.FORCE_SVG)
-                    if folder:
-                        theme_path = folder.get_filename()
-
-                        # we need to get the relative path for storage
-                        for theme_folder in ICON_FOLDERS:
-                            if os.path.commonpath([theme_folder, theme_path]) == theme_folder:
-                                icon_paths[theme] = os.path.relpath(theme_path, start=theme_folder)
-                                break
-
-                    dump = True
-
-                if theme_path == None:
-                    continue;
-
-                if os.path.exists(theme_path):
-                    chooser.add_picture(theme_path, callback, title=theme, id=theme)
-                GLib.timeout_add(5, self.increment_progress, (chooser, inc))
-
-            if dump:
-                if not os.path.exists(cache_folder):
-                    os.mkdir(cache_folder)
-
-                with open(icon_cache_path, 'w') as cache_file:
-                    for theme_name, icon_path in icon_paths.items():
-                        cache_file.write('%s:%s\n' % (theme_name, icon_path))
+        if path_suffix == "cinnamon":
+            chooser.add_picture("/usr/share/cinnamon/theme/thumbnail.png", callback, title="cinnamon", id="cinnamon")
+
+        # Previews that aren't cached (or are out of date) get a placeholder for now and are made in the background.
+        # The chooser keeps track of the progress and emits pictures-loaded once they're all in (see hide_progress)
+        self.theme_items[path_suffix] = {}
+        for theme_name, theme_folder in themes:
+            self.add_theme(chooser, path_suffix, theme_name, theme_folder, callback)
+
+    def update_chooser(self, chooser, path_suffix, added, removed, callback):
+        items = self.theme_items[path_suffix]
+        for theme_name, theme_folder in removed:
+            menuitem = items.pop(theme_name, None)
+            if menuitem is not None:
+                chooser.remove_picture(menuitem)
+
+        # The themes are sorted by name, like the catalog sorts them. The cinnamon chooser starts
+        # with the default theme
+        offset = 1 if path_suffix == "cinnamon" else 0
+        for theme_name, theme_folder in added:
+            position = offset + sum(1 for name in items if name.lower() < theme_name.lower())
+            self.add_theme(chooser, path_suffix, theme_name, theme_folder, callback, position)
+
+    def add_theme(self, chooser, path_suffix, theme_name, theme_folder, callback, position=None):
+        size = chooser.menu_pictures_size
+        theme_path = os.path.join(theme_folder, theme_name)
+        pixbuf, path = self.theme_thumbnails.lookup(path_suffix, theme_path, size)
+        menuitem = chooser.add_pixbuf(pixbuf, path, callback, title=theme_name, id=theme_name, position=position)
+        self.theme_items[path_suffix][theme_name] = menuitem
+        if pixbuf is None:
+            self.theme_thumbnails.generate(path_suffix, theme_path, size, self.on_thumbnail_ready,
+                                           chooser, path_suffix, theme_name, menuitem)
+
+    def on_thumbnail_ready(self, pixbuf, path, chooser, path_suffix, theme_name, menuitem):
+        if self.theme_items[path_suffix].get(theme_name) is not menuitem:
+            # the theme was taken out of the menu in the meantime
+            return
 
+        if pixbuf is None:
+            # there's nothing to show for it (an icon theme without a folder icon)
+            del self.theme_items[path_suffix][theme_name]
+            chooser.remove_picture(menuitem)
         else:
-            if path_suffix == "cinnamon":
-                chooser.add_picture("/usr/share/cinnamon/theme/thumbnail.png", callback, title="cinnamon", id="cinnamon")
-            for theme in themes:
-                theme_name = theme[0]
-                theme_path = theme[1]
-                try:
-                    for path in ["%s/%s/%s/thumbnail.png" % (theme_path, theme_name, path_suffix),
-                                 "/usr/share/cinnamon/thumbnails/%s/%s.png" % (path_suffix, theme_name),
-                                 "/usr/share/cinnamon/thumbnails/%s/unknown.png" % path_suffix]:
-                        if os.path.exists(path):
-                            chooser.add_picture(path, callback, title=theme_name, id=theme_name)
-                            break
-                except:
-                    chooser.add_picture("/usr/share/cinnamon/thumbnails/%s/unknown.png" % path_suffix, callback, title=theme_name, id=theme_name)
-                GLib.timeout_add(5, self.increment_progress, (chooser, inc))
-        GLib.timeout_add(500, self.hide_progress, chooser)
-
-    def increment_progress(self, payload):
-        (chooser, inc) = payload
-        chooser.increment_loading_progress(inc)
+            chooser.set_menu_picture(menuitem, pixbuf, path)
 
     def hide_progress(self, chooser):
         chooser.set_sensitive(True)
@@ -313,6 +290,7 @@ class Module:
 
     def create_button_chooser(self, settings, key, path_prefix, path_suffix, button_picture_size, menu_pictures_size, num_cols):
         chooser = PictureChooserButton(num_cols=num_cols, button_picture_size=button_picture_size, menu_pictures_size=menu_pictures_size, has_button_label=True)
+        chooser.connect("pictures-loaded", self.hide_progress)
         theme = settings.get_string(key)
         chooser.set_button_label(theme)
         chooser.set_tooltip_text(theme)
@@ -384,104 +362,6 @@ class Module:
             print(detail)
         return True
 
-    def _load_gtk_themes(self):
-        """ Only shows themes that have variations for gtk+-3 and gtk+-2 """
-        dirs = THEME_FOLDERS
-        valid = walk_directories(dirs, self.filter_func_gtk_dir, return_directories=True)
-        valid.sort(key=lambda a: a[0].lower())
-        res = []
-        for i in valid:
-            for j in res:
-                if i[0] == j[0]:
-                    if i[1] == dirs[0]:
-                        continue
-                    else:
-                        res.remove(j)
-            res.append((i[0], i[1]))
-        return res
-
-    def filter_func_gtk_dir(self, directory):
-        # returns whether a directory is a valid GTK theme
-        if os.path.exists(os.path.join(directory, "gtk-2.0")):
-            if os.path.exists(os.path.join(directory, "gtk-3.0")):
-                return True
-            else:
-                for subdir in glob.glob("%s/gtk-3.*" % directory):
-                    return True
-        return False
-
-    def _load_icon_themes(self):
-        dirs = ICON_FOLDERS
-        walked = walk_directories(dirs, lambda d: os.path.isdir(d), return_directories=True)
-        valid = []
-        for directory in walked:
-            path = os.path.join(directory[1], directory[0], "index.theme")
-            if os.path.exists(path):
-                try:
-                    for line in list(open(path)):
-                        if line.startswith("Directories="):
-                            valid.append(directory)
-                            break
-                except Exception as e:
-                    print (e)
-
-        valid.sort(key=lambda a: a[0].lower())
-        res = []
-        for i in valid:
-            for j in res:
-                if i[0] == j:
-                    if i[1] == dirs[0]:
-                        continue
-                    else:
-                        res.remove(j)
-            res.append(i[0])
-        return res
-
-    def _load_cursor_themes(self):
-        dirs = ICON_FOLDERS
-        valid = walk_directories(dirs, lambda d: os.path.isdir(d) and os.path.exists(os.path.join(d, "cursors")), return_directories=True)
-        valid.sort(key=lambda a: a[0].lower())
-        res = []
-        for i in valid:
-            for j in res:
-                if i[0] == j[0]:
-                    if i[1] == dirs[0]:
-                        continue
-                    else:
-                        res.remove(j)
-            res.append((i[0], i[1]))
-        return res
-
-    def _load_metacity_themes(self):
-        dirs = THEME_FOLDERS
-        valid = walk_directories(dirs, lambda d: os.path.exists(os.path.join(d, "metacity-1/metacity-theme-3.xml")), return_directories=True)
-        valid.sort(key=lambda a: a[0].lower())
-        res = []
-        for i in valid:
-            for j in res:
-                if i[0] == j[0]:
-                    if i[1] == dirs[0]:
-                        continue
-                    else:
-                        res.remove(j)
-            res.append((i[0], i[1]))
-        return res
-
-    def _load_cinnamon_themes(self):
-        dirs = THEME_FOLDERS
-        valid = walk_directories(dirs, lambda d: os.path.exists(os.path.join(d, "cinnamon")), return_directories=True)
-        valid.sort(key=lambda a: a[0].lower())
-        res = []
-        for i in valid:
-            for j in res:
-                if i[0] == j[0]:
-                    if i[1] == dirs[0]:
-                        continue
-                    else:
-                        res.remove(j)
-            res.append((i[0], i[1]))
-        return res
-
     def update_cursor_theme_link(self, path, name):
         default_dir = os.path.join(os.path.expanduser("~"), ".icons", "default")
         index_path = os.path.join(default_dir, "index.theme")
@@ -1,19 +1,25 @@
 #!/usr/bin/python3
 
-from gi.repository import Gio, GLib
+import gi
+gi.require_version('Gdk', '3.0')
+from gi.repository import Gio, GLib, Gdk
 import dbus, dbus.service, dbus.glib
 from dbus.mainloop.glib import DBusGMainLoop
-import random
-import os, locale
+import os, locale, math
 from xml.etree import ElementTree
 from setproctitle import setproctitle
 
+from playlist import Playlist
+from prerender import WallpaperRenderer, get_target_size
+
 SLIDESHOW_DBUS_NAME = "org.Cinnamon.Slideshow"
 SLIDESHOW_DBUS_PATH = "/org/Cinnamon/Slideshow"
 
 BACKGROUND_COLLECTION_TYPE_DIRECTORY = "directory"
 BACKGROUND_COLLECTION_TYPE_XML = "xml"
 
+SESSION_PRESENCE_STATUS_IDLE = 3
+
 class CinnamonSlideshow(dbus.service.Object):
     def __init__(self):
         bus_name = dbus.service.BusName(SLIDESHOW_DBUS_NAME, bus=dbus.SessionBus())
@@ -21,18 +27,31 @@ class CinnamonSlideshow(dbus.service.Object):
 
         self.slideshow_settings = Gio.Settings(schema="org.cinnamon.desktop.background.slideshow")
         self.background_settings = Gio.Settings(schema="org.cinnamon.desktop.background")
+        # picture-uri may point at a render, this is where the picture it was made from is kept
+        self.source_settings = Gio.Settings(schema="org.cinnamon.background")
 
         if self.slideshow_settings.get_boolean("slideshow-paused"):
             self.slideshow_settings.set_boolean("slideshow-paused", False)
 
-        self.image_playlist = []
-        self.used_image_playlist = []
+        self.playlist = Playlist()
         self.images_ready = False
         self.update_in_progress = False
         self.current_image = self.background_settings.get_string("picture-uri")
 
+        # The next image is picked as soon as the background changes, so it can be rendered
+        # for the screen before it's needed
+        self.renderer = WallpaperRenderer()
+        self.next_image = None
+        self.next_rendered = None
+        self.next_size = None
+
+        # A single timer is armed for the next change, and only while the slideshow is running and
+        # the session is in use. last_change is when the background last changed (monotonic time),
+        # or None if it's due right away
         self.update_id = 0
-        self.loop_counter = self.slideshow_settings.get_int("delay")
+        self.last_change = None
+        self.session_idle = False
+        self.screen_locked = False
 
         self.folder_monitor = None
         self.folder_monitor_id = 0
@@ -43,28 +62,22 @@ class CinnamonSlideshow(dbus.service.Object):
 
     @dbus.service.method(SLIDESHOW_DBUS_NAME, in_signature='', out_signature='')
     def end(self):
-        if self.update_id > 0:
-            GLib.source_remove(self.update_id)
-            self.update_id = 0
-
+        self.cancel_next_change()
         ml.quit()
 
     @dbus.service.method(SLIDESHOW_DBUS_NAME, in_signature='', out_signature='')
     def getNextImage(self):
-        if self.update_id > 0:
-            GLib.source_remove(self.update_id)
-            self.update_id = 0
-
-        self.loop_counter = self.slideshow_settings.get_int("delay")
-        self.start_mainloop()
+        self.last_change = None
+        self.schedule_next_change()
 
     def setup_slideshow(self):
         self.load_settings()
         self.connect_signals()
+        self.connect_session_signals()
         self.gather_images()
         if self.collection_type == BACKGROUND_COLLECTION_TYPE_DIRECTORY:
             self.connect_folder_monitor()
-        self.start_mainloop()
+        self.schedule_next_change()
 
     def format_source(self, type, path):
         # returns 'type://path'
@@ -78,12 +91,51 @@ class CinnamonSlideshow(dbus.service.Object):
         if self.collection != "" and "://" in self.collection:
             (self.collection_type, self.collection_path) = self.collection.split("://")
             self.collection_path = os.path.expanduser(self.collection_path)
+        self.playlist = Playlist(sorted_order=(self.collection_type == BACKGROUND_COLLECTION_TYPE_DIRECTORY))
 
     def connect_signals(self):
         self.slideshow_settings.connect("changed::image-source", self.on_slideshow_source_changed)
         self.slideshow_settings.connect("changed::random-order", self.on_random_order_changed)
+        self.slideshow_settings.connect("changed::delay", self.on_schedule_changed)
+        self.slideshow_settings.connect("changed::slideshow-paused", self.on_schedule_changed)
         self.background_settings.connect("changed::picture-uri", self.on_picture_uri_changed)
 
+    def connect_session_signals(self):
+        bus = dbus.SessionBus()
+        bus.add_signal_receiver(self.on_session_status_changed, signal_name="StatusChanged",
+                                dbus_interface="org.gnome.SessionManager.Presence",
+                                path="/org/gnome/SessionManager/Presence")
+        bus.add_signal_receiver(self.on_screensaver_active_changed, signal_name="ActiveChanged",
+                                dbus_interface="org.cinnamon.ScreenSaver",
+                                path="/org/cinnamon/ScreenSaver")
+
+        # Neither is started just to ask, if they aren't running the session is taken to be in use
+        try:
+            if bus.name_has_owner("org.gnome.SessionManager"):
+                presence = bus.get_object("org.gnome.SessionManager", "/org/gnome/SessionManager/Presence", introspect=False)
+                presence.Get("org.gnome.SessionManager.Presence", "status",
+                             dbus_interface="org.freedesktop.DBus.Properties",
+                             reply_handler=self.on_session_status_changed,
+                             error_handler=self.on_session_query_error)
+            if bus.name_has_owner("org.cinnamon.ScreenSaver"):
+                screensaver = bus.get_object("org.cinnamon.ScreenSaver", "/org/cinnamon/ScreenSaver", introspect=False)
+                screensaver.GetActive(dbus_interface="org.cinnamon.ScreenSaver",
+                                      reply_handler=self.on_screensaver_active_changed,
+                                      error_handler=self.on_session_query_error)
+        except dbus.exceptions.DBusException as e:
+            print("Could not get the session state: %s" % e)
+
+    def on_session_query_error(self, error):
+        print("Could not get the session state: %s" % error)
+
+    def on_session_status_changed(self, status):
+        self.session_idle = (status == SESSION_PRESENCE_STATUS_IDLE)
+        self.schedule_next_change()
+
+    def on_screensaver_active_changed(self, active):
+        self.screen_locked = bool(active)
+        self.schedule_next_change()
+
     def connect_folder_monitor(self):
         folder_path = Gio.file_new_for_path(self.collection_path)
         self.folder_monitor = folder_path.monitor_directory(0, None)
@@ -108,9 +160,7 @@ class CinnamonSlideshow(dbus.service.Object):
 
         elif self.collection_type == BACKGROUND_COLLECTION_TYPE_XML:
             pictures = self.parse_xml_backgrounds_list(self.collection_path)
-            for picture in pictures:
-                filename = picture["filename"]
-                self.add_image_to_playlist(filename)
+            self.add_images_to_playlist([picture["filename"] for picture in pictures])
 
     def gather_images_cb(self, obj, res, user_data):
         all_files = []
@@ -128,28 +178,34 @@ class CinnamonSlideshow(dbus.service.Object):
         enumerator.next_files_async(100, GLib.PRIORITY_LOW, None, on_next_file_complete, all_files)
 
     def ensure_file_is_image(self, file_list):
+        file_paths = []
         for item in file_list:
             file_type = item.get_file_type();
             if file_type is not Gio.FileType.DIRECTORY:
                 file_contents = item.get_content_type();
                 if file_contents.startswith("image"):
-                    self.add_image_to_playlist(self.collection_path + "/" + item.get_name())
+                    file_paths.append(self.collection_path + "/" + item.get_name())
+        self.add_images_to_playlist(file_paths)
 
     def add_image_to_playlist(self, file_path):
         image = Gio.file_new_for_path(file_path)
-        image_uri = image.get_uri();
-        self.image_playlist.append(image_uri)
-        if self.collection_type == BACKGROUND_COLLECTION_TYPE_DIRECTORY:
-            self.image_playlist.sort()
-        self.images_ready = True
+        self.playlist.add(image.get_uri())
+        self.set_images_ready()
+
+    def add_images_to_playlist(self, file_paths):
+        # The playlist is only put in order once, after all the images are in
+        image_uris = [Gio.file_new_for_path(file_path).get_uri() for file_path in file_paths]
+        if self.playlist.extend(image_uris):
+            self.set_images_ready()
+
+    def set_images_ready(self):
+        if not self.images_ready:
+            self.images_ready = True
+            self.schedule_next_change()
 
     def on_slideshow_source_changed(self, settings, key):
-        if self.update_id > 0:
-            GLib.source_remove(self.update_id)
-            self.update_id = 0
+        self.cancel_next_change()
         self.disconnect_folder_monitor()
-        self.image_playlist = []
-        self.used_image_playlist = []
         self.images_ready = False
         self.collection = self.slideshow_settings.get_string("image-source")
         self.collection_path = ""
@@ -157,22 +213,20 @@ class CinnamonSlideshow(dbus.service.Object):
         if self.collection != "" and "://" in self.collection:
             (self.collection_type, self.collection_path) = self.collection.split("://")
             self.collection_path = os.path.expanduser(self.collection_path)
+        self.playlist = Playlist(sorted_order=(self.collection_type == BACKGROUND_COLLECTION_TYPE_DIRECTORY))
+        self.next_image = None
         if self.collection_type == BACKGROUND_COLLECTION_TYPE_DIRECTORY:
             self.connect_folder_monitor()
+        self.last_change = None
         self.gather_images()
-        self.loop_counter = self.slideshow_settings.get_int("delay")
-        self.start_mainloop()
+        self.schedule_next_change()
 
     def on_monitored_folder_changed(self, monitor, file1, file2, event_type):
         try:
             if event_type == Gio.FileMonitorEvent.DELETED:
-                file_uri = file1.get_uri();
-                if self.image_playlist.count(file_uri) > 0:
-                    index_to_remove = self.image_playlist.index(file_uri)
-                    del self.image_playlist[index_to_remove]
-                elif self.used_image_playlist.count(file_uri) > 0:
-                    index_to_remove = self.used_image_playlist.index(file_uri)
-                    del self.used_image_playlist[index_to_remove]
+                self.playlist.remove(file1.get_uri())
+                if file1.get_uri() == self.next_image:
+                    self.next_image = None
 
             if event_type == Gio.FileMonitorEvent.CREATED:
                 file_path = file1.get_path()
@@ -195,21 +249,42 @@ class CinnamonSlideshow(dbus.service.Object):
             if self.background_settings.get_string("picture-uri") != self.current_image:
                 self.slideshow_settings.set_boolean("slideshow-enabled", False)
 
-    def start_mainloop(self):
+    def on_schedule_changed(self, settings, key):
+        self.schedule_next_change()
+
+    def cancel_next_change(self):
         if self.update_id > 0:
             GLib.source_remove(self.update_id)
             self.update_id = 0
 
-        if not self.images_ready:
-            self.update_id = GLib.timeout_add_seconds(1, self.start_mainloop)
+    def schedule_next_change(self):
+        """ arms the timer for the next change of background. Nothing is armed until there are images,
+            or while the slideshow is paused or the session idle or locked: these all call back here
+            when they change, and a change that came due in the meantime happens right away"""
+        self.cancel_next_change()
+
+        if not self.images_ready or self.session_idle or self.screen_locked:
+            return
+        if self.slideshow_settings.get_boolean("slideshow-paused"):
+            return
+
+        if self.last_change is None:
+            remaining = 0
         else:
-            if self.loop_counter >= self.slideshow_settings.get_int("delay") and not self.slideshow_settings.get_boolean("slideshow-paused"):
-                self.loop_counter = 1
-                self.update_background()
-                self.update_id = GLib.timeout_add_seconds(60, self.start_mainloop)
-            else:
-                self.loop_counter = self.loop_counter + 1
-                self.update_id = GLib.timeout_add_seconds(60, self.start_mainloop)
+            elapsed = (GLib.get_monotonic_time() - self.last_change) / 1000000
+            remaining = max(1, self.slideshow_settings.get_int("delay")) * 60 - elapsed
+
+        if remaining <= 0:
+            self.on_change_due()
+        else:
+            self.update_id = GLib.timeout_add_seconds(math.ceil(remaining), self.on_change_due)
+
+    def on_change_due(self):
+        self.update_id = 0
+        self.update_background()
+        self.last_change = GLib.get_monotonic_time()
+        self.schedule_next_change()
+        return False
 
     def update_background(self):
         if self.update_in_progress:
@@ -217,37 +292,39 @@ class CinnamonSlideshow(dbus.service.Object):
 
         self.update_in_progress = True
 
-        if len(self.image_playlist) == 0:
-            self.move_used_images_to_original_playlist()
+        if self.next_image is None:
+            self.next_image = self.playlist.next(self.random_order)
+            self.next_rendered = None
 
-        next_image = self.get_next_image_from_list()
-        if next_image is not None:
-            self.background_settings.set_string("picture-uri", next_image)
-            self.current_image = next_image
-
-        self.update_in_progress = False
+        if self.next_image is not None:
+            # Use the render if it's done and still fits the screen, or else the picture itself
+            size = get_target_size(self.background_settings.get_string("picture-options"))
+            if self.next_rendered is not None and size == self.next_size:
+                image = self.next_rendered
+            else:
+                image = self.renderer.lookup(self.next_image, size) or self.next_image
 
-    def get_next_image_from_list(self):
-        if self.random_order:
-            index = random.randint(0, len(self.image_playlist) - 1)
-            image = self.image_playlist[index]
-        else:
-            index = 0
-            image = self.image_playlist[index]
+            self.source_settings.set_string("slideshow-source-uri", self.next_image)
+            self.background_settings.set_string("picture-uri", image)
+            self.current_image = image
+            self.prefetch_next_image()
 
-        self.move_image_to_used_playlist(index, image)
+        self.update_in_progress = False
 
-        return image
+    def prefetch_next_image(self):
+        self.next_image = self.playlist.next(self.random_order)
+        self.next_rendered = None
+        if self.next_image is None:
+            return
 
-    def move_image_to_used_playlist(self, index, image):
-        self.image_playlist.pop(index)
-        self.used_image_playlist.append(image)
+        self.next_size = get_target_size(self.background_settings.get_string("picture-options"))
+        if self.next_size is not None:
+            self.renderer.prefetch(self.next_image, self.next_size, self.on_next_image_rendered, keep=(self.current_image,))
 
-    def move_used_images_to_original_playlist(self):
-        self.image_playlist = self.used_image_playlist
-        if self.collection_type == BACKGROUND_COLLECTION_TYPE_DIRECTORY:
-            self.image_playlist.sort()
-        self.used_image_playlist = []
+    def on_next_image_rendered(self, image, rendered):
+        if image == self.next_image:
+            self.next_rendered = rendered
+        return False
 
 
 ########### TAKEN FROM CS_BACKGROUND
@@ -311,6 +388,8 @@ class CinnamonSlideshow(dbus.service.Object):
 if __name__ == "__main__":
     setproctitle("cinnamon-slideshow")
     DBusGMainLoop(set_as_default=True)
+    # Only needed to know the size of the monitors, the pictures are shown as they are without it
+    Gdk.init_check([])
 
     sessionBus = dbus.SessionBus ()
     request = sessionBus.request_name(SLIDESHOW_DBUS_NAME, dbus.bus.NAME_FLAG_DO_NOT_QUEUE)
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+
+import heapq
+import itertools
+import random
+
+
+class Playlist(object):
+    """ The images of a slideshow. Every image is shown once before any is shown again, either in
+        order or shuffled.
+
+        Images that are left in the current round are kept in a list (for picking one at random) and
+        in a heap (for picking the next one in order). Removing an image only drops it from the list,
+        the heap skips it when it comes up. Played images wait in a dict until the round is over. """
+    def __init__(self, sorted_order=True):
+        # Images are played sorted by uri, or else in the order they were added
+        self.sorted_order = sorted_order
+        self.counter = itertools.count()
+
+        self.keys = {}
+        self.pool = []
+        self.remaining = {}
+        self.heap = []
+        self.played = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, uri):
+        return uri in self.keys
+
+    def _key(self, uri):
+        return uri if self.sorted_order else next(self.counter)
+
+    def _add(self, uri):
+        self.keys[uri] = self._key(uri)
+        self.remaining[uri] = len(self.pool)
+        self.pool.append(uri)
+
+    def _take(self, uri):
+        # swaps the last image of the pool in uri's place
+        index = self.remaining.pop(uri)
+        last = self.pool.pop()
+        if last != uri:
+            self.pool[index] = last
+            self.remaining[last] = index
+
+    def add(self, uri):
+        """ adds an image to the current round, unless it's already in the playlist"""
+        if uri in self.keys:
+            return False
+
+        self._add(uri)
+        heapq.heappush(self.heap, (self.keys[uri], uri))
+        return True
+
+    def extend(self, uris):
+        """ adds a batch of images, ordering them once at the end"""
+        added = False
+        for uri in uris:
+            if uri not in self.keys:
+                self._add(uri)
+                added = True
+
+        if added:
+            self.heap = [(self.keys[uri], uri) for uri in self.pool]
+            heapq.heapify(self.heap)
+        return added
+
+    def remove(self, uri):
+        if uri not in self.keys:
+            return False
+
+        if uri in self.remaining:
+            self._take(uri)
+        else:
+            del self.played[uri]
+        del self.keys[uri]
+        return True
+
+    def clear(self):
+        self.keys = {}
+        self.pool = []
+        self.remaining = {}
+        self.heap = []
+        self.played = {}
+
+    def _start_round(self):
+        for uri in self.played:
+            self.remaining[uri] = len(self.pool)
+            self.pool.append(uri)
+        self.played = {}
+
+        self.heap = [(self.keys[uri], uri) for uri in self.pool]
+        heapq.heapify(self.heap)
+
+    def next(self, random_order=False):
+        """ returns the image to show next, or None if the playlist is empty"""
+        if len(self.pool) == 0:
+            self._start_round()
+            if len(self.pool) == 0:
+                return None
+
+        if random_order:
+            uri = self.pool[random.randrange(len(self.pool))]
+        else:
+            while True:
+                key, uri = heapq.heappop(self.heap)
+                # skip images that were removed, played already, or added again since
+                if uri in self.remaining and self.keys[uri] == key:
+                    break
+
+        self._take(uri)
+        self.played[uri] = True
+        return uri
@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+
+# Pre-rendered wallpapers for the slideshow.
+#
+# Photos are often much larger than the screen (6K and up), and whatever
+# picture-uri points to is decoded at full size by the compositor when the
+# background changes. Rendering the next image ahead of time, in a thread,
+# already turned the right way up and scaled down to what the monitors need,
+# means the switch itself only has to load a screen-sized file.
+#
+# picture-uri points at the render, so renders are kept in the data directory
+# (a cache could be emptied from under the desktop) and trimmed to
+# RENDER_DIR_SIZE, oldest first. Their names end with the name of the picture
+# they were made from, and the slideshow keeps the uri of that picture in
+# org.cinnamon.background's slideshow-source-uri.
+
+import hashlib
+import os
+import threading
+
+import gi
+gi.require_version('Gdk', '3.0')
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import Gdk, GdkPixbuf, Gio, GLib
+
+RENDER_DIR_SIZE = 128 * 1024 * 1024
+JPEG_QUALITY = "92"
+
+# EXIF orientations that turn the picture by 90 degrees
+ROTATED_ORIENTATIONS = ("5", "6", "7", "8")
+
+# How much of the screen each picture-options value needs. Centered and tiled pictures are shown
+# at their own size, so they're left alone
+OPTION_SPANS_SCREEN = {
+    "scaled": False,
+    "stretched": False,
+    "zoom": False,
+    "spanned": True
+}
+
+
+def get_target_size(option):
+    """ returns the size a wallpaper needs to be for the current monitors and picture-options value,
+        or None if it shouldn't be scaled (or the monitors aren't known, Gdk needs to be initialized)"""
+    if option not in OPTION_SPANS_SCREEN:
+        return None
+
+    display = Gdk.Display.get_default()
+    if display is None:
+        return None
+
+    width = height = 0
+    left = top = right = bottom = 0
+    for i in range(display.get_n_monitors()):
+        monitor = display.get_monitor(i)
+        geometry = monitor.get_geometry()
+        scale = monitor.get_scale_factor()
+        width = max(width, geometry.width * scale)
+        height = max(height, geometry.height * scale)
+        left = min(left, geometry.x * scale)
+        top = min(top, geometry.y * scale)
+        right = max(right, (geometry.x + geometry.width) * scale)
+        bottom = max(bottom, (geometry.y + geometry.height) * scale)
+
+    if OPTION_SPANS_SCREEN[option]:
+        width = right - left
+        height = bottom - top
+
+    if width == 0 or height == 0:
+        return None
+    return (width, height)
+
+
+def get_render_dir():
+    return os.path.join(GLib.get_user_data_dir(), "cinnamon-slideshow", "renders")
+
+
+class WallpaperRenderer(object):
+    def __init__(self, render_dir=None, max_size=RENDER_DIR_SIZE):
+        if render_dir is None:
+            render_dir = get_render_dir()
+        self.render_dir = render_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def get_render_path(self, path, size):
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+
+        key = "%s\n%d\n%d\n%dx%d" % (path, info.st_mtime_ns, info.st_size, size[0], size[1])
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.render_dir, "%s-%s" % (hashlib.sha1(key.encode("utf-8")).hexdigest(), name))
+
+    def lookup(self, uri, size):
+        """ returns the uri of a render of uri made earlier, or None"""
+        path = Gio.File.new_for_uri(uri).get_path()
+        if path is None or size is None:
+            return None
+
+        render_path = self.get_render_path(path, size)
+        for extension in (".jpg", ".png"):
+            if render_path is not None and os.path.exists(render_path + extension):
+                # renders are trimmed by age, this one was just used
+                try:
+                    os.utime(render_path + extension)
+                except OSError:
+                    pass
+                return Gio.File.new_for_path(render_path + extension).get_uri()
+        return None
+
+    def _decode(self, path, size):
+        info, width, height = GdkPixbuf.Pixbuf.get_file_info(path)
+        if info is None:
+            return None
+
+        # Decode straight at the smallest size that still covers the target
+        scale = max(size[0] / width, size[1] / height)
+        if scale >= 1.0:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
+        else:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(path, max(1, round(width * scale)), max(1, round(height * scale)), False)
+
+        if pixbuf.get_option("orientation") in ROTATED_ORIENTATIONS:
+            # width and height trade places once it's turned, so it has to cover the target the other way round
+            rotated_scale = max(size[0] / height, size[1] / width)
+            if rotated_scale > scale and scale < 1.0:
+                if rotated_scale >= 1.0:
+                    pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
+                else:
+                    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(path, max(1, round(width * rotated_scale)), max(1, round(height * rotated_scale)), False)
+            scale = rotated_scale
+
+        if scale >= 1.0 and pixbuf.get_option("orientation") in (None, "1"):
+            # already small enough and the right way up, there's nothing to gain
+            return None
+
+        return pixbuf.apply_embedded_orientation()
+
+    def render(self, uri, size):
+        """ renders uri for a screen of the given size and returns the uri of the result. This can
+            take a while and is meant to run in a thread. If the picture doesn't need it (or can't be
+            rendered) the original uri is returned"""
+        path = Gio.File.new_for_uri(uri).get_path()
+        if path is None or size is None:
+            return uri
+
+        earlier_uri = self.lookup(uri, size)
+        if earlier_uri is not None:
+            return earlier_uri
+
+        render_path = self.get_render_path(path, size)
+        if render_path is None:
+            return uri
+
+        try:
+            pixbuf = self._decode(path, size)
+            if pixbuf is None:
+                return uri
+
+            os.makedirs(self.render_dir, exist_ok=True)
+            if pixbuf.get_has_alpha():
+                render_path = render_path + ".png"
+                pixbuf.savev(render_path + ".tmp", "png", [], [])
+            else:
+                render_path = render_path + ".jpg"
+                pixbuf.savev(render_path + ".tmp", "jpeg", ["quality"], [JPEG_QUALITY])
+            os.replace(render_path + ".tmp", render_path)
+        except (GLib.Error, OSError) as e:
+            print("Could not pre-render %s: %s" % (uri, e))
+            return uri
+
+        return Gio.File.new_for_path(render_path).get_uri()
+
+    def prefetch(self, uri, size, callback, keep=()):
+        """ renders uri in a thread, then trims the renders (leaving the uris in keep alone) and calls
+            callback(uri, rendered_uri) from the main loop"""
+        def run():
+            with self.lock:
+                rendered_uri = self.render(uri, size)
+                self.trim(set(keep) | {rendered_uri})
+            GLib.idle_add(callback, uri, rendered_uri)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def trim(self, keep=()):
+        """ deletes the oldest renders until they take no more than max_size"""
+        keep_paths = set()
+        for uri in keep:
+            if uri is not None:
+                keep_paths.add(Gio.File.new_for_uri(uri).get_path())
+
+        try:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.render_dir):
+                if entry.is_file():
+                    info = entry.stat()
+                    entries.append((info.st_mtime, entry.path, info.st_size))
+                    total += info.st_size
+        except OSError:
+            return
+
+        entries.sort()
+        for (mtime, path, size) in entries:
+            if total <= self.max_size:
+                break
+            if path in keep_paths:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
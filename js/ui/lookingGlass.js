@@ -444,6 +444,13 @@ const lgIFace =
                 <arg type="b" direction="out" name="success"/> \
                 <arg type="aa{ss}" direction="out" name="array of dictionary containing keys: timestamp, category, message"/> \
             </method> \
+            <method name="GetErrorStackSince"> \
+                <arg type="u" direction="in" name="sequence number of the first message to get"/> \
+                <arg type="b" direction="out" name="success"/> \
+                <arg type="s" direction="out" name="id of the log, it changes when Cinnamon is restarted"/> \
+                <arg type="u" direction="out" name="sequence number of the next message"/> \
+                <arg type="aa{ss}" direction="out" name="array of dictionary containing keys: timestamp, category, message"/> \
+            </method> \
             <method name="GetMemoryInfo"> \
                 <arg type="b" direction="out" name="success"/> \
                 <arg type="i" direction="out" name="time since last garbage collect"/> \
@@ -496,6 +503,9 @@ Melange.prototype = {
         this._results = [];
         this.rawResults = [];
 
+        this._logId = GLib.get_real_time().toString();
+        this._logUpdateId = 0;
+
         this._windowList = new WindowList();
         this._history = new History.HistoryManager({ gsettingsKey: HISTORY_KEY });
 
@@ -606,6 +616,13 @@ Melange.prototype = {
         return [true, Main._errorLogStack];
     },
 
+    // DBus function
+    GetErrorStackSince: function(since) {
+        // Messages are never taken off the stack, so their index is their sequence number
+        let stack = Main._errorLogStack;
+        return [true, this._logId, stack.length, stack.slice(Math.min(since, stack.length))];
+    },
+
     // DBus function
     GetMemoryInfo: function() {
         return null;
@@ -688,7 +705,15 @@ Melange.prototype = {
     },
 
     emitLogUpdate: function() {
-        this._dbusImpl.emit_signal('LogUpdate', null);
+        // Messages often come in bursts, they're announced once they're all in
+        if (this._logUpdateId)
+            return;
+
+        this._logUpdateId = GLib.idle_add(GLib.PRIORITY_DEFAULT_IDLE, Lang.bind(this, function() {
+            this._logUpdateId = 0;
+            this._dbusImpl.emit_signal('LogUpdate', null);
+            return false;
+        }));
     },
 
     emitWindowListUpdate: function() {
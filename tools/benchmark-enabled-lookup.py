@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+#
+# Compares counting the enabled instances of every installed applet by
+# reading and splitting enabled-applets for each one, as Spice_Harvester
+# used to do, with the parsed EnabledSpices model.
+#
+# The settings live in a memory backend, so the real configuration is
+# neither read nor changed.
+#
+# Usage: benchmark-enabled-lookup.py [ENTRIES] [INSTALLED]
+
+import os
+import sys
+import time
+
+os.environ["GSETTINGS_BACKEND"] = "memory"
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "../files/usr/share/cinnamon/cinnamon-settings/bin"))
+
+from gi.repository import Gio
+import Spices
+
+def old_get_enabled(settings, key, uuid):
+    enabled_count = 0
+    for item in settings.get_strv(key):
+        item = item.replace("!", "")
+        if uuid in item.split(":"):
+            enabled_count += 1
+    return enabled_count
+
+def run(name, func, uuids, rounds=10):
+    t1 = time.time()
+    for i in range(rounds):
+        for uuid in uuids:
+            func(uuid)
+    t2 = time.time()
+    print("%-20s %0.3f ms per page refresh" % (name, (t2 - t1) * 1000.0 / rounds))
+
+entries = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+installed = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+settings = Gio.Settings.new("org.cinnamon")
+settings.set_strv("enabled-applets", ["panel%d:%s:%d:applet%d@bench:%d" % (i % 4 + 1, ("left", "center", "right")[i % 3], i, i % installed, i)
+                                      for i in range(entries)])
+uuids = ["applet%d@bench" % i for i in range(installed)]
+
+enabled = Spices.EnabledSpices("applet", settings)
+assert all(enabled.get_count(uuid) == old_get_enabled(settings, "enabled-applets", uuid) for uuid in uuids)
+
+print("%d enabled entries, %d installed applets" % (entries, installed))
+run("get_strv and split", lambda uuid: old_get_enabled(settings, "enabled-applets", uuid), uuids)
+run("EnabledSpices", enabled.get_count, uuids)
+
+# What it costs to parse the key again after it changed
+t1 = time.time()
+enabled._load()
+t2 = time.time()
+print("%-20s %0.3f ms" % ("parsing the key", (t2 - t1) * 1000.0))
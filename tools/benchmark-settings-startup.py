@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+#
+# Measures how long cinnamon-settings takes to show its first frame, loading
+# every module up front (eager) and loading them from the module index (lazy).
+#
+# Usage: benchmark-settings-startup.py [MODULE] [RUNS]
+#
+# Run it from a graphical session. The first lazy run builds the index in
+# ~/.cache/cinnamon-settings if it is missing or out of date, so it is not
+# counted.
+
+import os
+import subprocess
+import sys
+import time
+
+SETTINGS = "/usr/share/cinnamon/cinnamon-settings/cinnamon-settings.py"
+
+def run(args, eager):
+    env = dict(os.environ, CINNAMON_SETTINGS_BENCHMARK="1")
+    if eager:
+        env["CINNAMON_SETTINGS_EAGER_LOAD"] = "1"
+
+    t1 = time.time()
+    subprocess.run([sys.executable, SETTINGS] + args, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.time() - t1
+
+def report(name, times):
+    times.sort()
+    print("%-6s min %7.1f ms   median %7.1f ms" % (name, times[0] * 1000.0, times[len(times) // 2] * 1000.0))
+
+args = sys.argv[1:2]
+runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+# Warm up the disk cache and (re)build the module index
+run(args, False)
+
+report("eager", [run(args, True) for i in range(runs)])
+report("lazy", [run(args, False) for i in range(runs)])
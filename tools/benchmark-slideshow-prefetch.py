@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+#
+# Measures what a slideshow switch costs when picture-uri points at the
+# original photo (the background has to decode all of it) and when it points
+# at a render made ahead of time by the slideshow's prefetch. The time taken
+# by the prefetch itself, which happens in a thread well before the switch,
+# is shown separately.
+#
+# A synthetic photo is made in a temporary directory, and the renders go
+# there too, so the real ones aren't touched.
+#
+# Usage: benchmark-slideshow-prefetch.py [WIDTH HEIGHT] [SCREEN_WIDTH SCREEN_HEIGHT] [RUNS]
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "../files/usr/share/cinnamon/cinnamon-slideshow"))
+
+import gi
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GdkPixbuf, Gio, GLib
+from prerender import WallpaperRenderer
+
+def make_photo(path, width, height):
+    # A gradient, so the jpeg isn't unrealistically small
+    row = bytearray()
+    for x in range(width):
+        row += bytes((x * 255 // width, 128, 255 - x * 255 // width))
+    pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(bytes(row) * height), GdkPixbuf.Colorspace.RGB,
+                                             False, 8, width, height, width * 3)
+    pixbuf.savev(path, "jpeg", ["quality"], ["92"])
+
+def decode(uri, runs):
+    path = Gio.File.new_for_uri(uri).get_path()
+    times = []
+    for i in range(runs):
+        t1 = time.time()
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
+        times.append(time.time() - t1)
+    times.sort()
+    size = pixbuf.get_rowstride() * pixbuf.get_height()
+    return (times[len(times) // 2], size, pixbuf.get_width(), pixbuf.get_height())
+
+def report(name, result):
+    (median, size, width, height) = result
+    print("%-18s %5dx%-5d %8.1f ms   %7.1f MiB decoded" % (name, width, height, median * 1000.0, size / (1024 * 1024)))
+
+args = [int(arg) for arg in sys.argv[1:]]
+width, height = args[0:2] if len(args) >= 2 else (6144, 4096)
+screen = tuple(args[2:4]) if len(args) >= 4 else (1920, 1080)
+runs = args[4] if len(args) >= 5 else 5
+
+with tempfile.TemporaryDirectory() as tmp:
+    photo = os.path.join(tmp, "photo.jpg")
+    make_photo(photo, width, height)
+    uri = Gio.File.new_for_path(photo).get_uri()
+
+    renderer = WallpaperRenderer(render_dir=os.path.join(tmp, "renders"))
+    t1 = time.time()
+    rendered = renderer.render(uri, screen)
+    prefetch_time = time.time() - t1
+
+    print("Switching to a %dx%d photo on a %dx%d screen, median of %d runs\n" % (width, height, screen[0], screen[1], runs))
+    report("without prefetch", decode(uri, runs))
+    report("with prefetch", decode(rendered, runs))
+    print("\nprefetch (in the background, before the switch): %0.1f ms" % (prefetch_time * 1000.0))
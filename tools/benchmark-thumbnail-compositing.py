@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+#
+# Compares the per-thumbnail cost of decorating wallpaper thumbnails
+# (rounded corners plus drop shadow) with fresh masks for every image, as
+# cs_backgrounds used to do, and with imtools.round_and_shadow().
+#
+# Usage: benchmark-thumbnail-compositing.py [COUNT]
+
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "../files/usr/share/cinnamon/cinnamon-settings/bin"))
+
+from PIL import Image
+import imtools
+
+# Thumbnails come in a handful of sizes (100x56 for 16:9, 100x75 for 4:3...)
+SIZES = [(100, 56), (100, 62), (100, 75), (75, 100), (100, 100)]
+
+def make_images(count):
+    images = []
+    for i in range(count):
+        size = random.choice(SIZES)
+        images.append(Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)))
+    return images
+
+def fresh_masks(img):
+    img = imtools.round_image(img, {}, False, None, 3, 255)
+    return imtools.drop_shadow(img, 4, 4, background_color=(255, 255, 255, 0),
+                               shadow_color=0x444444, border=8, shadow_blur=3,
+                               force_background_color=False, cache=None)
+
+def shared_masks(img):
+    return imtools.round_and_shadow(img, radius=3, opacity=255, horizontal_offset=4, vertical_offset=4,
+                                    shadow_color=0x444444, border=8, shadow_blur=3)
+
+def run(name, func, images):
+    imtools.SHARED_CACHE.clear()
+    t1 = time.time()
+    for img in images:
+        func(img)
+    t2 = time.time()
+    print("%-24s %0.3f ms per thumbnail" % (name, (t2 - t1) * 1000.0 / len(images)))
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+images = make_images(count)
+
+run("fresh masks", fresh_masks, images)
+if imtools.numpy is not None:
+    run("shared masks (numpy)", shared_masks, images)
+    numpy = imtools.numpy
+    imtools.numpy = None
+    run("shared masks (PIL only)", shared_masks, images)
+    imtools.numpy = numpy
+else:
+    run("shared masks (PIL only)", shared_masks, images)